@@ -22,12 +22,14 @@ from pecan import response
 from pecan import rest
 from pecan.secure import secure
 import six
+from wsme import api as wsme_api
 from wsme import types as wtypes
 import wsmeext.pecan as wsme_pecan
 
 from storyboard._i18n import _
 from storyboard.api.auth import authorization_checks as checks
 from storyboard.api.v1 import wmodels
+from storyboard.api.v1.worklists import apply_card_operations
 from storyboard.common import decorators
 from storyboard.common import exception as exc
 from storyboard.db.api import boards as boards_api
@@ -214,29 +216,110 @@ class PermissionsController(rest.RestController):
             raise exc.NotFound(_("Board %s not found") % board_id)
 
 
+class ChangesController(rest.RestController):
+    """Manages fetching incremental changes to a board."""
+
+    @decorators.db_exceptions
+    @secure(checks.guest)
+    @wsme_pecan.wsexpose(wmodels.BoardChanges, int, int)
+    def get(self, board_id, since=0):
+        """Get the lanes and cards of a board which changed after a given
+        version of the board.
+
+        Clients which already have a copy of the board can use this to
+        stay up to date without fetching the whole board again. If the
+        board hasn't changed since the given version, an empty response
+        with a 304 status is returned.
+
+        Example::
+
+          curl https://my.example.org/api/v1/boards/1/changes?since=12
+
+        :param board_id: The ID of the board.
+        :param since: The version of the board the client last saw.
+
+        """
+        board = boards_api.get(board_id)
+        if not boards_api.visible(board, request.current_user_id):
+            raise exc.NotFound(_("Board %s not found") % board_id)
+
+        if since is not None and board.version <= since:
+            return wsme_api.Response(None, status_code=304, return_type=None)
+
+        changes = wmodels.BoardChanges(board_id=board.id,
+                                       since=since,
+                                       version=board.version)
+        changes.resolve_changes(board, since or 0)
+        return changes
+
+
+class CardsController(rest.RestController):
+    """Manages batch operations on the cards in a board."""
+
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose([wmodels.WorklistItem], int,
+                         body=[wmodels.CardOperation])
+    def post(self, board_id, operations):
+        """Add, move and archive several cards across the lanes of a board.
+
+        The operations are applied in order in a single transaction, and a
+        single timeline event is created for each lane which changed. All
+        of the cards and lanes involved must belong to the board.
+
+        Example::
+
+          curl https://my.example.org/api/v1/boards/1/cards \\
+          -H 'Authorization: Bearer MY_ACCESS_TOKEN' \\
+          -H 'Content-Type: application/json;charset=UTF-8' \\
+          --data-binary '[{"action":"move","card_id":3,"list_id":5}]'
+
+        :param board_id: The ID of the board.
+        :param operations: A list of operations to apply.
+
+        """
+        board = boards_api.get(board_id)
+        if not boards_api.visible(board, request.current_user_id):
+            raise exc.NotFound(_("Board %s not found") % board_id)
+
+        lanes = [lane.list_id for lane in board.lanes]
+        return apply_card_operations(operations, allowed_lists=lanes)
+
+
 class BoardsController(rest.RestController):
     """Manages operations on boards."""
 
     @decorators.db_exceptions
     @secure(checks.guest)
-    @wsme_pecan.wsexpose(wmodels.Board, int)
-    def get_one(self, id):
+    @wsme_pecan.wsexpose(wmodels.Board, int, int, bool)
+    def get_one(self, id, card_limit=None, due_date_items=True):
         """Retrieve details about one board.
 
         :param id: The ID of the board.
+        :param card_limit: If given, only include the first `card_limit`
+                           cards of each lane. The rest can be fetched
+                           from the worklist items endpoint.
+        :param due_date_items: Whether to include the stories and tasks
+                               of each due date in the board. The count of
+                               cards for each due date is always included.
 
         """
         board = boards_api.get(id)
 
         user_id = request.current_user_id
-        story_cache = {story.id: story for story in stories_api.story_get_all(
-                       board_id=id, current_user=user_id)}
-        task_cache = {task.id: task for task in tasks_api.task_get_all(
-                      board_id=id, current_user=user_id)}
+        story_cache = {}
+        task_cache = {}
+        if card_limit is None:
+            story_cache = {story.id: story
+                           for story in stories_api.story_get_all(
+                               board_id=id, current_user=user_id)}
+            task_cache = {task.id: task for task in tasks_api.task_get_all(
+                          board_id=id, current_user=user_id)}
         if boards_api.visible(board, user_id):
             board_model = wmodels.Board.from_db_model(board)
-            board_model.resolve_lanes(board, story_cache, task_cache)
-            board_model.resolve_due_dates(board)
+            board_model.resolve_lanes(board, story_cache, task_cache,
+                                      card_limit=card_limit)
+            board_model.resolve_due_dates(board, due_date_items)
             board_model.resolve_permissions(board)
             return board_model
         else:
@@ -454,3 +537,5 @@ class BoardsController(rest.RestController):
                     True)
 
     permissions = PermissionsController()
+    changes = ChangesController()
+    cards = CardsController()
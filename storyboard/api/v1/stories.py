@@ -35,6 +35,7 @@ from storyboard.api.v1.timeline import CommentsController
 from storyboard.api.v1.timeline import NestedTimeLineEventsController
 from storyboard.api.v1 import validations
 from storyboard.api.v1 import wmodels
+from storyboard.api.v1.worklists import StoryCardsController
 from storyboard.common import decorators
 from storyboard.common import exception as exc
 from storyboard.db.api import stories as stories_api
@@ -358,6 +359,7 @@ class StoriesController(rest.RestController):
     events = NestedTimeLineEventsController()
     tasks = TasksNestedController()
     tags = TagsController()
+    cards = StoryCardsController()
 
     @decorators.db_exceptions
     @secure(checks.guest)
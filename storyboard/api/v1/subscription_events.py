@@ -29,10 +29,14 @@ from storyboard.api.v1 import base
 from storyboard.common import decorators
 from storyboard.db.api import subscription_events as subscription_events_api
 from storyboard.db.api import users as user_api
+from storyboard.notifications import stream
 
 
 CONF = cfg.CONF
 
+LATEST_DEFAULT_LIMIT = 20
+LATEST_MAX_LIMIT = 100
+
 
 class SubscriptionEvent(base.APIBase):
     """A model that describes a resource subscription.
@@ -64,6 +68,27 @@ class SubscriptionEvent(base.APIBase):
         )
 
 
+class SubscriptionEventCounter(base.APIBase):
+    """The number of subscription events a user hasn't read yet."""
+
+    user_id = int
+    """The owner of these subscription events."""
+
+    unread_count = int
+    """The number of events after the last one read."""
+
+    last_read_id = int
+    """The ID of the last event the user read."""
+
+    @classmethod
+    def sample(cls):
+        return cls(
+            user_id=1,
+            unread_count=3,
+            last_read_id=42
+        )
+
+
 class SubscriptionEventsController(rest.RestController):
     """REST controller for Subscriptions.
 
@@ -71,6 +96,23 @@ class SubscriptionEventsController(rest.RestController):
     subscriptionEvents.
     """
 
+    _custom_actions = {"latest": ["GET"],
+                       "poll": ["GET"],
+                       "unread": ["GET"],
+                       "read": ["PUT"]}
+
+    def _get_subscriber(self, subscriber_id):
+        """The user whose events to use: the current user, unless a
+        superuser asks for someone else's.
+        """
+        current_user = user_api.user_get(request.current_user_id)
+        if subscriber_id is None:
+            return current_user.id
+        if current_user.id != subscriber_id and \
+                not current_user.is_superuser:
+            abort(403, _("Permission Denied"))
+        return subscriber_id
+
     @decorators.db_exceptions
     @secure(checks.authenticated)
     @wsme_pecan.wsexpose(SubscriptionEvent, int)
@@ -144,6 +186,119 @@ class SubscriptionEventsController(rest.RestController):
 
         return [SubscriptionEvent.from_db_model(s) for s in subscriptions]
 
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose([SubscriptionEvent], int, int, wtypes.text, int)
+    def latest(self, limit=None, before=None, event_type=None,
+               subscriber_id=None):
+        """Retrieve a user's latest subscription events, newest first.
+
+        :param limit: The number of events to retrieve.
+        :param before: Only retrieve events older than this one. Pass the ID
+                       of the last event of a page to get the next page.
+        :param event_type: The type of event to search by.
+        :param subscriber_id: The user whose events to retrieve. Defaults to
+                              the current user.
+        """
+        subscriber_id = self._get_subscriber(subscriber_id)
+
+        # Boundary check on limit.
+        if limit is None:
+            limit = LATEST_DEFAULT_LIMIT
+        limit = max(0, min(limit, LATEST_MAX_LIMIT))
+
+        events = subscription_events_api.subscription_events_get_latest(
+            subscriber_id, limit=limit, before=before, event_type=event_type)
+
+        response.headers['X-Limit'] = str(limit)
+        if events:
+            response.headers['X-Marker'] = str(events[-1].id)
+
+        return [SubscriptionEvent.from_db_model(e) for e in events]
+
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose([SubscriptionEvent], int, int, int)
+    def poll(self, after=None, timeout=None, limit=None):
+        """Wait for the current user's new subscription events, and
+        retrieve them as soon as there are any. If there are none before
+        the timeout, an empty list is returned.
+
+        :param after: Only retrieve events newer than this one, usually the
+                      newest event the client has. Defaults to the user's
+                      newest event.
+        :param timeout: The longest time (in seconds) to wait. Capped by
+                        the stream_max_timeout option.
+        :param limit: The number of events to retrieve, oldest first.
+        """
+        user_id = request.current_user_id
+        hub = stream.get_hub()
+        max_timeout = CONF.notifications.stream_max_timeout
+        if timeout is None:
+            timeout = max_timeout
+        timeout = max(0, min(timeout, max_timeout))
+
+        # Boundary check on limit.
+        if limit is None:
+            limit = LATEST_DEFAULT_LIMIT
+        limit = max(0, min(limit, LATEST_MAX_LIMIT))
+
+        if after is None:
+            latest = subscription_events_api.subscription_events_get_latest(
+                user_id, limit=1)
+            after = latest[0].id if latest else 0
+
+        # Listen before looking, so events added in between aren't missed.
+        with hub.listen(user_id) as woken:
+            events = subscription_events_api.subscription_events_get_after(
+                user_id, after, limit=limit)
+            if not events and timeout:
+                # Give the database connection back while waiting, and
+                # look again in a new transaction, which sees new events.
+                request.session.close()
+                if woken.wait(timeout):
+                    events = subscription_events_api \
+                        .subscription_events_get_after(user_id, after,
+                                                       limit=limit)
+
+        response.headers['X-Limit'] = str(limit)
+        if events:
+            response.headers['X-Marker'] = str(events[-1].id)
+        else:
+            response.headers['X-Marker'] = str(after)
+
+        return [SubscriptionEvent.from_db_model(e) for e in events]
+
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose(SubscriptionEventCounter, int)
+    def unread(self, subscriber_id=None):
+        """Retrieve the number of subscription events a user hasn't read.
+
+        :param subscriber_id: The user whose events to count. Defaults to
+                              the current user.
+        """
+        subscriber_id = self._get_subscriber(subscriber_id)
+        counter = subscription_events_api.subscription_events_get_unread(
+            subscriber_id)
+        return SubscriptionEventCounter.from_db_model(counter)
+
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose(SubscriptionEventCounter, int, int)
+    def read(self, last_read_id=None, subscriber_id=None):
+        """Mark a user's subscription events as read.
+
+        :param last_read_id: The ID of the last event read. Defaults to the
+                             user's latest event.
+        :param subscriber_id: The user whose events to mark. Defaults to the
+                              current user.
+        """
+        subscriber_id = self._get_subscriber(subscriber_id)
+        counter = subscription_events_api.subscription_events_mark_read(
+            subscriber_id, last_read_id)
+        return SubscriptionEventCounter.from_db_model(counter)
+
     @decorators.db_exceptions
     @secure(checks.authenticated)
     @wsme_pecan.wsexpose(None, int, status_code=204)
@@ -653,13 +653,17 @@ class DueDate(base.APIBase):
             assignable=True)
 
     @nodoc
-    def resolve_count_in_board(self, due_date, board):
-        self.count = 0
-        for lane in board.lanes:
-            for card in worklists_api.get_visible_items(
-                lane.worklist, current_user=request.current_user_id):
-                if card.display_due_date == due_date.id:
-                    self.count += 1
+    def resolve_count_in_board(self, due_date, board, counts=None):
+        """Resolve the number of cards in the board showing this date.
+
+        :param counts: The result of `boards_api.get_due_date_counts`, to
+                       avoid querying it again for each date in a board.
+
+        """
+        if counts is None:
+            counts = boards_api.get_due_date_counts(
+                board, current_user=request.current_user_id)
+        self.count = counts.get(due_date.id, 0)
 
     @nodoc
     def resolve_items(self, due_date):
@@ -704,6 +708,9 @@ class WorklistItem(base.APIBase):
     display_due_date = int
     """The ID of the due date displayed on this item."""
 
+    version = int
+    """The version of the containing board when this item last changed."""
+
     resolved_due_date = DueDate
     """The Due Date displayed on this item."""
 
@@ -763,6 +770,76 @@ class WorklistItem(base.APIBase):
         return True
 
 
+class StoryCard(base.APIBase):
+    """Represents a card for a story or one of its tasks, along with the
+    worklist and board which contain it.
+
+    """
+    card = WorklistItem
+    """The card itself."""
+
+    worklist_id = int
+    """The ID of the worklist containing the card."""
+
+    worklist_title = wtypes.text
+    """The title of the worklist containing the card."""
+
+    board_id = int
+    """The ID of the board containing the card, if it is in a lane."""
+
+    board_title = wtypes.text
+    """The title of the board containing the card, if it is in a lane."""
+
+    @classmethod
+    def sample(cls):
+        return cls(
+            card=WorklistItem(
+                id=1,
+                list_id=10,
+                item_id=1,
+                item_type="story",
+                list_position=0,
+                archived=False),
+            worklist_id=10,
+            worklist_title="Todo",
+            board_id=2,
+            board_title="StoryBoard development")
+
+
+class CardOperation(base.APIBase):
+    """Represents a single operation in a batch of changes to the cards
+    in one or more worklists.
+
+    """
+    action = wtypes.Enum(wtypes.text, 'add', 'move', 'archive')
+    """The operation to apply, one of "add", "move" or "archive"."""
+
+    card_id = int
+    """The ID of the WorklistItem to move or archive."""
+
+    item_id = int
+    """The ID of the Task or Story to add."""
+
+    item_type = wtypes.text
+    """The type of the item to add, either "story" or "task"."""
+
+    list_id = int
+    """The ID of the Worklist to add or move the card to. When moving, this
+    defaults to the card's current worklist."""
+
+    list_position = int
+    """The position in the Worklist to put the card. Defaults to the end
+    of the list."""
+
+    @classmethod
+    def sample(cls):
+        return cls(
+            action="move",
+            card_id=1,
+            list_id=2,
+            list_position=0)
+
+
 class Worklist(base.APIBase):
     """Represents a worklist."""
 
@@ -815,20 +892,36 @@ class Worklist(base.APIBase):
             items=[])
 
     @nodoc
-    def resolve_items(self, worklist, story_cache={}, task_cache={}):
-        """Resolve the contents of this worklist."""
+    def resolve_items(self, worklist, story_cache={}, task_cache={},
+                      cursor=None, limit=None):
+        """Resolve the contents of this worklist.
+
+        If a `cursor` or `limit` is given, only that window of the items
+        is resolved. Automatic worklists have no ordering to page through,
+        so only the limit applies to them.
+
+        :returns: The window of database items which was fetched, including
+                  any which couldn't be resolved, when paginating a worklist
+                  which isn't automatic. None otherwise.
+
+        """
         self.items = []
         user_id = request.current_user_id
         if worklist.automatic:
-            self._resolve_automatic_items(worklist, user_id)
+            self._resolve_automatic_items(worklist, user_id, limit)
+        elif cursor is not None or limit is not None:
+            return self._resolve_item_window(
+                worklist, user_id, story_cache, task_cache, cursor, limit)
         else:
             self._resolve_set_items(worklist, user_id, story_cache, task_cache)
 
     @nodoc
-    def _resolve_automatic_items(self, worklist, user_id):
+    def _resolve_automatic_items(self, worklist, user_id, limit=None):
         items, stories, tasks = worklists_api.filter_items(worklist, user_id)
         story_cache = {story.id: story for story in stories}
         task_cache = {task.id: task for task in tasks}
+        if limit is not None:
+            items = items[:limit]
         for item in items:
             item_model = WorklistItem(**item)
             valid = item_model.resolve_item(item_model, story_cache,
@@ -851,6 +944,19 @@ class Worklist(base.APIBase):
             self.items.append(item_model)
         self.items.sort(key=lambda x: x.list_position)
 
+    @nodoc
+    def _resolve_item_window(self, worklist, user_id, story_cache, task_cache,
+                             cursor, limit):
+        items = list(worklists_api.get_visible_items(
+            worklist, current_user=user_id, cursor=cursor, limit=limit))
+        for item in items:
+            item_model = WorklistItem.from_db_model(item)
+            if not item_model.resolve_item(item, story_cache, task_cache):
+                continue
+            item_model.resolve_due_date(item)
+            self.items.append(item_model)
+        return items
+
     @nodoc
     def resolve_permissions(self, worklist):
         self.owners = worklists_api.get_owners(worklist)
@@ -880,6 +986,9 @@ class Lane(base.APIBase):
     position = int
     """The position of the lane in the board."""
 
+    version = int
+    """The version of the board when this lane last changed."""
+
     @classmethod
     def sample(cls):
         return cls(
@@ -900,14 +1009,15 @@ class Lane(base.APIBase):
                 items=[]))
 
     @nodoc
-    def resolve_list(self, lane, story_cache, task_cache, resolve_items=True):
+    def resolve_list(self, lane, story_cache, task_cache, resolve_items=True,
+                     card_limit=None):
         """Resolve the worklist which represents the lane."""
         self.worklist = Worklist.from_db_model(lane.worklist)
         self.worklist.resolve_permissions(lane.worklist)
         self.worklist.resolve_filters(lane.worklist)
         if resolve_items:
             self.worklist.resolve_items(
-                lane.worklist, story_cache, task_cache)
+                lane.worklist, story_cache, task_cache, limit=card_limit)
         else:
             items = worklists_api.get_visible_items(
                 lane.worklist, current_user=request.current_user_id)
@@ -939,6 +1049,10 @@ class Board(base.APIBase):
     archived = bool
     """A flag to identify whether or not the board has been archived."""
 
+    version = int
+    """A counter which is incremented whenever the lanes or cards of the
+    board change."""
+
     lanes = wtypes.ArrayType(Lane)
     """A list containing the representions of the lanes in this board."""
 
@@ -960,6 +1074,7 @@ class Board(base.APIBase):
             creator_id=1,
             private=False,
             archived=False,
+            version=3,
             lanes=[Lane(
                 id=1,
                 board_id=23,
@@ -982,26 +1097,41 @@ class Board(base.APIBase):
 
     @nodoc
     def resolve_lanes(self, board, story_cache={}, task_cache={},
-                      resolve_items=True):
-        """Resolve the lanes of the board."""
+                      resolve_items=True, card_limit=None):
+        """Resolve the lanes of the board.
+
+        If `card_limit` is given, only the first `card_limit` cards of
+        each lane are resolved.
+
+        """
         self.lanes = []
         for lane in board.lanes:
             lane_model = Lane.from_db_model(lane)
             lane_model.resolve_list(
-                lane, story_cache, task_cache, resolve_items)
+                lane, story_cache, task_cache, resolve_items, card_limit)
             self.lanes.append(lane_model)
         self.lanes.sort(key=lambda x: x.position)
 
     @nodoc
-    def resolve_due_dates(self, board):
+    def resolve_due_dates(self, board, resolve_items=True):
+        """Resolve the due dates used in the board.
+
+        The stories and tasks of each due date are only resolved if
+        `resolve_items` is True. The card counts are always included.
+
+        """
         self.due_dates = []
+        counts = boards_api.get_due_date_counts(
+            board, current_user=request.current_user_id)
         for due_date in board.due_dates:
             if due_dates_api.visible(due_date, request.current_user_id):
                 due_date_model = DueDate.from_db_model(due_date)
-                due_date_model.resolve_items(due_date)
+                if resolve_items:
+                    due_date_model.resolve_items(due_date)
                 due_date_model.resolve_permissions(
                     due_date, request.current_user_id)
-                due_date_model.resolve_count_in_board(due_date, board)
+                due_date_model.resolve_count_in_board(
+                    due_date, board, counts)
                 self.due_dates.append(due_date_model)
 
     @nodoc
@@ -1009,3 +1139,69 @@ class Board(base.APIBase):
         """Resolve the permissions groups of the board."""
         self.owners = boards_api.get_owners(board)
         self.users = boards_api.get_users(board)
+
+
+class BoardChanges(base.APIBase):
+    """Represents the lanes and cards of a board which have changed since
+    a given version of the board.
+
+    Cards which have been archived or moved to a different lane are
+    included, so a client can apply the changes to its copy of the board.
+
+    """
+
+    board_id = int
+    """The ID of the board."""
+
+    since = int
+    """The version of the board which the changes are relative to."""
+
+    version = int
+    """The current version of the board."""
+
+    lanes = wtypes.ArrayType(Lane)
+    """The lanes which have changed. The items of a lane are only included
+    if it is an automatic worklist."""
+
+    cards = wtypes.ArrayType(WorklistItem)
+    """The cards which have changed, in order of list and position."""
+
+    @classmethod
+    def sample(cls):
+        return cls(
+            board_id=1,
+            since=2,
+            version=3,
+            lanes=[],
+            cards=[WorklistItem(
+                id=1,
+                list_id=10,
+                item_id=1,
+                item_type="story",
+                list_position=0,
+                archived=False,
+                version=3)])
+
+    @nodoc
+    def resolve_changes(self, board, since):
+        """Resolve the lanes and cards which changed after `since`."""
+        lanes, cards = boards_api.get_changes(board, since)
+
+        self.lanes = []
+        for lane in lanes:
+            lane_model = Lane.from_db_model(lane)
+            lane_model.worklist = Worklist.from_db_model(lane.worklist)
+            lane_model.worklist.resolve_permissions(lane.worklist)
+            lane_model.worklist.resolve_filters(lane.worklist)
+            if lane.worklist.automatic:
+                lane_model.worklist.resolve_items(lane.worklist)
+            self.lanes.append(lane_model)
+        self.lanes.sort(key=lambda x: x.position)
+
+        self.cards = []
+        for card in cards:
+            card_model = WorklistItem.from_db_model(card)
+            if not card_model.resolve_item(card, {}, {}):
+                continue
+            card_model.resolve_due_date(card)
+            self.cards.append(card_model)
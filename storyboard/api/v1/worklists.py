@@ -35,7 +35,6 @@ from storyboard.db.api import tasks as tasks_api
 from storyboard.db.api import timeline_events as events_api
 from storyboard.db.api import users as users_api
 from storyboard.db.api import worklists as worklists_api
-from storyboard.db import models
 
 
 CONF = cfg.CONF
@@ -93,6 +92,110 @@ def post_timeline_events(original, updated):
             updated.archived)
 
 
+def set_cursor_headers(items, cursor, limit):
+    """Set the pagination headers for a window of worklist items.
+
+    :param items: The items fetched for the window, before any which can't
+                  be resolved are dropped, so that a full window always has
+                  a next cursor.
+
+    """
+    if cursor is not None:
+        response.headers['X-Cursor'] = str(cursor)
+    if limit is not None:
+        response.headers['X-Limit'] = str(limit)
+        if items and len(items) == limit:
+            response.headers['X-Next-Cursor'] = str(items[-1].list_position)
+
+
+def _get_card_item(card, cache):
+    key = (card.item_type, card.item_id)
+    if key not in cache:
+        item = None
+        if card.item_type == 'story':
+            item = stories_api.story_get(
+                card.item_id, current_user=request.current_user_id)
+        elif card.item_type == 'task':
+            item = tasks_api.task_get(
+                card.item_id, current_user=request.current_user_id)
+        cache[key] = item
+    return cache[key]
+
+
+def apply_card_operations(operations, allowed_lists=None):
+    """Apply a batch of card operations on behalf of the current user.
+
+    The user must be able to edit the contents of every worklist involved.
+    One worklist_contents_batch_changed timeline event is posted for each
+    affected worklist, rather than one per operation.
+
+    :param operations: A list of CardOperation objects.
+    :param allowed_lists: If given, the IDs of the only worklists which
+                          the operations may touch.
+    :returns: The affected cards, as WorklistItem objects.
+
+    """
+    user_id = request.current_user_id
+    operations = [operation.as_dict(omit_unset=True)
+                  for operation in operations]
+
+    # Check the user can edit every list involved before changing anything
+    list_ids = set()
+    for operation in operations:
+        if operation.get('card_id') is not None:
+            card = worklists_api.get_item_by_id(operation['card_id'])
+            if card is None:
+                raise exc.NotFound(_("Item %s seems to have been deleted, "
+                                     "try refreshing your page.")
+                                   % operation['card_id'])
+            list_ids.add(card.list_id)
+        if operation.get('list_id') is not None:
+            list_ids.add(operation['list_id'])
+    for list_id in list_ids:
+        if allowed_lists is not None and list_id not in allowed_lists:
+            raise exc.NotFound(_("Worklist %s not found") % list_id)
+        if not worklists_api.editable_contents(worklists_api.get(list_id),
+                                               user_id):
+            raise exc.NotFound(_("Worklist %s not found") % list_id)
+
+    results = worklists_api.apply_card_operations(
+        operations, current_user=user_id)
+
+    item_cache = {}
+    changes = {}
+    cards = []
+    for action, card, old in results:
+        item = _get_card_item(card, item_cache)
+        info = {
+            "worklist_id": card.list_id,
+            "item_id": card.item_id,
+            "item_title": item.title if item is not None else '',
+            "item_type": card.item_type
+        }
+        if action == 'add':
+            info['position'] = card.list_position
+            key, list_id = 'added', card.list_id
+        elif action == 'archive':
+            info['worklist_id'] = old['list_id']
+            key, list_id = 'removed', old['list_id']
+        else:
+            old_info = dict(info, worklist_id=old['list_id'],
+                            position=old['list_position'],
+                            due_date_id=card.display_due_date)
+            info['position'] = card.list_position
+            info = {"old": old_info, "new": info}
+            key, list_id = 'updated', card.list_id
+        changes.setdefault(list_id, {}).setdefault(key, []).append(info)
+        if card not in cards:
+            cards.append(card)
+
+    for list_id in sorted(changes):
+        events_api.worklist_contents_batch_changed_event(
+            list_id, user_id, **changes[list_id])
+
+    return [wmodels.WorklistItem.from_db_model(card) for card in cards]
+
+
 class PermissionsController(rest.RestController):
     """Manages operations on worklist permissions."""
 
@@ -369,17 +472,24 @@ class FilterSubcontroller(rest.RestController):
 class ItemsSubcontroller(rest.RestController):
     """Manages operations on the items in worklists."""
 
+    _custom_actions = {"batch": ["POST"]}
+
     @decorators.db_exceptions
     @secure(checks.guest)
-    @wsme_pecan.wsexpose([wmodels.WorklistItem], int)
-    def get(self, worklist_id):
+    @wsme_pecan.wsexpose([wmodels.WorklistItem], int, int, int)
+    def get(self, worklist_id, cursor=None, limit=None):
         """Get items inside a worklist.
 
         Example::
 
-          curl https://my.example.org/api/v1/worklists/49/items
+          curl https://my.example.org/api/v1/worklists/49/items?limit=20
 
         :param worklist_id: The ID of the worklist.
+        :param cursor: Only return items after this list position. When
+                       paginating, the cursor for the next page is given
+                       in the X-Next-Cursor response header.
+        :param limit: Maximum number of items to return. Archived items
+                      are left out when paginating.
 
         """
         worklist = worklists_api.get(worklist_id)
@@ -388,20 +498,24 @@ class ItemsSubcontroller(rest.RestController):
             raise exc.NotFound(_("Worklist %s not found") % worklist_id)
 
         if worklist.automatic:
-            return [wmodels.WorklistItem(**item)
-                    for item in worklists_api.filter_items(worklist)]
+            items, _stories, _tasks = worklists_api.filter_items(
+                worklist, user_id)
+            if limit is not None:
+                items = items[:limit]
+            return [wmodels.WorklistItem(**item) for item in items]
 
         if worklist.items is None:
             return []
 
-        worklist.items.order_by(models.WorklistItem.list_position)
-
         visible_items = worklists_api.get_visible_items(
-            worklist, current_user=request.current_user_id)
-        return [
+            worklist, current_user=request.current_user_id,
+            cursor=cursor, limit=limit)
+        items = [
             wmodels.WorklistItem.from_db_model(item)
             for item in visible_items
         ]
+        set_cursor_headers(items, cursor, limit)
+        return items
 
     @decorators.db_exceptions
     @secure(checks.authenticated)
@@ -450,6 +564,39 @@ class ItemsSubcontroller(rest.RestController):
 
         return wmodels.WorklistItem.from_db_model(card)
 
+    @decorators.db_exceptions
+    @secure(checks.authenticated)
+    @wsme_pecan.wsexpose([wmodels.WorklistItem], int,
+                         body=[wmodels.CardOperation])
+    def batch(self, id, operations):
+        """Add, move and archive several items in a worklist at once.
+
+        The operations are applied in order in a single transaction, and a
+        single timeline event is created for the worklist. Moving items to
+        other worklists is allowed, as long as the user can edit them.
+
+        Example::
+
+          curl https://my.example.org/api/v1/worklists/49/items/batch \\
+          -H 'Authorization: Bearer MY_ACCESS_TOKEN' \\
+          -H 'Content-Type: application/json;charset=UTF-8' \\
+          --data-binary '[{"action":"move","card_id":3,"list_position":0}]'
+
+        :param id: The ID of the worklist.
+        :param operations: A list of operations to apply.
+
+        """
+        if not worklists_api.editable_contents(worklists_api.get(id),
+                                               request.current_user_id):
+            raise exc.NotFound(_("Worklist %s not found") % id)
+
+        # Items are added to this worklist unless told otherwise
+        for operation in operations:
+            if operation.action == 'add' and not operation.list_id:
+                operation.list_id = id
+
+        return apply_card_operations(operations)
+
     @decorators.db_exceptions
     @secure(checks.authenticated)
     @wsme_pecan.wsexpose(wmodels.WorklistItem, int, int, int, int, int)
@@ -580,13 +727,49 @@ class ItemsSubcontroller(rest.RestController):
                                                    removed=removed)
 
 
+class StoryCardsController(rest.RestController):
+    """Manages looking up the cards for a story."""
+
+    @decorators.db_exceptions
+    @secure(checks.guest)
+    @wsme_pecan.wsexpose([wmodels.StoryCard], int)
+    def get_all(self, story_id):
+        """Get the cards for a story and its tasks, and the worklists and
+        boards containing them.
+
+        Example::
+
+          curl https://my.example.org/api/v1/stories/11/cards
+
+        :param story_id: The ID of the story.
+
+        """
+        user_id = request.current_user_id
+        story = stories_api.story_get_simple(story_id, current_user=user_id)
+        if story is None:
+            raise exc.NotFound(_("Story %s not found") % story_id)
+
+        cards = []
+        for card, worklist, lane in worklists_api.get_story_cards(
+                story_id, current_user=user_id):
+            story_card = wmodels.StoryCard(
+                card=wmodels.WorklistItem.from_db_model(card),
+                worklist_id=worklist.id,
+                worklist_title=worklist.title)
+            if lane is not None:
+                story_card.board_id = lane.board_id
+                story_card.board_title = lane.board.title
+            cards.append(story_card)
+        return cards
+
+
 class WorklistsController(rest.RestController):
     """Manages operations on worklists."""
 
     @decorators.db_exceptions
     @secure(checks.guest)
-    @wsme_pecan.wsexpose(wmodels.Worklist, int)
-    def get_one(self, worklist_id):
+    @wsme_pecan.wsexpose(wmodels.Worklist, int, int, int)
+    def get_one(self, worklist_id, cursor=None, limit=None):
         """Retrieve details about one worklist.
 
         Example::
@@ -594,20 +777,31 @@ class WorklistsController(rest.RestController):
           curl https://my.example.org/api/v1/worklists/27
 
         :param worklist_id: The ID of the worklist.
+        :param cursor: Only include items after this list position.
+        :param limit: Maximum number of items to include. Only the
+                      included items are resolved.
 
         """
         worklist = worklists_api.get(worklist_id)
 
         user_id = request.current_user_id
-        story_cache = {story.id: story for story in stories_api.story_get_all(
-                       worklist_id=worklist_id, current_user=user_id)}
-        task_cache = {task.id: task for task in tasks_api.task_get_all(
-                      worklist_id=worklist_id, current_user=user_id)}
+        paginate = cursor is not None or limit is not None
+        story_cache = {}
+        task_cache = {}
+        if not paginate:
+            story_cache = {story.id: story
+                           for story in stories_api.story_get_all(
+                               worklist_id=worklist_id, current_user=user_id)}
+            task_cache = {task.id: task for task in tasks_api.task_get_all(
+                          worklist_id=worklist_id, current_user=user_id)}
         if worklist and worklists_api.visible(worklist, user_id):
             worklist_model = wmodels.Worklist.from_db_model(worklist)
-            worklist_model.resolve_items(worklist, story_cache, task_cache)
+            window = worklist_model.resolve_items(
+                worklist, story_cache, task_cache, cursor=cursor, limit=limit)
             worklist_model.resolve_permissions(worklist)
             worklist_model.resolve_filters(worklist)
+            if paginate and not worklist.automatic:
+                set_cursor_headers(window, cursor, limit)
             return worklist_model
         else:
             raise exc.NotFound(_("Worklist %s not found") % worklist_id)
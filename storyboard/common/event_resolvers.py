@@ -109,6 +109,10 @@ def worklist_contents_changed(event):
     return event
 
 
+def worklist_contents_batch_changed(event):
+    return event
+
+
 def board_created(event):
     return event
 
@@ -147,6 +151,8 @@ resolvers = {
     event_types.WORKLIST_PERMISSIONS_CHANGED: worklist_permissions_changed,
     event_types.WORKLIST_FILTERS_CHANGED: worklist_filters_changed,
     event_types.WORKLIST_CONTENTS_CHANGED: worklist_contents_changed,
+    event_types.WORKLIST_CONTENTS_BATCH_CHANGED:
+        worklist_contents_batch_changed,
     event_types.BOARD_CREATED: board_created,
     event_types.BOARD_DETAILS_CHANGED: board_details_changed,
     event_types.BOARD_PERMISSION_CREATED: board_permission_created,
@@ -43,6 +43,10 @@ WORKLIST_PERMISSION_CREATED = "worklist_permission_created"
 WORKLIST_PERMISSIONS_CHANGED = "worklist_permissions_changed"
 WORKLIST_FILTERS_CHANGED = "worklist_filters_changed"
 WORKLIST_CONTENTS_CHANGED = "worklist_contents_changed"
+# WORKLIST_CONTENTS_BATCH_CHANGED is posted once for each worklist affected
+# by a batch of card operations. Its `added`, `removed` and `updated` fields
+# hold lists of changes, each shaped like those of WORKLIST_CONTENTS_CHANGED.
+WORKLIST_CONTENTS_BATCH_CHANGED = "worklist_contents_batch_changed"
 
 BOARD_CREATED = "board_created"
 # BOARD_DETAILS_CHANGED should occur when a value in any of the fields
@@ -72,6 +76,7 @@ ALL = (
     WORKLIST_PERMISSIONS_CHANGED,
     WORKLIST_FILTERS_CHANGED,
     WORKLIST_CONTENTS_CHANGED,
+    WORKLIST_CONTENTS_BATCH_CHANGED,
     BOARD_CREATED,
     BOARD_DETAILS_CHANGED,
     BOARD_PERMISSION_CREATED,
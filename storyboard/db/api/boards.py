@@ -13,7 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import six
+from sqlalchemy import func
 from sqlalchemy.orm import aliased, subqueryload
+from sqlalchemy.sql.expression import false
 from wsme.exc import ClientSideError
 
 from storyboard._i18n import _
@@ -152,17 +155,21 @@ def get_count(title=None, creator_id=None, user_id=None, project_id=None,
 
 
 def create(values):
+    values.pop('version', None)
     board = api_base.entity_create(models.Board, values)
     return board
 
 
 def update(id, values):
+    # The version is only ever changed by bump_version
+    values.pop('version', None)
     return api_base.entity_update(models.Board, id, values)
 
 
 def add_lane(board, lane_dict):
     # Make sure we're adding the lane to the right board
     lane_dict['board_id'] = board.id
+    lane_dict.pop('version', None)
 
     if lane_dict.get('list_id') is None:
         raise ClientSideError(_("A lane must have a worklist_id."))
@@ -170,7 +177,8 @@ def add_lane(board, lane_dict):
     if lane_dict.get('position') is None:
         lane_dict['position'] = len(board.lanes)
 
-    api_base.entity_create(models.BoardWorklist, lane_dict)
+    lane = api_base.entity_create(models.BoardWorklist, lane_dict)
+    bump_version(board.id, lane_ids=[lane.id])
 
     return board
 
@@ -178,11 +186,13 @@ def add_lane(board, lane_dict):
 def update_lane(board, lane, new_lane):
     # Make sure we aren't messing up the board ID
     new_lane['board_id'] = board.id
+    new_lane.pop('version', None)
 
     if new_lane.get('list_id') is None:
         raise ClientSideError(_("A lane must have a worklist_id."))
 
     api_base.entity_update(models.BoardWorklist, lane.id, new_lane)
+    bump_version(board.id, lane_ids=[lane.id])
 
 
 def get_from_lane(worklist):
@@ -193,23 +203,186 @@ def get_from_lane(worklist):
         return lane.board
 
 
+def _card_query(board, item_type, item_id, session):
+    board_lists = session.query(models.BoardWorklist.list_id).filter(
+        models.BoardWorklist.board_id == board.id)
+    return session.query(models.WorklistItem).filter(
+        models.WorklistItem.list_id.in_(board_lists),
+        models.WorklistItem.item_type == item_type,
+        models.WorklistItem.item_id == item_id)
+
+
 # FIXME: This assumes that boards only contain a task or story once, which
 #        is not actually enforced when creating a card.
 def get_card(board, item_type, item_id, archived=False):
-    for lane in board.lanes:
-        for card in lane.worklist.items:
-            if (card.item_type == item_type and
-                    card.item_id == item_id and
-                    card.archived == archived):
-                return card
+    session = api_base.get_session()
+    query = _card_query(board, item_type, item_id, session)
+    query = query.filter(models.WorklistItem.archived == archived)
+    return query.order_by(models.WorklistItem.id).first()
 
 
 def has_card(board, item_type, item_id):
-    for lane in board.lanes:
-        for item in lane.worklist.items:
-            if item.item_id == item_id and item.item_type == item_type:
-                return True
-    return False
+    session = api_base.get_session()
+    query = _card_query(board, item_type, item_id, session)
+    return session.query(query.exists()).scalar()
+
+
+def bump_version(board_id, lane_ids=None, card_ids=None, session=None):
+    """Increment the version of a board, and stamp the new version on any
+    of its lanes and cards which were changed.
+
+    The increment is done in the database rather than in Python, so that
+    concurrent changes to the same board always get distinct versions.
+
+    :param board_id: The ID of the board which changed.
+    :param lane_ids: IDs of BoardWorklist rows which changed.
+    :param card_ids: IDs of WorklistItem rows which changed.
+    :returns: The new version of the board.
+
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        session.query(models.Board).filter_by(id=board_id).update(
+            {'version': models.Board.version + 1},
+            synchronize_session='fetch')
+        version = session.query(models.Board.version).filter_by(
+            id=board_id).scalar()
+
+        if lane_ids:
+            session.query(models.BoardWorklist).filter(
+                models.BoardWorklist.board_id == board_id,
+                models.BoardWorklist.id.in_(lane_ids)).update(
+                    {'version': version}, synchronize_session='fetch')
+
+        if card_ids:
+            board_lists = session.query(models.BoardWorklist.list_id).filter(
+                models.BoardWorklist.board_id == board_id)
+            session.query(models.WorklistItem).filter(
+                models.WorklistItem.id.in_(card_ids),
+                models.WorklistItem.list_id.in_(board_lists)).update(
+                    {'version': version}, synchronize_session='fetch')
+
+    return version
+
+
+def touch_lists(list_ids, card_ids=None, lanes=False, session=None):
+    """Bump the version of every board which has one of the given worklists
+    as a lane.
+
+    :param list_ids: IDs of the worklists which changed.
+    :param card_ids: IDs of the cards in those worklists which changed.
+    :param lanes: Whether the lanes themselves changed (for example their
+                  position or filters), rather than just their contents.
+
+    """
+    if not session:
+        session = api_base.get_session()
+
+    list_ids = [list_id for list_id in set(list_ids) if list_id is not None]
+    if not list_ids:
+        return
+
+    with session.begin(subtransactions=True):
+        board_lanes = {}
+        query = session.query(
+            models.BoardWorklist.board_id, models.BoardWorklist.id).filter(
+                models.BoardWorklist.list_id.in_(list_ids))
+        for board_id, lane_id in query:
+            board_lanes.setdefault(board_id, []).append(lane_id)
+
+        for board_id, lane_ids in six.iteritems(board_lanes):
+            bump_version(board_id,
+                         lane_ids=lane_ids if lanes else None,
+                         card_ids=card_ids,
+                         session=session)
+
+
+def touch_cards(item_type, item_id, session=None):
+    """Bump the version of any boards containing a card for the given
+    story or task, so that clients pick up the changed item.
+
+    :param item_type: Either 'story' or 'task'.
+    :param item_id: The ID of the story or task which changed.
+
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        cards = session.query(
+            models.WorklistItem.id, models.WorklistItem.list_id).filter_by(
+                item_type=item_type, item_id=item_id).all()
+        if cards:
+            touch_lists([card.list_id for card in cards],
+                        card_ids=[card.id for card in cards],
+                        session=session)
+
+
+def get_changes(board, since):
+    """Return the lanes and cards of a board which changed after a given
+    version, including cards which have since been archived.
+
+    :param board: The board to look at.
+    :param since: The last board version the client has seen.
+    :returns: A tuple of (lanes, cards).
+
+    """
+    session = api_base.get_session()
+    lanes = session.query(models.BoardWorklist).filter(
+        models.BoardWorklist.board_id == board.id,
+        models.BoardWorklist.version > since).all()
+
+    board_lists = session.query(models.BoardWorklist.list_id).filter(
+        models.BoardWorklist.board_id == board.id)
+    cards = session.query(models.WorklistItem).filter(
+        models.WorklistItem.list_id.in_(board_lists),
+        models.WorklistItem.version > since).order_by(
+            models.WorklistItem.list_id,
+            models.WorklistItem.list_position).all()
+
+    return lanes, cards
+
+
+def get_due_date_counts(board, current_user=None):
+    """Count the visible, unarchived cards in a board for each due date.
+
+    This is done with a single grouped query rather than by resolving
+    every card in every lane.
+
+    :param board: The board to count cards in.
+    :param current_user: The ID of the user requesting the counts.
+    :returns: A dict mapping due date IDs to card counts.
+
+    """
+    session = api_base.get_session()
+    board_lists = session.query(models.BoardWorklist.list_id).filter(
+        models.BoardWorklist.board_id == board.id)
+    cards = session.query(
+        models.WorklistItem.id.label('id'),
+        models.WorklistItem.display_due_date.label('due_date_id')).filter(
+            models.WorklistItem.list_id.in_(board_lists),
+            models.WorklistItem.archived == false(),
+            models.WorklistItem.display_due_date.isnot(None))
+
+    stories = cards.filter(models.WorklistItem.item_type == 'story')
+    stories = stories.join(
+        (models.Story, models.Story.id == models.WorklistItem.item_id))
+    stories = api_base.filter_private_stories(stories, current_user)
+
+    tasks = cards.filter(models.WorklistItem.item_type == 'task')
+    tasks = tasks.join(
+        (models.Task, models.Task.id == models.WorklistItem.item_id))
+    tasks = tasks.outerjoin(models.Story)
+    tasks = api_base.filter_private_stories(tasks, current_user)
+
+    # The nested unions lose the column labels, so use their positions.
+    card_id, due_date_id = stories.union(tasks).subquery().c
+    query = session.query(due_date_id, func.count(card_id))
+    query = query.group_by(due_date_id)
+
+    return dict(query.all())
 
 
 def get_owners(board):
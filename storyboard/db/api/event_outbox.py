@@ -0,0 +1,49 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from storyboard.db.api import base as api_base
+from storyboard.db import models
+
+
+def outbox_add(topic, payload, session=None):
+    """Store an event to be published once the current transaction commits.
+
+    :param topic: The topic to publish the event on.
+    :param payload: The event payload, which will be JSON encoded.
+    """
+    return api_base.entity_create(models.EventOutbox, {
+        'topic': topic,
+        'payload': json.dumps(payload, ensure_ascii=False)
+    }, session=session)
+
+
+def outbox_get_batch(limit, session=None):
+    """Get the oldest events waiting to be published, in the order they
+    were stored.
+    """
+    query = api_base.model_query(models.EventOutbox, session)
+    return query.order_by(models.EventOutbox.id).limit(limit).all()
+
+
+def outbox_delete(entry_ids, session=None):
+    """Remove events which have been published."""
+    if not entry_ids:
+        return
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        query = api_base.model_query(models.EventOutbox, session)
+        query.filter(models.EventOutbox.id.in_(entry_ids)) \
+            .delete(synchronize_session=False)
@@ -0,0 +1,130 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+
+import pytz
+from sqlalchemy import or_
+
+from storyboard.db.api import base as api_base
+from storyboard.db import models
+
+
+def supports_skip_locked(session):
+    """Whether the database can skip rows locked by other consumers. Where
+    it can't, consumers may briefly wait on each other, but the claim
+    itself is still safe.
+    """
+    dialect = session.get_bind().dialect
+    version = dialect.server_version_info or ()
+    if dialect.name == 'postgresql':
+        return version >= (9, 5)
+    if dialect.name == 'mysql':
+        return not getattr(dialect, '_is_mariadb', False) and \
+            version >= (8, 0, 1)
+    return False
+
+
+def queue_add(topic, payload, session=None):
+    """Queue an event. In a request, it is only visible to consumers once
+    the request's transaction commits.
+
+    :param topic: The topic the event is published on.
+    :param payload: The event payload, which will be JSON encoded.
+    """
+    return api_base.entity_create(models.EventQueue, {
+        'topic': topic,
+        'payload': json.dumps(payload, ensure_ascii=False)
+    }, session=session)
+
+
+def queue_claim(consumer, topics, limit, lease, session=None):
+    """Claim the oldest unclaimed events on some topics, in the order they
+    were queued. Claims by consumers which have stopped expire after the
+    lease, and the events are handed out again.
+
+    :param consumer: A unique name for the consumer.
+    :param topics: The topics the consumer handles.
+    :param limit: The maximum number of events to claim.
+    :param lease: How long (in seconds) the consumer has to acknowledge
+                  the events.
+    :return: The claimed events.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    now = datetime.datetime.now(pytz.utc)
+    claimable = or_(models.EventQueue.claimed_until.is_(None),
+                    models.EventQueue.claimed_until < now)
+
+    with session.begin(subtransactions=True):
+        query = session.query(models.EventQueue.id) \
+            .filter(models.EventQueue.topic.in_(topics)) \
+            .filter(claimable) \
+            .order_by(models.EventQueue.id) \
+            .limit(limit)
+        if supports_skip_locked(session):
+            query = query.with_for_update(skip_locked=True)
+        entry_ids = [entry_id for (entry_id,) in query]
+        if not entry_ids:
+            return []
+
+        # Check the claim again, in case another consumer took some of the
+        # events since they were selected.
+        session.query(models.EventQueue) \
+            .filter(models.EventQueue.id.in_(entry_ids)) \
+            .filter(claimable) \
+            .update({'claimed_by': consumer,
+                     'claimed_until': now + datetime.timedelta(
+                         seconds=lease)},
+                    synchronize_session=False)
+
+    query = api_base.model_query(models.EventQueue, session)
+    return query.filter(models.EventQueue.id.in_(entry_ids)) \
+        .filter(models.EventQueue.claimed_by == consumer) \
+        .order_by(models.EventQueue.id).all()
+
+
+def queue_ack(consumer, entry_id, multiple=False, session=None):
+    """Remove events a consumer has handled.
+
+    :param consumer: The consumer which claimed the events.
+    :param entry_id: The ID of the handled event.
+    :param multiple: Also remove every earlier event claimed by the
+                     consumer.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        query = api_base.model_query(models.EventQueue, session) \
+            .filter(models.EventQueue.claimed_by == consumer)
+        if multiple:
+            query = query.filter(models.EventQueue.id <= entry_id)
+        else:
+            query = query.filter(models.EventQueue.id == entry_id)
+        query.delete(synchronize_session=False)
+
+
+def queue_release(consumer, session=None):
+    """Hand the events a consumer claimed but didn't handle back to the
+    queue.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        api_base.model_query(models.EventQueue, session) \
+            .filter(models.EventQueue.claimed_by == consumer) \
+            .update({'claimed_by': None, 'claimed_until': None},
+                    synchronize_session=False)
@@ -0,0 +1,167 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+
+import pytz
+from sqlalchemy import or_
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import event_queue
+from storyboard.db import models
+
+
+def _now():
+    return datetime.datetime.now(pytz.utc)
+
+
+def mail_add(sender, recipients, domain, message, session=None):
+    """Spool an email. In a transaction, it is only visible to the sender
+    once the transaction commits.
+
+    :param sender: The envelope sender.
+    :param recipients: A list of envelope recipients.
+    :param domain: The domain of the recipients, for rate limiting.
+    :param message: The whole message, as a string.
+    """
+    return api_base.entity_create(models.MailQueue, {
+        'sender': sender,
+        'recipients': json.dumps(recipients),
+        'domain': domain,
+        'message': message,
+        'attempts': 0
+    }, session=session)
+
+
+def mail_claim(consumer, limit, lease, session=None):
+    """Claim the oldest emails which are due to be sent. Claims by senders
+    which have stopped expire after the lease.
+
+    :param consumer: A unique name for the sender.
+    :param limit: The maximum number of emails to claim.
+    :param lease: How long (in seconds) the sender has to deliver them.
+    :return: The claimed emails.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    now = _now()
+    claimable = [models.MailQueue.dead_at.is_(None),
+                 or_(models.MailQueue.next_attempt_at.is_(None),
+                     models.MailQueue.next_attempt_at <= now),
+                 or_(models.MailQueue.claimed_until.is_(None),
+                     models.MailQueue.claimed_until < now)]
+
+    with session.begin(subtransactions=True):
+        query = session.query(models.MailQueue.id) \
+            .filter(*claimable) \
+            .order_by(models.MailQueue.id) \
+            .limit(limit)
+        if event_queue.supports_skip_locked(session):
+            query = query.with_for_update(skip_locked=True)
+        entry_ids = [entry_id for (entry_id,) in query]
+        if not entry_ids:
+            return []
+
+        # Check the claim again, in case another sender took some of the
+        # emails since they were selected.
+        session.query(models.MailQueue) \
+            .filter(models.MailQueue.id.in_(entry_ids)) \
+            .filter(*claimable) \
+            .update({'claimed_by': consumer,
+                     'claimed_until': now + datetime.timedelta(
+                         seconds=lease)},
+                    synchronize_session=False)
+
+    query = api_base.model_query(models.MailQueue, session)
+    return query.filter(models.MailQueue.id.in_(entry_ids)) \
+        .filter(models.MailQueue.claimed_by == consumer) \
+        .order_by(models.MailQueue.id).all()
+
+
+def _update_claimed(consumer, entry_id, values, session=None):
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        api_base.model_query(models.MailQueue, session) \
+            .filter(models.MailQueue.id == entry_id) \
+            .filter(models.MailQueue.claimed_by == consumer) \
+            .update(values, synchronize_session=False)
+
+
+def mail_delete(consumer, entry_id, session=None):
+    """Remove an email which has been delivered."""
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        api_base.model_query(models.MailQueue, session) \
+            .filter(models.MailQueue.id == entry_id) \
+            .filter(models.MailQueue.claimed_by == consumer) \
+            .delete(synchronize_session=False)
+
+
+def mail_defer(consumer, entry_id, delay, session=None):
+    """Hand an email back to be sent later, without counting an attempt.
+
+    :param delay: How long (in seconds) to wait before sending it.
+    """
+    _update_claimed(consumer, entry_id, {
+        'claimed_by': None,
+        'claimed_until': None,
+        'next_attempt_at': _now() + datetime.timedelta(seconds=delay)
+    }, session=session)
+
+
+def mail_retry(consumer, entry_id, attempts, delay, error, session=None):
+    """Record a failed attempt to send an email, and when to try again.
+
+    :param attempts: The number of attempts made so far.
+    :param delay: How long (in seconds) to wait before trying again.
+    :param error: A description of the failure.
+    """
+    _update_claimed(consumer, entry_id, {
+        'claimed_by': None,
+        'claimed_until': None,
+        'attempts': attempts,
+        'next_attempt_at': _now() + datetime.timedelta(seconds=delay),
+        'last_error': error
+    }, session=session)
+
+
+def mail_dead_letter(consumer, entry_id, attempts, error, session=None):
+    """Give up on an email. It's kept, so that it can be looked into and
+    queued again by clearing dead_at.
+    """
+    _update_claimed(consumer, entry_id, {
+        'claimed_by': None,
+        'claimed_until': None,
+        'attempts': attempts,
+        'last_error': error,
+        'dead_at': _now()
+    }, session=session)
+
+
+def mail_release(consumer, session=None):
+    """Hand the emails a sender claimed but didn't deliver back to the
+    queue.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        api_base.model_query(models.MailQueue, session) \
+            .filter(models.MailQueue.claimed_by == consumer) \
+            .update({'claimed_by': None, 'claimed_until': None},
+                    synchronize_session=False)
@@ -21,6 +21,7 @@ from sqlalchemy.orm import subqueryload
 from storyboard._i18n import _
 from storyboard.common import exception as exc
 from storyboard.db.api import base as api_base
+from storyboard.db.api import boards as boards_api
 from storyboard.db.api import projects as projects_api
 from storyboard.db.api import story_tags
 from storyboard.db.api import story_types
@@ -258,6 +259,9 @@ def story_update(story_id, values, current_user=None):
     for project_id in project_ids:
         projects_api.project_update_updated_at(project_id)
 
+    # Make sure boards showing this story report the change
+    boards_api.touch_cards('story', story_id)
+
     return story_get(story_id, current_user=current_user)
 
 
@@ -284,6 +288,7 @@ def story_update_updated_at(story_id):
                                {'name': "Story", 'id': story_id})
         story.updated_at = datetime.datetime.now(tz=pytz.utc)
         session.add(story)
+        boards_api.touch_cards('story', story_id, session=session)
     session.expunge(story)
 
 
@@ -335,6 +340,7 @@ def story_remove_tag(story_id, tag_name, current_user=None):
         story.tags.remove(tag)
         story.updated_at = datetime.datetime.now(tz=pytz.utc)
         session.add(story)
+        boards_api.touch_cards('story', story_id, session=session)
     session.expunge(story)
 
 
@@ -13,6 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+
+from oslo_db import exception as db_exc
+import six
+from sqlalchemy import func
+from sqlalchemy import or_
+from sqlalchemy import select
+
 from storyboard.db.api import base as api_base
 from storyboard.db import models
 
@@ -31,8 +39,51 @@ def subscription_events_get_count(**kwargs):
     return api_base.entity_get_count(models.SubscriptionEvents, **kwargs)
 
 
+def subscription_events_get_latest(subscriber_id, limit=None, before=None,
+                                   event_type=None):
+    """Get a user's latest subscription events, newest first. Pages are
+    found by event ID, so they cost the same however far back they are.
+
+    :param subscriber_id: The ID of the user.
+    :param limit: The number of events to get.
+    :param before: Only get events with IDs below this one, usually the last
+                   event of the previous page.
+    :param event_type: Only get events of this type.
+    """
+    query = api_base.model_query(models.SubscriptionEvents) \
+        .filter(models.SubscriptionEvents.subscriber_id == subscriber_id)
+    if before is not None:
+        query = query.filter(models.SubscriptionEvents.id < before)
+    if event_type:
+        query = query.filter(models.SubscriptionEvents.event_type ==
+                             event_type)
+    query = query.order_by(models.SubscriptionEvents.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def subscription_events_get_after(subscriber_id, after, limit=None):
+    """Get a user's subscription events newer than a given one, oldest
+    first.
+
+    :param subscriber_id: The ID of the user.
+    :param after: The ID of the newest event the user already has.
+    :param limit: The number of events to get.
+    """
+    query = api_base.model_query(models.SubscriptionEvents) \
+        .filter(models.SubscriptionEvents.subscriber_id == subscriber_id) \
+        .filter(models.SubscriptionEvents.id > after) \
+        .order_by(models.SubscriptionEvents.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
 def subscription_events_create(values):
-    return api_base.entity_create(models.SubscriptionEvents, values)
+    event = api_base.entity_create(models.SubscriptionEvents, values)
+    subscription_events_count_new({event.subscriber_id: 1})
+    return event
 
 
 def subscription_events_delete(subscription_event_id):
@@ -41,3 +92,118 @@ def subscription_events_delete(subscription_event_id):
     if subscription:
         api_base.entity_hard_delete(models.SubscriptionEvents,
                                     subscription_event_id)
+        subscription_events_recount([subscription.subscriber_id])
+
+
+def _count_unread(user_id, last_read_id, session):
+    query = session.query(func.count(models.SubscriptionEvents.id)) \
+        .filter(models.SubscriptionEvents.subscriber_id == user_id)
+    if last_read_id is not None:
+        query = query.filter(models.SubscriptionEvents.id > last_read_id)
+    return query.scalar()
+
+
+def _get_counter(user_id, session):
+    query = api_base.model_query(models.SubscriptionEventCounter, session) \
+        .filter_by(user_id=user_id)
+    counter = query.first()
+    if counter is not None:
+        return counter
+
+    # Users get a counter the first time they ask for it, so that adding
+    # events never needs to create one.
+    try:
+        with session.begin(subtransactions=True):
+            counter = models.SubscriptionEventCounter(
+                user_id=user_id,
+                unread_count=_count_unread(user_id, None, session))
+            session.add(counter)
+    except db_exc.DBDuplicateEntry:
+        # Another request created it first.
+        counter = query.first()
+    return counter
+
+
+def subscription_events_get_unread(user_id, session=None):
+    """Get a user's unread subscription event counter.
+
+    :return: The user's SubscriptionEventCounter.
+    """
+    if not session:
+        session = api_base.get_session()
+    return _get_counter(user_id, session)
+
+
+def subscription_events_mark_read(user_id, last_read_id=None, session=None):
+    """Mark a user's subscription events as read, up to and including the
+    given event. Events can't be marked unread again.
+
+    :param last_read_id: The ID of the last event read, or None to mark all
+                         of them read.
+    :return: The user's SubscriptionEventCounter.
+    """
+    if not session:
+        session = api_base.get_session()
+
+    with session.begin(subtransactions=True):
+        counter = _get_counter(user_id, session)
+        if last_read_id is None:
+            last_read_id = session.query(
+                func.max(models.SubscriptionEvents.id)) \
+                .filter(models.SubscriptionEvents.subscriber_id == user_id) \
+                .scalar()
+        if last_read_id is not None and \
+                (counter.last_read_id is None or
+                 last_read_id > counter.last_read_id):
+            counter.last_read_id = last_read_id
+            counter.unread_count = _count_unread(user_id, last_read_id,
+                                                 session)
+    return counter
+
+
+def subscription_events_count_new(counts, session=None):
+    """Add new subscription events to their subscribers' unread counters.
+
+    :param counts: A dict of the number of new events, keyed by subscriber
+                   ID.
+    """
+    if not counts:
+        return
+    if not session:
+        session = api_base.get_session()
+
+    # Usually everybody gets the same number of events, so this is a
+    # single update.
+    by_count = collections.defaultdict(list)
+    for user_id, count in six.iteritems(counts):
+        by_count[count].append(user_id)
+
+    counter = models.SubscriptionEventCounter
+    with session.begin(subtransactions=True):
+        for count, user_ids in six.iteritems(by_count):
+            session.query(counter) \
+                .filter(counter.user_id.in_(user_ids)) \
+                .update({'unread_count': counter.unread_count + count},
+                        synchronize_session=False)
+
+
+def subscription_events_recount(user_ids, session=None):
+    """Count the unread subscription events of some users again, after some
+    of their events have been removed.
+    """
+    if not user_ids:
+        return
+    if not session:
+        session = api_base.get_session()
+
+    events = models.SubscriptionEvents
+    counter = models.SubscriptionEventCounter
+    unread = select([func.count(events.id)]) \
+        .where(events.subscriber_id == counter.user_id) \
+        .where(or_(counter.last_read_id.is_(None),
+                   events.id > counter.last_read_id)) \
+        .as_scalar()
+    with session.begin(subtransactions=True):
+        session.query(counter) \
+            .filter(counter.user_id.in_(list(user_ids))) \
+            .update({'unread_count': unread}, synchronize_session=False)
@@ -13,8 +13,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from sqlalchemy import distinct
-from sqlalchemy.orm import subqueryload
+import collections
+import threading
+import time
+
+from sqlalchemy import exists
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import true
+from sqlalchemy import union
 
 from storyboard.db.api import base as api_base
 from storyboard.db.api import stories as stories_api
@@ -78,7 +85,83 @@ def subscription_delete(subscription_id):
         api_base.entity_hard_delete(models.Subscription, subscription_id)
 
 
-def subscription_get_all_subscriber_ids(resource, resource_id, session=None):
+class ProjectGroupCache(object):
+    """The project groups each project belongs to. The whole mapping is
+    loaded at once, and kept until it is invalidated or expires.
+    """
+
+    def __init__(self, ttl):
+        """Create an empty cache.
+
+        :param ttl: How long (in seconds) to keep the mapping.
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._groups = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        """Forget the mapping, after a project group has changed."""
+        with self._lock:
+            self._groups = None
+
+    def groups(self, project_ids, session=None):
+        """The IDs of the groups containing any of the given projects."""
+        with self._lock:
+            if self._groups is None or \
+                    time.time() - self._loaded_at > self._ttl:
+                mapping = api_base.model_query(
+                    models.project_group_mapping, session=session)
+                groups = collections.defaultdict(set)
+                for project_id, group_id in mapping.all():
+                    groups[project_id].add(group_id)
+                self._groups = groups
+                self._loaded_at = time.time()
+
+            return set(group_id for project_id in project_ids
+                       for group_id in self._groups.get(project_id, ()))
+
+
+def _subscribed(target_type, target_ids, visible=None):
+    """Select the users subscribed to any of the given resources.
+
+    :param target_type: The type of the resources.
+    :param target_ids: A list of IDs, or a query selecting them.
+    :param visible: A condition the users must meet.
+    """
+    subscriptions = models.Subscription.__table__
+    query = select([subscriptions.c.user_id]) \
+        .where(subscriptions.c.target_type == target_type) \
+        .where(subscriptions.c.target_id.in_(target_ids))
+    if visible is not None:
+        query = query.where(visible)
+    return query
+
+
+def _visible_to(story_ids):
+    """A condition which users must meet to be told about a set of stories.
+    Everyone can see a public story, but only the users given permission
+    can see a private one.
+    """
+    stories = models.Story.__table__
+    permissions = models.story_permissions
+    users = models.user_permissions
+
+    private = select([stories.c.id]) \
+        .where(stories.c.id.in_(story_ids)) \
+        .where(stories.c.private == true())
+    allowed = select([users.c.user_id]) \
+        .select_from(users.join(
+            permissions,
+            permissions.c.permission_id == users.c.permission_id)) \
+        .where(permissions.c.story_id.in_(story_ids))
+
+    user_id = models.Subscription.__table__.c.user_id
+    return or_(~exists(private), user_id.in_(allowed))
+
+
+def subscription_get_all_subscriber_ids(resource, resource_id, session=None,
+                                        project_groups=None):
     '''Test subscription discovery. The tested algorithm is as follows:
 
     If you're subscribed to a project_group, you will be notified about
@@ -93,18 +176,16 @@ def subscription_get_all_subscriber_ids(resource, resource_id, session=None):
     If you are subscribed to a story, you will be notified about changes to
     that story and its tasks.
 
+    The subscribers are found with a single query, which is a union of the
+    subscriptions to each type of affected resource.
+
     :param resource: The name of the resource.
     :param resource_id: The ID of the resource.
+    :param session: The session to use.
+    :param project_groups: A ProjectGroupCache, to find the project groups
+                           with instead of querying project_group_mapping.
     :return: A list of user id's.
     '''
-    affected = {
-        'project_group': set(),
-        'project': set(),
-        'story': set(),
-        'task': set(),
-        'worklist': set()
-    }
-
     # If we accidentally pass a timeline_event, we're actually going to treat
     # it as a story.
     if resource == 'timeline_event':
@@ -124,79 +205,59 @@ def subscription_get_all_subscriber_ids(resource, resource_id, session=None):
             return set()
 
     # Sanity check exit.
-    if resource not in affected.keys():
+    if resource not in SUPPORTED_TYPES:
         return set()
 
-    # Make sure the requested resource is going to be handled.
-    affected[resource].add(resource_id)
-
-    users = None
+    tasks = models.Task.__table__
+    mapping = models.project_group_mapping
 
-    # Resolve either from story->task or from task->story, so the root
-    # resource id remains pristine.
+    visible = None
+    project_ids = None
     if resource == 'story':
-        # If the story is private, make a whitelist of users to notify.
-        story = api_base.model_query(models.Story, session) \
-            .options(subqueryload(models.Story.permissions)) \
-            .filter_by(id=resource_id).first()
-
-        if story.private:
-            users = [user.id for user in story.permissions[0].users]
-
-        # Get this story's tasks
-        query = api_base.model_query(models.Task.id, session=session) \
-            .filter(models.Task.story_id.in_(affected['story']))
-
-        affected['task'] = affected['task'] \
-            .union(r for (r,) in query.all())
+        # A story affects its tasks, and their projects.
+        visible = _visible_to([resource_id])
+        task_ids = select([tasks.c.id]).where(tasks.c.story_id == resource_id)
+        project_ids = select([tasks.c.project_id]) \
+            .where(tasks.c.story_id == resource_id)
+        queries = [_subscribed('story', [resource_id], visible),
+                   _subscribed('task', task_ids, visible),
+                   _subscribed('project', project_ids, visible)]
     elif resource == 'task':
-        # Get this tasks's story
-        query = api_base.model_query(models.Task.story_id, session=session) \
-            .filter(models.Task.id == resource_id)
-
-        affected['story'].add(query.first().story_id)
-
-        story = api_base.model_query(models.Story, session) \
-            .options(subqueryload(models.Story.permissions)) \
-            .filter_by(id=query.first().story_id).first()
-
-        if story.private:
-            users = [user.id for user in story.permissions[0].users]
-
-    # If there are tasks, there will also be projects.
-    if affected['task']:
-        # Get all the tasks's projects
-        query = api_base.model_query(distinct(models.Task.project_id),
-                                     session=session) \
-            .filter(models.Task.id.in_(affected['task']))
-
-        affected['project'] = affected['project'] \
-            .union(r for (r,) in query.all())
-
-    # If there are projects, there will also be project groups.
-    if affected['project']:
-        # Get all the projects' groups.
-        query = api_base.model_query(
-            distinct(models.project_group_mapping.c.project_group_id),
-            session=session) \
-            .filter(models.project_group_mapping.c.project_id
-                    .in_(affected['project']))
-
-        affected['project_group'] = affected['project_group'] \
-            .union(r for (r,) in query.all())
-
-    # Load all subscribers.
-    subscribers = set()
-    for affected_type in affected:
-        query = api_base.model_query(distinct(
-            models.Subscription.user_id), session=session) \
-            .filter(models.Subscription.target_type == affected_type) \
-            .filter(models.Subscription.target_id.in_(affected[affected_type]))
-
-        if users is not None:
-            query = query.filter(models.Subscription.user_id.in_(users))
-
-        results = query.all()
-        subscribers = subscribers.union(r for (r,) in results)
-
-    return subscribers
+        # A task affects its story, but not the story's other tasks.
+        story_ids = select([tasks.c.story_id]) \
+            .where(tasks.c.id == resource_id)
+        visible = _visible_to(story_ids)
+        project_ids = select([tasks.c.project_id]) \
+            .where(tasks.c.id == resource_id)
+        queries = [_subscribed('task', [resource_id], visible),
+                   _subscribed('story', story_ids, visible),
+                   _subscribed('project', project_ids, visible)]
+    else:
+        queries = [_subscribed(resource, [resource_id])]
+
+    if not session:
+        session = api_base.get_session()
+
+    if resource == 'project':
+        if project_groups is not None:
+            group_ids = list(project_groups.groups([resource_id], session))
+        else:
+            group_ids = select([mapping.c.project_group_id]) \
+                .where(mapping.c.project_id == resource_id)
+        queries.append(_subscribed('project_group', group_ids))
+    elif project_ids is not None and project_groups is None:
+        group_ids = select([mapping.c.project_group_id]) \
+            .where(mapping.c.project_id.in_(project_ids))
+        queries.append(_subscribed('project_group', group_ids, visible))
+    elif project_ids is not None:
+        # Fetch the affected projects first, so that only the subscriptions
+        # to their groups in the cached mapping are looked up.
+        group_ids = project_groups.groups(
+            [project_id for (project_id,) in session.execute(project_ids)],
+            session)
+        if group_ids:
+            queries.append(_subscribed('project_group', sorted(group_ids),
+                                       visible))
+
+    rows = session.execute(union(*queries)).fetchall()
+    return set(user_id for (user_id,) in rows)
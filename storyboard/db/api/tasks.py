@@ -14,6 +14,7 @@
 # limitations under the License.
 
 from storyboard.db.api import base as api_base
+from storyboard.db.api import boards as boards_api
 from storyboard.db.api import projects as projects_api
 from storyboard.db.api import stories as stories_api
 from storyboard.db import models
@@ -75,6 +76,7 @@ def task_create(values):
 def task_update(task_id, values):
     task = api_base.entity_update(models.Task, task_id, values)
     if task:
+        boards_api.touch_cards('task', task_id)
         stories_api.story_update_updated_at(task.story_id)
         # Update updated_at in projects when task is updated
         projects_api.project_update_updated_at(task.project_id)
@@ -85,6 +87,7 @@ def task_delete(task_id):
     task = task_get(task_id)
 
     if task:
+        boards_api.touch_cards('task', task_id)
         stories_api.story_update_updated_at(task.story_id)
         # Update updated_at in projects when task/story is deleted
         projects_api.project_update_updated_at(task.project_id)
@@ -18,6 +18,12 @@ import json
 from oslo_config import cfg
 from pecan import request
 from pecan import response
+from sqlalchemy import and_
+from sqlalchemy import exists
+from sqlalchemy import false
+from sqlalchemy import or_
+from sqlalchemy import select
+from sqlalchemy import true
 from wsme.rest.json import tojson
 
 from storyboard.api.v1.wmodels import TimeLineEvent
@@ -125,31 +131,169 @@ def event_create(values):
     return new_event
 
 
+def _worklist_contents_items(event):
+    """The items mentioned by a worklist contents event."""
+    event_info = json.loads(event.event_info)
+
+    # Events for batches of card operations contain lists of changes
+    # rather than a single change.
+    batch = event.event_type == event_types.WORKLIST_CONTENTS_BATCH_CHANGED
+    infos = []
+    for key in ('updated', 'removed', 'added'):
+        changes = event_info.get(key)
+        if changes is None:
+            continue
+        if not batch:
+            changes = [changes]
+        if key == 'updated':
+            changes = [change['old'] for change in changes]
+        infos.extend(changes)
+    return infos
+
+
 def is_visible(event, user_id, session=None):
     if event is None:
         return False
     if 'worklist_contents' in event.event_type:
-        event_info = json.loads(event.event_info)
-        if event_info['updated'] is not None:
-            info = event_info['updated']['old']
-        elif event_info['removed'] is not None:
-            info = event_info['removed']
-        elif event_info['added'] is not None:
-            info = event_info['added']
-        else:
-            return True
+        # The event is only visible if all of the items it mentions are.
+        for info in _worklist_contents_items(event):
+            if info.get('item_type') == 'story':
+                story = stories_api.story_get_simple(
+                    info['item_id'], current_user=user_id, session=session)
+                if story is None:
+                    return False
+            elif info.get('item_type') == 'task':
+                task = tasks_api.task_get(
+                    info['item_id'], current_user=user_id, session=session)
+                if task is None:
+                    return False
+    return True
+
 
+def _users_with_permission(permissions_table, column, resource_id):
+    """Select the users given one of a resource's permissions directly."""
+    users = models.user_permissions
+    return select([users.c.user_id]) \
+        .select_from(permissions_table.join(
+            users,
+            users.c.permission_id == permissions_table.c.permission_id)) \
+        .where(column == resource_id)
+
+
+def _story_visible(story_id):
+    """A condition on User.id, which users meet if they can see a story."""
+    permissions = models.story_permissions
+    teams = models.team_permissions
+    members = models.team_membership
+
+    private = select([models.Story.id]) \
+        .where(models.Story.id == story_id) \
+        .where(models.Story.private == true())
+    team_users = select([members.c.user_id]) \
+        .select_from(permissions.join(
+            teams, teams.c.permission_id == permissions.c.permission_id)
+            .join(members, members.c.team_id == teams.c.team_id)) \
+        .where(permissions.c.story_id == story_id)
+
+    return or_(~exists(private),
+               models.User.id.in_(_users_with_permission(
+                   permissions, permissions.c.story_id, story_id)),
+               models.User.id.in_(team_users))
+
+
+def _board_visible(board_id):
+    """A condition on User.id, which users meet if they can see a board."""
+    permissions = models.board_permissions
+    return or_(models.Board.private == false(),
+               models.User.id.in_(_users_with_permission(
+                   permissions, permissions.c.board_id, board_id)))
+
+
+def _worklist_visible(worklist_id):
+    """A condition on User.id, which users meet if they can see a worklist.
+    Lanes in a board can be seen by anyone who can see one of the boards.
+    """
+    permissions = models.worklist_permissions
+    lanes = models.BoardWorklist
+
+    private = select([models.Worklist.id]) \
+        .where(models.Worklist.id == worklist_id) \
+        .where(models.Worklist.private == true())
+    in_board = select([lanes.id]).where(lanes.list_id == worklist_id)
+    visible_lane = select([lanes.id]) \
+        .select_from(lanes.__table__.join(
+            models.Board.__table__, models.Board.id == lanes.board_id)) \
+        .where(lanes.list_id == worklist_id) \
+        .where(_board_visible(models.Board.id))
+
+    return or_(
+        and_(~exists(in_board),
+             or_(~exists(private),
+                 models.User.id.in_(_users_with_permission(
+                     permissions, permissions.c.worklist_id,
+                     worklist_id)))),
+        exists(visible_lane))
+
+
+def _worklist_contents_story_ids(event, session=None):
+    """The stories of the items a worklist contents event mentions, or None
+    if any of them no longer exist.
+    """
+    story_ids = set()
+    task_ids = set()
+    for info in _worklist_contents_items(event):
         if info.get('item_type') == 'story':
-            story = stories_api.story_get_simple(
-                info['item_id'], current_user=user_id, session=session)
-            if story is None:
-                return False
+            story_ids.add(info['item_id'])
         elif info.get('item_type') == 'task':
-            task = tasks_api.task_get(
-                info['item_id'], current_user=user_id, session=session)
-            if task is None:
-                return False
-    return True
+            task_ids.add(info['item_id'])
+
+    if task_ids:
+        tasks = api_base.model_query(models.Task, session) \
+            .filter(models.Task.id.in_(task_ids)) \
+            .with_entities(models.Task.id, models.Task.story_id).all()
+        if len(tasks) < len(task_ids):
+            return None
+        story_ids.update(story_id for (_id, story_id) in tasks)
+
+    if story_ids:
+        found = api_base.model_query(models.Story.id, session) \
+            .filter(models.Story.id.in_(story_ids)).count()
+        if found < len(story_ids):
+            return None
+    return story_ids
+
+
+def event_visible_users(event, user_ids, session=None):
+    """Query for the users who can see an event. This gives the same answer
+    as using event_get and is_visible for each user, with a single query.
+
+    :param event: The TimeLineEvent.
+    :param user_ids: The IDs of the users to check.
+    :return: A query for the IDs of the users who can see the event, which
+             can be filtered further.
+    """
+    query = api_base.model_query(models.User.id, session) \
+        .filter(models.User.id.in_(user_ids))
+
+    if event.story_id is not None:
+        query = query.filter(_story_visible(event.story_id))
+    if event.worklist_id is not None:
+        query = query.filter(_worklist_visible(event.worklist_id))
+    if event.board_id is not None:
+        board = select([models.Board.id]) \
+            .where(models.Board.id == event.board_id)
+        query = query.filter(or_(~exists(board),
+                                 exists(board.where(_board_visible(
+                                     event.board_id)))))
+
+    if event.event_type and 'worklist_contents' in event.event_type:
+        story_ids = _worklist_contents_story_ids(event, session)
+        if story_ids is None:
+            return query.filter(false())
+        for story_id in story_ids:
+            query = query.filter(_story_visible(story_id))
+
+    return query
 
 
 def story_created_event(story_id, author_id, story_title):
@@ -411,6 +555,24 @@ def worklist_contents_changed_event(worklist_id, author_id, added=None,
     })
 
 
+def worklist_contents_batch_changed_event(worklist_id, author_id, added=None,
+                                          removed=None, updated=None):
+    event_info = {
+        "worklist_id": worklist_id,
+        "author_id": author_id,
+        "added": added or [],
+        "removed": removed or [],
+        "updated": updated or []
+    }
+
+    return event_create({
+        "worklist_id": worklist_id,
+        "author_id": author_id,
+        "event_type": event_types.WORKLIST_CONTENTS_BATCH_CHANGED,
+        "event_info": json.dumps(event_info)
+    })
+
+
 def board_created_event(board_id, author_id, board_title, board_description):
     event_info = {
         "board_id": board_id,
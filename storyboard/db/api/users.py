@@ -13,11 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import threading
+import time
+
+from oslo_config import cfg
+
 from storyboard.db.api import base as api_base
 from storyboard.db import models
+from storyboard.notifications.conf import NOTIFICATION_OPTS
 from storyboard.plugin.user_preferences import PREFERENCE_DEFAULTS
 
 
+CONF = cfg.CONF
+
+# The number of users whose preferences are loaded in each query.
+PREFERENCE_BATCH_SIZE = 500
+
+PREFERENCE_STORE = None
+
+
 def user_get(user_id, filter_non_public=False, session=None):
     entity = api_base.entity_get(models.User, user_id,
                                  filter_non_public=filter_non_public,
@@ -87,13 +101,93 @@ def user_update(user_id, values, filter_non_public=False):
                                   filter_non_public=filter_non_public)
 
 
-def user_get_preferences(user_id):
-    preferences = api_base.entity_get_all(models.UserPreference,
-                                          user_id=user_id)
+def user_load_preferences(user_ids, session=None):
+    """Load the preferences of several users, with their values cast, in as
+    few queries as possible.
+
+    :param user_ids: The IDs of the users.
+    :return: A dict of each user's preferences, keyed by user ID.
+    """
+    user_ids = list(set(user_ids))
+    preferences = dict((user_id, {}) for user_id in user_ids)
+    for start in range(0, len(user_ids), PREFERENCE_BATCH_SIZE):
+        query = api_base.model_query(models.UserPreference, session) \
+            .filter(models.UserPreference.user_id.in_(
+                user_ids[start:start + PREFERENCE_BATCH_SIZE]))
+        for pref in query:
+            preferences[pref.user_id][pref.key] = pref.cast_value
+    return preferences
+
+
+class PreferenceStore(object):
+    """Users' preferences, with their values cast. The preferences of all
+    the users asked for at once are loaded together, and kept until they
+    are invalidated or expire.
+    """
+
+    def __init__(self, ttl):
+        """Create an empty store.
+
+        :param ttl: How long (in seconds) to keep each user's preferences.
+                    0 loads them every time.
+        """
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._preferences = {}
+
+    def invalidate(self, user_id=None):
+        """Forget a user's preferences, after they have changed.
+
+        :param user_id: The ID of the user, or None to forget everybody's.
+        """
+        with self._lock:
+            if user_id is None:
+                self._preferences.clear()
+            else:
+                self._preferences.pop(user_id, None)
+
+    def load(self, user_ids, session=None):
+        """Get the preferences of several users. Don't change them.
+
+        :param user_ids: The IDs of the users.
+        :return: A dict of each user's preferences, keyed by user ID.
+        """
+        now = time.time()
+        found = {}
+        with self._lock:
+            for user_id in user_ids:
+                cached = self._preferences.get(user_id)
+                if cached is not None and now - cached[0] < self._ttl:
+                    found[user_id] = cached[1]
+
+        missing = [user_id for user_id in user_ids if user_id not in found]
+        if missing:
+            loaded = user_load_preferences(missing, session=session)
+            found.update(loaded)
+            if self._ttl:
+                with self._lock:
+                    for user_id, preferences in loaded.items():
+                        self._preferences[user_id] = (now, preferences)
+        return found
+
+    def get(self, user_id, name, session=None):
+        """Get one of a user's preferences, or None if it isn't set."""
+        return self.load([user_id], session=session)[user_id].get(name)
+
+
+def get_preference_store():
+    """The PreferenceStore shared by this process."""
+    global PREFERENCE_STORE
+
+    if PREFERENCE_STORE is None:
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        PREFERENCE_STORE = PreferenceStore(
+            CONF.notifications.preference_cache_ttl)
+    return PREFERENCE_STORE
 
-    pref_dict = dict()
-    for pref in preferences:
-        pref_dict[pref.key] = pref.cast_value
+
+def user_get_preferences(user_id):
+    pref_dict = dict(get_preference_store().load([user_id])[user_id])
 
     # Decorate with plugin defaults.
     for key in PREFERENCE_DEFAULTS:
@@ -143,4 +237,5 @@ def user_update_preferences(user_id, preferences):
                 'cast_value': value
             })
 
+    get_preference_store().invalidate(user_id)
     return user_get_preferences(user_id)
@@ -14,7 +14,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import aliased
+from sqlalchemy.sql.expression import false
 from wsme.exc import ClientSideError
 
 from storyboard._i18n import _
@@ -180,19 +182,39 @@ def get_count(title=None, creator_id=None, project_id=None, board_id=None,
     return query.count()
 
 
-def get_visible_items(worklist, current_user=None):
-    stories = worklist.items.filter(models.WorklistItem.item_type == 'story')
+def get_visible_items(worklist, current_user=None, cursor=None, limit=None):
+    """Return the items in a worklist which the current user can see.
+
+    If a `cursor` or `limit` is given, only a window of the items is
+    returned, ordered by position. The window starts after the item at
+    position `cursor`, and archived items are left out since they all
+    share the same position.
+
+    """
+    items = worklist.items
+    paginate = cursor is not None or limit is not None
+    if paginate:
+        items = items.filter(models.WorklistItem.archived == false())
+        if cursor is not None:
+            items = items.filter(models.WorklistItem.list_position > cursor)
+
+    stories = items.filter(models.WorklistItem.item_type == 'story')
     stories = stories.join(
         (models.Story, models.Story.id == models.WorklistItem.item_id))
     stories = api_base.filter_private_stories(stories, current_user)
 
-    tasks = worklist.items.filter(models.WorklistItem.item_type == 'task')
+    tasks = items.filter(models.WorklistItem.item_type == 'task')
     tasks = tasks.join(
         (models.Task, models.Task.id == models.WorklistItem.item_id))
     tasks = tasks.outerjoin(models.Story)
     tasks = api_base.filter_private_stories(tasks, current_user)
 
-    return stories.union(tasks)
+    query = stories.union(tasks)
+    if paginate:
+        query = query.order_by(models.WorklistItem.list_position)
+        if limit is not None:
+            query = query.limit(limit)
+    return query
 
 
 def create(values):
@@ -200,14 +222,70 @@ def create(values):
 
 
 def update(worklist_id, values):
-    return api_base.entity_update(models.Worklist, worklist_id, values)
+    worklist = api_base.entity_update(models.Worklist, worklist_id, values)
+    boards.touch_lists([worklist_id], lanes=True)
+    return worklist
 
 
 def has_item(worklist, item_type, item_id):
-    for item in worklist.items:
-        if item.item_type == item_type and item.item_id == item_id:
-            return True
-    return False
+    session = api_base.get_session()
+    query = session.query(models.WorklistItem.id).filter_by(
+        list_id=worklist.id, item_type=item_type, item_id=item_id)
+    return session.query(query.exists()).scalar()
+
+
+def get_story_cards(story_id, current_user=None):
+    """Find the cards for a story and its tasks in visible worklists.
+
+    :param story_id: The ID of the story.
+    :param current_user: The ID of the user requesting the cards.
+    :returns: A list of (card, worklist, lane) tuples, where lane is the
+              BoardWorklist placing the worklist in a board, or None.
+
+    """
+    session = api_base.get_session()
+    story_tasks = session.query(models.Task.id).filter(
+        models.Task.story_id == story_id)
+
+    query = session.query(models.WorklistItem, models.Worklist).join(
+        (models.Worklist, models.Worklist.id == models.WorklistItem.list_id))
+    query = query.filter(
+        models.WorklistItem.archived == false(),
+        models.Worklist.archived == false(),
+        or_(
+            and_(models.WorklistItem.item_type == 'story',
+                 models.WorklistItem.item_id == story_id),
+            and_(models.WorklistItem.item_type == 'task',
+                 models.WorklistItem.item_id.in_(story_tasks))
+        ))
+    query = api_base.filter_private_worklists(
+        query, current_user, hide_lanes=False)
+    results = query.all()
+
+    lanes = {}
+    list_ids = set(worklist.id for _card, worklist in results)
+    if list_ids:
+        lanes = {lane.list_id: lane for lane in session.query(
+            models.BoardWorklist).filter(
+                models.BoardWorklist.list_id.in_(list_ids))}
+
+    return [(card, worklist, lanes.get(worklist.id))
+            for card, worklist in results]
+
+
+def _get_item(item_type, item_id, current_user=None):
+    if item_type == 'story':
+        item = stories_api.story_get(item_id, current_user=current_user)
+    elif item_type == 'task':
+        item = tasks_api.task_get(item_id, current_user=current_user)
+    else:
+        raise ClientSideError(_("An item in a worklist must be either a "
+                                "story or a task"))
+
+    if item is None:
+        raise exc.NotFound(_("%(type)s %(id)s not found") %
+                           {'type': item_type, 'id': item_id})
+    return item
 
 
 def add_item(worklist_id, item_id, item_type, list_position,
@@ -243,17 +321,7 @@ def add_item(worklist_id, item_id, item_type, list_position,
             return archived
 
     # Create a new card
-    if item_type == 'story':
-        item = stories_api.story_get(item_id, current_user=current_user)
-    elif item_type == 'task':
-        item = tasks_api.task_get(item_id, current_user=current_user)
-    else:
-        raise ClientSideError(_("An item in a worklist must be either a "
-                                "story or a task"))
-
-    if item is None:
-        raise exc.NotFound(_("%(type)s %(id)s not found") %
-                           {'type': item_type, 'id': item_id})
+    _get_item(item_type, item_id, current_user)
 
     card_dict = {
         'list_id': worklist_id,
@@ -321,6 +389,10 @@ def move_item(item_id, new_pos, new_list_id=None):
         if new_list_id is not None:
             new_list = _worklist_get(new_list_id)
 
+        # Keep track of every card whose position changes, so that boards
+        # containing these lists can report them as changed.
+        moved = [modified_card.id]
+
         # First decrement the position of everything past the old position
         # by one, "removing" the item from the list. Archived items are
         # ignored, since they are not really part of the ordering and are
@@ -328,6 +400,7 @@ def move_item(item_id, new_pos, new_list_id=None):
         for card in old_list.items:
             if card.list_position > old_pos and not card.archived:
                 card.list_position -= 1
+                moved.append(card.id)
 
         # Next, increment the position of everything at or past the new
         # position by one, creating "space" for the item. Archived items are
@@ -335,15 +408,125 @@ def move_item(item_id, new_pos, new_list_id=None):
         for card in new_list.items:
             if card.list_position >= new_pos and not card.archived:
                 card.list_position += 1
+                moved.append(card.id)
 
         # Finally, update the position of the item we're actually moving
         modified_card.list_position = new_pos
         if new_list_id is not None:
             modified_card.list_id = new_list_id
 
+        session.flush()
+        boards.touch_lists([old_list.id, new_list.id], card_ids=moved,
+                           session=session)
+
     return modified_card
 
 
+def apply_card_operations(operations, current_user=None):
+    """Add, move and archive a batch of cards in a single transaction.
+
+    Rather than reshuffling a list for every operation like `move_item`
+    does, the new order of each affected list is worked out in memory and
+    then each card whose position changed is written exactly once.
+
+    :param operations: A list of dicts, each with an `action` of "add",
+                       "move" or "archive". Adding needs `list_id`,
+                       `item_type` and `item_id`; moving needs `card_id`
+                       and optionally `list_id`; archiving needs `card_id`.
+                       Adds and moves take an optional `list_position`,
+                       defaulting to the end of the list.
+    :returns: A list of (action, card, old) tuples in the order the
+              operations were given, where `old` is a dict of the card's
+              `list_id` and `list_position` before the batch, or None for
+              newly created cards.
+
+    """
+    session = api_base.get_session()
+    lists = {}
+    results = []
+
+    def get_list(list_id):
+        if list_id not in lists:
+            if _worklist_get(list_id, session=session) is None:
+                raise exc.NotFound(_("Worklist %s not found") % list_id)
+            lists[list_id] = session.query(models.WorklistItem).filter_by(
+                list_id=list_id, archived=False).order_by(
+                    models.WorklistItem.list_position).all()
+        return lists[list_id]
+
+    with session.begin(subtransactions=True), session.no_autoflush:
+        for operation in operations:
+            action = operation.get('action')
+            list_id = operation.get('list_id')
+
+            if action == 'add':
+                # Load the target list before touching any cards, so that
+                # the card isn't picked up from the database as well.
+                cards = get_list(list_id)
+                worklist = _worklist_get(list_id, session=session)
+                item_type = operation.get('item_type')
+                item_id = operation.get('item_id')
+                old = None
+
+                card = get_item_by_item_id(
+                    worklist, item_type, item_id, archived=True)
+                if card is None and is_lane(worklist):
+                    board = boards.get_from_lane(worklist)
+                    card = boards.get_card(
+                        board, item_type, item_id, archived=True)
+                if card is None:
+                    _get_item(item_type, item_id, current_user)
+                    card = models.WorklistItem(list_id=list_id,
+                                               item_id=item_id,
+                                               item_type=item_type,
+                                               list_position=99999,
+                                               archived=False)
+                    session.add(card)
+                    session.flush()
+            elif action in ('move', 'archive'):
+                card = get_item_by_id(operation.get('card_id'), session)
+                if card is None:
+                    raise exc.NotFound(_("Item %s not found")
+                                       % operation.get('card_id'))
+                old = {'list_id': card.list_id,
+                       'list_position': card.list_position}
+                if not card.archived:
+                    get_list(card.list_id).remove(card)
+                if list_id is None:
+                    list_id = card.list_id
+                cards = get_list(list_id)
+            else:
+                raise ClientSideError(_("Unknown card operation: %s")
+                                      % action)
+
+            if action == 'archive':
+                card.archived = True
+                card.list_position = 99999
+            else:
+                position = operation.get('list_position')
+                if position is None or position > len(cards):
+                    position = len(cards)
+                cards.insert(max(position, 0), card)
+                card.list_id = list_id
+                card.archived = False
+
+            results.append((action, card, old))
+
+        # A single pass over each affected list to renumber its cards
+        changed = set(card.id for _, card, _ in results)
+        for cards in lists.values():
+            for position, card in enumerate(cards):
+                if card.list_position != position:
+                    card.list_position = position
+                    changed.add(card.id)
+
+        session.flush()
+        boards.touch_lists(list(lists), card_ids=list(changed),
+                           session=session)
+
+    return results
+
+
 def archive_item(item_id):
     update_item(item_id, {'archived': True})
 
@@ -354,7 +537,9 @@ def archive_item(item_id):
 
 
 def update_item(item_id, updated):
-    return api_base.entity_update(models.WorklistItem, item_id, updated)
+    item = api_base.entity_update(models.WorklistItem, item_id, updated)
+    boards.touch_lists([item.list_id], card_ids=[item.id])
+    return item
 
 
 def is_lane(worklist):
@@ -480,6 +665,7 @@ def create_filter(worklist_id, filter_dict):
         criterion_dict['filter_id'] = filter.id
         filter.criteria.append(
             api_base.entity_create(models.FilterCriterion, criterion_dict))
+    boards.touch_lists([worklist_id], lanes=True)
 
     return filter
 
@@ -509,7 +695,9 @@ def update_filter(filter_id, update):
                 old_filter.criteria.remove(criterion)
         del update['filter_criteria']
 
-    return api_base.entity_update(models.WorklistFilter, filter_id, update)
+    updated = api_base.entity_update(models.WorklistFilter, filter_id, update)
+    boards.touch_lists([updated.list_id], lanes=True)
+    return updated
 
 
 def delete_filter(filter_id):
@@ -517,6 +705,7 @@ def delete_filter(filter_id):
     for criterion in filter.criteria:
         api_base.entity_hard_delete(models.FilterCriterion, criterion.id)
     api_base.entity_hard_delete(models.WorklistFilter, filter_id)
+    boards.touch_lists([filter.list_id], lanes=True)
 
 
 def translate_criterion_to_field(criterion):
@@ -24,14 +24,52 @@ revision = '050'
 down_revision = '049'
 
 
+import datetime
+
 from alembic import op
 import sqlalchemy as sa
 from sqlalchemy.dialects import mysql
 
-from storyboard.db.api import base as api_base
-from storyboard.db.api import boards
-from storyboard.db.api import worklists
-from storyboard.db import models
+
+# Lightweight table definitions for the data migration. These deliberately
+# avoid the ORM models, which describe the latest schema rather than the
+# schema at this revision.
+permissions = sa.table(
+    'permissions',
+    sa.column('id', sa.Integer),
+    sa.column('created_at', sa.DateTime),
+    sa.column('name', sa.Unicode),
+    sa.column('codename', sa.Unicode))
+user_permissions = sa.table(
+    'user_permissions',
+    sa.column('user_id', sa.Integer),
+    sa.column('permission_id', sa.Integer))
+boards = sa.table(
+    'boards',
+    sa.column('id', sa.Integer),
+    sa.column('creator_id', sa.Integer))
+board_permissions = sa.table(
+    'board_permissions',
+    sa.column('board_id', sa.Integer),
+    sa.column('permission_id', sa.Integer))
+worklists = sa.table(
+    'worklists',
+    sa.column('id', sa.Integer),
+    sa.column('creator_id', sa.Integer))
+worklist_permissions = sa.table(
+    'worklist_permissions',
+    sa.column('worklist_id', sa.Integer),
+    sa.column('permission_id', sa.Integer))
+
+
+def _create_permission(bind, name, codename, users):
+    result = bind.execute(permissions.insert().values(
+        name=name, codename=codename, created_at=datetime.datetime.utcnow()))
+    permission_id = result.inserted_primary_key[0]
+    for user_id in users:
+        bind.execute(user_permissions.insert().values(
+            user_id=user_id, permission_id=permission_id))
+    return permission_id
 
 
 def upgrade(active_plugins=None, options=None):
@@ -48,41 +86,26 @@ def upgrade(active_plugins=None, options=None):
         sa.ForeignKeyConstraint(['worklist_id'], ['worklists.id'], )
     )
 
-    session = api_base.get_session(in_request=False)
-    for board in boards.get_all(session=session):
-        edit_permission = {
-            'name': 'edit_board_%d' % board.id,
-            'codename': 'edit_board',
-            'users': [board.creator_id]
-        }
-        move_permission = {
-            'name': 'move_cards_%d' % board.id,
-            'codename': 'move_cards',
-            'users': []
-        }
+    bind = op.get_bind()
+    for board in bind.execute(boards.select()).fetchall():
         print('Creating permissions for Board with id: %d' % board.id)
-        boards.create_permission(board.id, edit_permission, session=session)
-        boards.create_permission(board.id, move_permission, session=session)
-
-    for worklist in worklists.get_all(session=session):
-        edit_permission = {
-            'name': 'edit_worklist_%d' % worklist.id,
-            'codename': 'edit_worklist',
-            'users': [worklist.creator_id]
-        }
-        move_permission = {
-            'name': 'move_items_%d' % worklist.id,
-            'codename': 'move_items',
-            'users': []
-        }
+        for codename, users in (('edit_board', [board.creator_id]),
+                                ('move_cards', [])):
+            permission_id = _create_permission(
+                bind, '%s_%d' % (codename, board.id), codename, users)
+            bind.execute(board_permissions.insert().values(
+                board_id=board.id, permission_id=permission_id))
+
+    for worklist in bind.execute(worklists.select()).fetchall():
         print('Creating permissions for Worklist with id: %d' % worklist.id)
-        worklists.create_permission(
-            worklist.id, edit_permission, session=session)
-        worklists.create_permission(
-            worklist.id, move_permission, session=session)
-        session.flush()
-
-    dialect = op.get_bind().engine.dialect
+        for codename, users in (('edit_worklist', [worklist.creator_id]),
+                                ('move_items', [])):
+            permission_id = _create_permission(
+                bind, '%s_%d' % (codename, worklist.id), codename, users)
+            bind.execute(worklist_permissions.insert().values(
+                worklist_id=worklist.id, permission_id=permission_id))
+
+    dialect = bind.engine.dialect
     if dialect.supports_alter:
         op.drop_constraint(u'boards_ibfk_2', 'boards', type_='foreignkey')
         op.drop_column(u'boards', 'permission_id')
@@ -103,19 +126,17 @@ def downgrade(active_plugins=None, options=None):
     op.create_foreign_key(u'boards_ibfk_2', 'boards', 'permissions',
                           ['permission_id'], ['id'])
 
-    session = api_base.get_session(in_request=False)
-    to_delete = []
-    for board in boards.get_all(session=session):
-        for permission in board.permissions:
-            to_delete.append(permission)
-
-    for worklist in worklists.get_all(session=session):
-        for permission in worklist.permissions:
-            to_delete.append(permission)
+    bind = op.get_bind()
+    to_delete = [row.permission_id for row in bind.execute(
+        sa.select([board_permissions.c.permission_id])).fetchall()]
+    to_delete += [row.permission_id for row in bind.execute(
+        sa.select([worklist_permissions.c.permission_id])).fetchall()]
 
     op.drop_table('worklist_permissions')
     op.drop_table('board_permissions')
 
-    for permission in to_delete:
-        api_base.entity_hard_delete(
-            models.Permission, permission.id, session=session)
+    if to_delete:
+        bind.execute(user_permissions.delete().where(
+            user_permissions.c.permission_id.in_(to_delete)))
+        bind.execute(permissions.delete().where(
+            permissions.c.id.in_(to_delete)))
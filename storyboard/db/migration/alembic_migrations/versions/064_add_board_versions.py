@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add version counters to boards, lanes and cards
+
+Revision ID: 064
+Revises: 063
+Create Date: 2026-10-19 10:12:31.410232
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '064'
+down_revision = '063'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade(active_plugins=None, options=None):
+    for table in ('boards', 'board_worklists', 'worklist_items'):
+        op.add_column(
+            table, sa.Column('version', sa.Integer(), nullable=False,
+                             server_default='0'))
+    op.create_index('board_worklists_version_idx',
+                    'board_worklists', ['board_id', 'version'])
+    op.create_index('worklist_items_version_idx',
+                    'worklist_items', ['list_id', 'version'])
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_index('worklist_items_version_idx', table_name='worklist_items')
+    op.drop_index('board_worklists_version_idx',
+                  table_name='board_worklists')
+    for table in ('boards', 'board_worklists', 'worklist_items'):
+        op.drop_column(table, 'version')
@@ -0,0 +1,40 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Index worklist items by the story or task they refer to
+
+Revision ID: 065
+Revises: 064
+Create Date: 2026-10-19 11:02:47.118326
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '065'
+down_revision = '064'
+
+
+from alembic import op
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_index('worklist_items_membership_idx', 'worklist_items',
+                    ['list_id', 'item_type', 'item_id', 'archived'])
+    op.create_index('worklist_items_item_idx', 'worklist_items',
+                    ['item_type', 'item_id'])
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_index('worklist_items_item_idx', table_name='worklist_items')
+    op.drop_index('worklist_items_membership_idx',
+                  table_name='worklist_items')
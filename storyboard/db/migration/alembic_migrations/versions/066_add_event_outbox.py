@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add a table for API events waiting to be published
+
+Revision ID: 066
+Revises: 065
+Create Date: 2026-10-19 13:24:05.640912
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '066'
+down_revision = '065'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+from storyboard.db.decorators import UTCDateTime
+from storyboard.db.models import MYSQL_MEDIUM_TEXT
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_table(
+        'event_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', UTCDateTime(), nullable=True),
+        sa.Column('updated_at', UTCDateTime(), nullable=True),
+        sa.Column('topic', sa.Unicode(255), nullable=False),
+        sa.Column('payload', MYSQL_MEDIUM_TEXT, nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_table('event_outbox')
@@ -0,0 +1,52 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add a table used as the event queue by the database transport
+
+Revision ID: 067
+Revises: 066
+Create Date: 2026-10-19 15:02:41.118203
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '067'
+down_revision = '066'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+from storyboard.db.decorators import UTCDateTime
+from storyboard.db.models import MYSQL_MEDIUM_TEXT
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_table(
+        'event_queue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', UTCDateTime(), nullable=True),
+        sa.Column('updated_at', UTCDateTime(), nullable=True),
+        sa.Column('topic', sa.Unicode(255), nullable=False),
+        sa.Column('payload', MYSQL_MEDIUM_TEXT, nullable=False),
+        sa.Column('claimed_by', sa.String(50), nullable=True),
+        sa.Column('claimed_until', UTCDateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('event_queue_claim_idx', 'event_queue',
+                    ['topic', 'claimed_until'])
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_index('event_queue_claim_idx', table_name='event_queue')
+    op.drop_table('event_queue')
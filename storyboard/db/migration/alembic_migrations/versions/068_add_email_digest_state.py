@@ -0,0 +1,50 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add a table recording the email digests sent to each user
+
+Revision ID: 068
+Revises: 067
+Create Date: 2026-10-19 17:21:09.502361
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '068'
+down_revision = '067'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+from storyboard.db.decorators import UTCDateTime
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_table(
+        'email_digest_state',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', UTCDateTime(), nullable=True),
+        sa.Column('updated_at', UTCDateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('last_event_id', sa.Integer(), nullable=True),
+        sa.Column('last_sent_at', UTCDateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                name='fk_email_digest_user_id'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', name='uniq_email_digest_user')
+    )
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_table('email_digest_state')
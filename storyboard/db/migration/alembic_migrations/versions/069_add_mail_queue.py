@@ -0,0 +1,58 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add a table used as the outbound mail spool
+
+Revision ID: 069
+Revises: 068
+Create Date: 2026-10-19 19:47:33.815920
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '069'
+down_revision = '068'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+from storyboard.db.decorators import UTCDateTime
+from storyboard.db.models import MYSQL_MEDIUM_TEXT
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_table(
+        'mail_queue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', UTCDateTime(), nullable=True),
+        sa.Column('updated_at', UTCDateTime(), nullable=True),
+        sa.Column('sender', sa.Unicode(255), nullable=False),
+        sa.Column('recipients', sa.UnicodeText(), nullable=False),
+        sa.Column('domain', sa.Unicode(255), nullable=False),
+        sa.Column('message', MYSQL_MEDIUM_TEXT, nullable=False),
+        sa.Column('attempts', sa.Integer(), nullable=False),
+        sa.Column('next_attempt_at', UTCDateTime(), nullable=True),
+        sa.Column('claimed_by', sa.String(50), nullable=True),
+        sa.Column('claimed_until', UTCDateTime(), nullable=True),
+        sa.Column('last_error', sa.UnicodeText(), nullable=True),
+        sa.Column('dead_at', UTCDateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('mail_queue_claim_idx', 'mail_queue',
+                    ['dead_at', 'next_attempt_at'])
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_index('mail_queue_claim_idx', table_name='mail_queue')
+    op.drop_table('mail_queue')
@@ -0,0 +1,59 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+
+"""Add unread subscription event counters, and indexes for reading a
+user's latest events and purging old ones
+
+Revision ID: 070
+Revises: 069
+Create Date: 2026-10-19 21:08:41.270153
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '070'
+down_revision = '069'
+
+
+from alembic import op
+import sqlalchemy as sa
+
+from storyboard.db.decorators import UTCDateTime
+
+
+def upgrade(active_plugins=None, options=None):
+    op.create_table(
+        'subscription_event_counters',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('created_at', UTCDateTime(), nullable=True),
+        sa.Column('updated_at', UTCDateTime(), nullable=True),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('unread_count', sa.Integer(), nullable=False),
+        sa.Column('last_read_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'],
+                                name='fk_subscription_counter_user_id'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', name='uniq_subscription_counter_user')
+    )
+    op.create_index('subscription_events_subscriber_idx',
+                    'subscription_events', ['subscriber_id', 'id'])
+    op.create_index('subscription_events_created_at_idx',
+                    'subscription_events', ['created_at'])
+
+
+def downgrade(active_plugins=None, options=None):
+    op.drop_index('subscription_events_created_at_idx',
+                  table_name='subscription_events')
+    op.drop_index('subscription_events_subscriber_idx',
+                  table_name='subscription_events')
+    op.drop_table('subscription_event_counters')
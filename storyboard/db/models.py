@@ -548,6 +548,69 @@ class SubscriptionEvents(ModelBuilder, Base):
     event_info = Column(UnicodeText(), nullable=True)
 
 
+class SubscriptionEventCounter(ModelBuilder, Base):
+    """The number of subscription events a user hasn't read yet, kept up to
+    date as events are added, so it doesn't need counting.
+    """
+    __tablename__ = 'subscription_event_counters'
+    __table_args__ = (
+        schema.UniqueConstraint('user_id',
+                                name='uniq_subscription_counter_user'),
+    )
+
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    unread_count = Column(Integer, default=0, nullable=False)
+    last_read_id = Column(Integer, nullable=True)
+
+
+class EmailDigestState(ModelBuilder, Base):
+    """The last email digest sent to a user, and the last subscription
+    event it included.
+    """
+    __tablename__ = 'email_digest_state'
+    __table_args__ = (
+        schema.UniqueConstraint('user_id', name='uniq_email_digest_user'),
+    )
+
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    last_event_id = Column(Integer, nullable=True)
+    last_sent_at = Column(UTCDateTime, nullable=True)
+
+
+class EventOutbox(ModelBuilder, Base):
+    __tablename__ = 'event_outbox'
+
+    topic = Column(Unicode(CommonLength.top_large_length), nullable=False)
+    payload = Column(MYSQL_MEDIUM_TEXT, nullable=False)
+
+
+class EventQueue(ModelBuilder, Base):
+    __tablename__ = 'event_queue'
+
+    topic = Column(Unicode(CommonLength.top_large_length), nullable=False)
+    payload = Column(MYSQL_MEDIUM_TEXT, nullable=False)
+    claimed_by = Column(String(CommonLength.top_short_length), nullable=True)
+    claimed_until = Column(UTCDateTime, nullable=True)
+
+
+class MailQueue(ModelBuilder, Base):
+    """An email waiting to be delivered by storyboard-mail-sender. Emails
+    which can't be delivered are kept, with dead_at set.
+    """
+    __tablename__ = 'mail_queue'
+
+    sender = Column(Unicode(CommonLength.top_large_length), nullable=False)
+    recipients = Column(UnicodeText(), nullable=False)
+    domain = Column(Unicode(CommonLength.top_large_length), nullable=False)
+    message = Column(MYSQL_MEDIUM_TEXT, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(UTCDateTime, nullable=True)
+    claimed_by = Column(String(CommonLength.top_short_length), nullable=True)
+    claimed_until = Column(UTCDateTime, nullable=True)
+    last_error = Column(UnicodeText(), nullable=True)
+    dead_at = Column(UTCDateTime, nullable=True)
+
+
 # Worklists and boards
 
 class WorklistItem(ModelBuilder, Base):
@@ -563,10 +626,12 @@ class WorklistItem(ModelBuilder, Base):
                               ForeignKey('due_dates.id'),
                               nullable=True)
     archived = Column(Boolean, default=False)
+    # The version of the containing board at which this card last changed.
+    version = Column(Integer, default=0, nullable=False)
     list = relationship('Worklist', backref=backref('items', lazy="dynamic"))
 
     _public_fields = ["id", "list_id", "list_position", "item_type",
-                      "item_id"]
+                      "item_id", "version"]
 
 
 class FilterCriterion(FullText, ModelBuilder, Base):
@@ -617,9 +682,11 @@ class BoardWorklist(ModelBuilder, Base):
     board_id = Column(Integer, ForeignKey('boards.id'))
     list_id = Column(Integer, ForeignKey('worklists.id'))
     position = Column(Integer)
+    # The version of the board at which this lane last changed.
+    version = Column(Integer, default=0, nullable=False)
     worklist = relationship(Worklist)
 
-    _public_fields = ["id", "board_id", "list_id", "position"]
+    _public_fields = ["id", "board_id", "list_id", "position", "version"]
 
 
 class Board(FullText, ModelBuilder, Base):
@@ -632,11 +699,15 @@ class Board(FullText, ModelBuilder, Base):
     project_id = Column(Integer, ForeignKey('projects.id'))
     private = Column(Boolean, default=False)
     archived = Column(Boolean, default=False)
+    # Monotonically increasing counter, bumped whenever the board's lanes
+    # or cards change. Used by clients to fetch incremental changes.
+    version = Column(Integer, default=0, nullable=False)
     lanes = relationship(BoardWorklist, backref='board')
     permissions = relationship("Permission", secondary="board_permissions")
 
     _public_fields = ["id", "title", "description", "creator_id",
-                      "project_id", "permission_id", "private", "archived"]
+                      "project_id", "permission_id", "private", "archived",
+                      "version"]
 
 board_permissions = Table(
     'board_permissions', Base.metadata,
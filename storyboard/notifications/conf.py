@@ -18,6 +18,16 @@ from oslo_config import cfg
 CONF = cfg.CONF
 
 NOTIFICATION_OPTS = [
+    cfg.StrOpt("transport", default="rabbitmq",
+               choices=["rabbitmq", "database"],
+               help="How API events reach the worker daemon. 'rabbitmq' "
+                    "publishes them to a RabbitMQ exchange. 'database' "
+                    "queues them in the event_queue table, so that no "
+                    "broker is needed."),
+    cfg.IntOpt("database_queue_claim_timeout", default=300, min=1,
+               help="How long (in seconds) a worker has to handle the "
+                    "events it claims from the database queue, before "
+                    "they are given to another worker."),
     cfg.StrOpt("rabbit_exchange_name", default="storyboard",
                help="The name of the topic exchange which storyboard will "
                     "use to broadcast its events."),
@@ -43,5 +53,114 @@ NOTIFICATION_OPTS = [
     cfg.IntOpt("rabbit_connection_attempts", default=6,
                help="The number of connection attempts before giving-up"),
     cfg.IntOpt("rabbit_retry_delay", default=10,
-               help="The interval between connection attempts (in seconds)")
+               help="The interval between connection attempts (in seconds)"),
+    cfg.StrOpt("rabbit_content_type", default="application/json",
+               choices=["application/json", "application/x-msgpack"],
+               help="How event messages are encoded. Subscribers decode "
+                    "messages using their content type, so this can be "
+                    "changed without stopping them. application/x-msgpack "
+                    "needs the msgpack library to be installed."),
+    cfg.StrOpt("event_payload_mode", default="full",
+               choices=["full", "diff"],
+               help="'full' sends the whole resource before and after each "
+                    "change, loaded from the database. 'diff' only sends "
+                    "the fields which changed, plus the IDs of the "
+                    "resource and its parents, and marks the event with a "
+                    "payload_mode of 'diff'. Consumers need to load the "
+                    "rest of the resource themselves."),
+    cfg.IntOpt("rabbit_event_shards", default=0, min=0,
+               help="The number of queues to split API events between. "
+                    "Events for the same story always go to the same "
+                    "queue, and the worker daemon runs one process per "
+                    "queue. 0 uses a single queue, shared by all the "
+                    "worker processes, which doesn't keep events in "
+                    "order."),
+    cfg.IntOpt("rabbit_prefetch_count", default=50, min=1,
+               help="The number of messages the broker sends to each "
+                    "subscriber ahead of the ones it has acknowledged."),
+    cfg.IntOpt("subscriber_ack_batch_size", default=10, min=1,
+               help="The number of handled messages a subscriber "
+                    "acknowledges at once. Should be less than "
+                    "rabbit_prefetch_count."),
+    cfg.FloatOpt("subscriber_inactivity_timeout", default=1.0,
+                 help="How long (in seconds) a subscriber waits for a "
+                      "message before acknowledging the ones it has "
+                      "already handled."),
+    cfg.FloatOpt("subscriber_plugin_timeout", default=60.0,
+                 help="How long (in seconds) a subscriber waits for its "
+                      "worker plugins to handle an event, before moving "
+                      "on to the next one. Events aren't acknowledged "
+                      "until every plugin has handled them, so a plugin "
+                      "which times out still holds up the acknowledgement "
+                      "of its group of events."),
+    cfg.BoolOpt("publisher_async", default=True,
+                help="Publish events from a background thread in each API "
+                     "worker, instead of waiting for the broker while "
+                     "handling the request."),
+    cfg.IntOpt("publisher_queue_size", default=10000, min=1,
+               help="The maximum number of events waiting to be published "
+                    "by the background publisher."),
+    cfg.IntOpt("publisher_batch_size", default=100, min=1,
+               help="The maximum number of events the background "
+                    "publisher sends before waiting for the broker to "
+                    "confirm them."),
+    cfg.FloatOpt("publisher_flush_interval", default=0.2,
+                 help="How long (in seconds) the background publisher "
+                      "waits for more events before sending a batch."),
+    cfg.StrOpt("publisher_overflow_policy", default="block",
+               choices=["block", "drop_new", "drop_oldest"],
+               help="What to do with a new event when the publisher queue "
+                    "is full. 'block' waits up to publisher_block_timeout "
+                    "for space and then drops the event, 'drop_new' drops "
+                    "the new event and 'drop_oldest' drops the oldest "
+                    "queued event."),
+    cfg.FloatOpt("publisher_block_timeout", default=5.0,
+                 help="How long (in seconds) to wait for space in a full "
+                      "publisher queue when using the 'block' policy."),
+    cfg.FloatOpt("publisher_shutdown_timeout", default=10.0,
+                 help="How long (in seconds) to wait for queued events to "
+                      "be published when shutting down."),
+    cfg.BoolOpt("outbox_enabled", default=False,
+                help="Store events in the event_outbox table as part of the "
+                     "API request's transaction, instead of publishing them "
+                     "directly. The storyboard-outbox-relay process must be "
+                     "running to send them to the broker."),
+    cfg.IntOpt("outbox_batch_size", default=100, min=1,
+               help="The maximum number of stored events the outbox relay "
+                    "publishes at once."),
+    cfg.FloatOpt("outbox_poll_interval", default=1.0,
+                 help="How long (in seconds) the outbox relay waits before "
+                      "checking for new events, when it has none left."),
+    cfg.IntOpt("project_group_cache_ttl", default=0, min=0,
+               help="How long (in seconds) each worker process keeps the "
+                    "mapping of projects to project groups, used to find "
+                    "the subscribers to an event. The worker which "
+                    "handles a project group event reloads it straight "
+                    "away, others wait for it to expire. 0 disables the "
+                    "cache."),
+    cfg.IntOpt("preference_cache_ttl", default=0, min=0,
+               help="How long (in seconds) each API and worker process "
+                    "keeps users' preferences. A user's preferences are "
+                    "reloaded straight away by the process which changes "
+                    "them, or by the worker which handles the change, and "
+                    "other processes wait for them to expire. 0 disables "
+                    "the cache."),
+    cfg.StrOpt("worker_metrics_file", default=None,
+               help="Where the worker daemon writes its metrics, in the "
+                    "Prometheus text format. Metrics are only collected "
+                    "when this is set."),
+    cfg.FloatOpt("worker_metrics_interval", default=15.0,
+                 help="How often (in seconds) the worker daemon's metrics "
+                      "are updated."),
+    cfg.ListOpt("full_snapshot_resources", default=[],
+                help="Resource types whose events still include the whole "
+                     "resource before and after each change when "
+                     "event_payload_mode is 'diff'."),
+    cfg.IntOpt("stream_max_timeout", default=30, min=0,
+               help="The longest time (in seconds) a request for new "
+                    "subscription events is held open waiting for them."),
+    cfg.FloatOpt("stream_database_poll_interval", default=2.0,
+                 help="How often (in seconds) each API process looks for "
+                      "new subscription events for its waiting requests, "
+                      "when using the database transport.")
 ]
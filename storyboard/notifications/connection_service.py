@@ -83,7 +83,7 @@ class ConnectionService(object):
         # Create a channel
         LOG.debug(_('Creating a new channel'))
         self._channel = self._connection.channel()
-        self._channel.confirm_delivery()
+        self._configure_channel()
 
         # Declare the exchange
         LOG.debug(_('Declaring exchange %s'), self._exchange_name)
@@ -96,6 +96,12 @@ class ConnectionService(object):
         self._open = True
         self._execute_open_hooks()
 
+    def _configure_channel(self):
+        """Put a newly created channel into the right mode. By default,
+        publisher confirms are enabled.
+        """
+        self._channel.confirm_delivery()
+
     def _reconnect(self):
         """Reconnect to rabbit.
         """
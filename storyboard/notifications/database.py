@@ -0,0 +1,165 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A transport which keeps API events in the event_queue table.
+
+Events are written in the API request's transaction, so they are only
+delivered if the change they describe is committed. Subscribers claim
+events in batches, which makes them invisible to other subscribers until
+they are acknowledged or the claim expires.
+"""
+
+import collections
+import time
+import uuid
+
+from oslo_db import exception as db_exc
+from oslo_log import log
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import event_queue
+from storyboard.notifications import encoding
+from storyboard.notifications import transport
+from storyboard._i18n import _LW
+
+
+LOG = log.getLogger(__name__)
+
+Delivery = collections.namedtuple('Delivery', ['delivery_tag'])
+Properties = collections.namedtuple('Properties', ['content_type'])
+
+
+class DatabasePublisher(transport.PublisherBase):
+    """Queues API events in the database."""
+
+    def __init__(self, conf):
+        """Setup the publisher instance based on our configuration.
+
+        :param conf A configuration object.
+        """
+        shards = conf.rabbit_event_shards
+        if shards:
+            self._topics = set(key for shard in range(shards)
+                               for key in transport.binding_keys(shard))
+        else:
+            self._topics = set(transport.binding_keys())
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def publish_message(self, topic, payload, session=None):
+        """Queue a message, in the current request's transaction unless
+        another session is given.
+        """
+        # Nothing would ever consume these, so don't let them pile up.
+        if topic not in self._topics:
+            return
+        event_queue.queue_add(topic, payload, session=session)
+
+
+class DatabaseSubscriber(transport.SubscriberBase):
+    """Consumes API events from the database."""
+
+    def __init__(self, conf, shard=None):
+        """Setup the subscriber instance based on our configuration.
+
+        :param conf A configuration object.
+        :param shard The shard to consume, when events are sharded.
+        """
+        self._consumer = uuid.uuid4().hex
+        self._topics = transport.binding_keys(shard)
+        self._prefetch_count = conf.rabbit_prefetch_count
+        self._lease = conf.database_queue_claim_timeout
+        self._unacked = set()
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.cancel()
+        self.started = False
+
+    def is_open(self):
+        return self.started
+
+    def _claim(self, limit):
+        session = api_base.get_session(in_request=False)
+        try:
+            return event_queue.queue_claim(self._consumer, self._topics,
+                                           limit, self._lease,
+                                           session=session)
+        finally:
+            session.close()
+
+    def consume(self, inactivity_timeout=None):
+        """Iterate over the queued events. Up to rabbit_prefetch_count
+        events are claimed ahead of the ones which have been acknowledged.
+        If there are none, (None, None, None) is yielded after waiting for
+        the inactivity timeout.
+        """
+        while self.started:
+            limit = self._prefetch_count - len(self._unacked)
+            entries = []
+            if limit > 0:
+                try:
+                    entries = self._claim(limit)
+                except db_exc.DBError as e:
+                    LOG.warning(_LW("Could not claim events from the "
+                                    "database."))
+                    LOG.debug(e)
+
+            if not entries:
+                # Give the consumer the chance to acknowledge what it has,
+                # so that more can be claimed.
+                if limit > 0 and inactivity_timeout:
+                    time.sleep(inactivity_timeout)
+                yield None, None, None
+                continue
+
+            for entry in entries:
+                self._unacked.add(entry.id)
+                yield (Delivery(entry.id), Properties(encoding.JSON),
+                       entry.payload)
+
+    def ack(self, delivery_tag, multiple=False):
+        session = api_base.get_session(in_request=False)
+        try:
+            event_queue.queue_ack(self._consumer, delivery_tag,
+                                  multiple=multiple, session=session)
+        except db_exc.DBError as e:
+            # The claim will expire, and the events will be handled again.
+            LOG.warning(_LW("Could not acknowledge events in the "
+                            "database."))
+            LOG.debug(e)
+        finally:
+            session.close()
+
+        if multiple:
+            self._unacked = set(entry_id for entry_id in self._unacked
+                                if entry_id > delivery_tag)
+        else:
+            self._unacked.discard(delivery_tag)
+
+    def cancel(self):
+        if not self._unacked:
+            return
+        session = api_base.get_session(in_request=False)
+        try:
+            event_queue.queue_release(self._consumer, session=session)
+            self._unacked.clear()
+        except db_exc.DBError as e:
+            LOG.debug(e)
+        finally:
+            session.close()
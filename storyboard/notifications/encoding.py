@@ -0,0 +1,88 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Encoding of event payloads, and the slimmed down "diff" payloads.
+
+The content type of each message is set in its AMQP properties, so
+subscribers can decode messages whichever encoding the publisher used.
+"""
+
+import json
+
+import six
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = 'application/json'
+MSGPACK = 'application/x-msgpack'
+CONTENT_TYPES = [JSON, MSGPACK]
+
+
+def available(content_type):
+    """Whether messages can be encoded with the given content type."""
+    if content_type == MSGPACK:
+        return msgpack is not None
+    return content_type == JSON
+
+
+def encode(payload, content_type=JSON):
+    """Encode a payload for sending.
+
+    :param payload: The payload, made of JSON compatible types.
+    :param content_type: The content type to encode it as.
+    """
+    if content_type == MSGPACK:
+        return msgpack.packb(payload, use_bin_type=True)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def decode(body, content_type=None):
+    """Decode a message body. Messages without a content type are JSON.
+
+    :param body: The body of the message.
+    :param content_type: The content type from the message's properties.
+    :raises ValueError: If the body can't be decoded.
+    """
+    if content_type == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack is not installed")
+        try:
+            return msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(six.text_type(e))
+    if isinstance(body, six.binary_type):
+        body = body.decode('utf-8')
+    return json.loads(body)
+
+
+def diff(before, after):
+    """Reduce a pair of resource states to the fields which changed, plus
+    the IDs needed to look the resource up again. If either state is
+    missing, they are returned as they are.
+
+    :param before: The serialized resource before the change.
+    :param after: The serialized resource after the change.
+    """
+    if not isinstance(before, dict) or not isinstance(after, dict):
+        return before, after
+
+    keep = set(key for key in set(before) | set(after)
+               if key == 'id' or key.endswith('_id') or
+               before.get(key) != after.get(key))
+    keep.discard('updated_at')
+
+    return (dict((k, before[k]) for k in keep if k in before),
+            dict((k, after[k]) for k in keep if k in after))
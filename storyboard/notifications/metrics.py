@@ -0,0 +1,289 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Metrics for the worker daemon.
+
+Each worker process records how many events it handles, how long after
+publishing they are handled, and how long and how many database queries
+each plugin takes. The processes send snapshots of their metrics to the
+DaemonManager, which adds them up and writes them to a file in the
+Prometheus text format, for the node exporter's textfile collector.
+"""
+
+import copy
+import os
+import tempfile
+import threading
+import uuid
+
+import six
+from sqlalchemy.engine import Engine
+from sqlalchemy import event
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0, 60.0)
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0,
+               900.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_LOCAL = threading.local()
+_LISTENING = False
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_LOCAL, 'queries', None) is not None:
+        _LOCAL.queries += 1
+
+
+def start_counting_queries():
+    """Count the queries made by the current thread, until
+    stop_counting_queries is called.
+    """
+    global _LISTENING
+    if not _LISTENING:
+        event.listen(Engine, 'before_cursor_execute', _count_query)
+        _LISTENING = True
+    _LOCAL.queries = 0
+
+
+def stop_counting_queries():
+    """Stop counting queries.
+
+    :return: The number of queries made since counting started.
+    """
+    queries = getattr(_LOCAL, 'queries', None) or 0
+    _LOCAL.queries = None
+    return queries
+
+
+def _histogram(buckets):
+    # One count per bucket, plus one for values above the largest bucket.
+    return {'counts': [0] * (len(buckets) + 1), 'sum': 0.0, 'count': 0}
+
+
+def _observe(histogram, buckets, value):
+    index = len(buckets)
+    for i, bound in enumerate(buckets):
+        if value <= bound:
+            index = i
+            break
+    histogram['counts'][index] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def _add_histogram(total, histogram):
+    total['counts'] = [a + b for a, b in zip(total['counts'],
+                                             histogram['counts'])]
+    total['sum'] += histogram['sum']
+    total['count'] += histogram['count']
+
+
+def _plugin_metrics():
+    return {'events': 0,
+            'failures': 0,
+            'timeouts': 0,
+            'latency': _histogram(LATENCY_BUCKETS),
+            'queries': _histogram(QUERY_BUCKETS)}
+
+
+class WorkerMetrics(object):
+    """The metrics of a single worker process. Plugins run in their own
+    threads, so every update takes a lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = 0
+        self._lag = _histogram(LAG_BUCKETS)
+        self._plugins = {}
+
+    def _plugin(self, name):
+        if name not in self._plugins:
+            self._plugins[name] = _plugin_metrics()
+        return self._plugins[name]
+
+    def record_event(self, lag=None):
+        """Record an event taken from the queue.
+
+        :param lag: How long (in seconds) it's been since it was published.
+        """
+        with self._lock:
+            self._events += 1
+            if lag is not None:
+                _observe(self._lag, LAG_BUCKETS, max(0.0, lag))
+
+    def record_plugin(self, name, seconds, queries):
+        """Record a plugin handling an event.
+
+        :param name: The name of the plugin.
+        :param seconds: How long the plugin took.
+        :param queries: The number of database queries it made.
+        """
+        with self._lock:
+            plugin = self._plugin(name)
+            plugin['events'] += 1
+            _observe(plugin['latency'], LATENCY_BUCKETS, seconds)
+            _observe(plugin['queries'], QUERY_BUCKETS, queries)
+
+    def record_failure(self, name):
+        with self._lock:
+            self._plugin(name)['failures'] += 1
+
+    def record_timeout(self, name):
+        with self._lock:
+            self._plugin(name)['timeouts'] += 1
+
+    def snapshot(self):
+        """A copy of the metrics, which can be sent to another process."""
+        with self._lock:
+            return copy.deepcopy({'events': self._events,
+                                  'lag': self._lag,
+                                  'plugins': self._plugins})
+
+
+def merge(snapshots):
+    """Add up the snapshots of several worker processes."""
+    total = {'events': 0, 'lag': _histogram(LAG_BUCKETS), 'plugins': {}}
+    for snapshot in snapshots:
+        total['events'] += snapshot['events']
+        _add_histogram(total['lag'], snapshot['lag'])
+        for name, plugin in six.iteritems(snapshot['plugins']):
+            plugin_total = total['plugins'].setdefault(name,
+                                                       _plugin_metrics())
+            for key in ('events', 'failures', 'timeouts'):
+                plugin_total[key] += plugin[key]
+            _add_histogram(plugin_total['latency'], plugin['latency'])
+            _add_histogram(plugin_total['queries'], plugin['queries'])
+    return total
+
+
+def _format_histogram(lines, name, buckets, histogram, labels=''):
+    cumulative = 0
+    bounds = [repr(float(bound)) for bound in buckets] + ['+Inf']
+    for bound, count in zip(bounds, histogram['counts']):
+        cumulative += count
+        lines.append('%s_bucket{%sle="%s"} %d' %
+                     (name, labels, bound, cumulative))
+    labels = labels.rstrip(',')
+    if labels:
+        labels = '{%s}' % labels
+    lines.append('%s_sum%s %s' % (name, labels, repr(histogram['sum'])))
+    lines.append('%s_count%s %d' % (name, labels, histogram['count']))
+
+
+def to_prometheus(snapshot, events_per_second=None):
+    """Format metrics in the Prometheus text format.
+
+    :param snapshot: The metrics, from WorkerMetrics.snapshot or merge.
+    :param events_per_second: The recent rate of events, if known.
+    """
+    prefix = 'storyboard_worker_'
+    lines = ['# HELP %sevents_total Events taken from the queue.' % prefix,
+             '# TYPE %sevents_total counter' % prefix,
+             '%sevents_total %d' % (prefix, snapshot['events'])]
+
+    if events_per_second is not None:
+        lines.extend([
+            '# HELP %sevents_per_second Events taken from the queue per '
+            'second, since the metrics were last written.' % prefix,
+            '# TYPE %sevents_per_second gauge' % prefix,
+            '%sevents_per_second %s' % (prefix, repr(events_per_second))])
+
+    lines.extend([
+        '# HELP %sevent_lag_seconds Time between an event being published '
+        'and taken from the queue.' % prefix,
+        '# TYPE %sevent_lag_seconds histogram' % prefix])
+    _format_histogram(lines, prefix + 'event_lag_seconds', LAG_BUCKETS,
+                      snapshot['lag'])
+
+    plugins = sorted(snapshot['plugins'].items())
+    for key, kind, description in (
+            ('events', 'counter', 'Events handled by each plugin.'),
+            ('failures', 'counter', 'Events each plugin failed to handle.'),
+            ('timeouts', 'counter', 'Events each plugin took too long to '
+                                    'handle.')):
+        name = '%splugin_%s_total' % (prefix, key)
+        lines.extend(['# HELP %s %s' % (name, description),
+                      '# TYPE %s %s' % (name, kind)])
+        for plugin_name, plugin in plugins:
+            lines.append('%s{plugin="%s"} %d' % (name, plugin_name,
+                                                 plugin[key]))
+
+    for key, buckets, name, description in (
+            ('latency', LATENCY_BUCKETS, 'plugin_latency_seconds',
+             'Time each plugin takes to handle an event.'),
+            ('queries', QUERY_BUCKETS, 'plugin_queries',
+             'Database queries each plugin makes to handle an event.')):
+        name = prefix + name
+        lines.extend(['# HELP %s %s' % (name, description),
+                      '# TYPE %s histogram' % name])
+        for plugin_name, plugin in plugins:
+            _format_histogram(lines, name, buckets, plugin[key],
+                              'plugin="%s",' % plugin_name)
+
+    return '\n'.join(lines) + '\n'
+
+
+def write_text_file(path, text):
+    """Replace a file's contents in one step, so the metrics are never read
+    half written.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.storyboard-')
+    try:
+        with os.fdopen(fd, 'w') as tmp_file:
+            tmp_file.write(text)
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+class Reporter(object):
+    """Sends a worker process's metrics to the DaemonManager at regular
+    intervals, and once more when it stops.
+    """
+
+    def __init__(self, worker_metrics, metrics_queue, interval):
+        """Setup the reporter.
+
+        :param worker_metrics: The process's WorkerMetrics.
+        :param metrics_queue: The DaemonManager's multiprocessing queue.
+        :param interval: How often (in seconds) to send the metrics.
+        """
+        # Process IDs can be reused, so each process gets its own key.
+        self._key = uuid.uuid4().hex
+        self._metrics = worker_metrics
+        self._queue = metrics_queue
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run,
+                                        name='storyboard-metrics')
+        self._thread.daemon = True
+
+    def report(self):
+        self._queue.put((self._key, self._metrics.snapshot()))
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            self.report()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        self.report()
@@ -13,22 +13,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import datetime
 import json
 import re
 
+from oslo_config import cfg
+from oslo_log import log
 from pecan import hooks
+import six
+from sqlalchemy import event
+from sqlalchemy import inspect
 from wsme.rest.json import tojson
 
 from storyboard.api.v1 import wmodels
 import storyboard.common.hook_priorities as priority
 from storyboard.db.api import base as api_base
 from storyboard.db import models
+from storyboard.notifications.conf import NOTIFICATION_OPTS
 from storyboard.notifications.publisher import publish
+from storyboard.notifications.publisher import wants_full_payload
 
 
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
 class_mappings = {'task': [models.Task, wmodels.Task],
                   'project_group': [models.ProjectGroup, wmodels.ProjectGroup],
-                  'project': [models.ProjectGroup, wmodels.Project],
+                  'project': [models.Project, wmodels.Project],
                   'user': [models.User, wmodels.User],
                   'team': [models.Team, wmodels.Team],
                   'story': [models.Story, wmodels.Story],
@@ -42,11 +53,135 @@ class_mappings = {'task': [models.Task, wmodels.Task],
                   'event': [models.TimeLineEvent, wmodels.TimeLineEvent]}
 
 
+def _serialize(value):
+    """Make a column value safe to put in a notification payload."""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if value is None or isinstance(value, (bool, float) + six.integer_types +
+                                   six.string_types):
+        return value
+    return six.text_type(value)
+
+
+def capture_changes(session):
+    """Start recording the column changes that a session flushes, so that
+    notifications can describe a change without loading the resource
+    again.
+
+    :param session: The request's session.
+    """
+    if 'notification_changes' in session.info:
+        return
+    session.info['notification_changes'] = {}
+    event.listen(session, 'after_flush', _record_changes)
+
+
+def _record_changes(session, flush_context):
+    # The session's new, dirty and deleted collections and the attribute
+    # history still describe the flush at this point.
+    changes = session.info['notification_changes']
+    for kind, instances in (('new', session.new),
+                            ('dirty', session.dirty),
+                            ('deleted', session.deleted)):
+        for instance in instances:
+            instance_state = inspect(instance)
+            if kind == 'dirty' and not session.is_modified(instance):
+                continue
+
+            key = (type(instance), instance_state.dict.get('id'))
+            record = changes.setdefault(key, {'before': {}, 'after': {},
+                                              'created': kind == 'new',
+                                              'deleted': False})
+            record['deleted'] = kind == 'deleted'
+
+            for attr in instance_state.mapper.column_attrs:
+                if kind == 'new':
+                    record['after'][attr.key] = _serialize(
+                        instance_state.dict.get(attr.key))
+                elif kind == 'deleted':
+                    # Only read what's loaded, the row is gone now.
+                    record['before'].setdefault(attr.key, _serialize(
+                        instance_state.dict.get(attr.key)))
+                else:
+                    history = instance_state.attrs[attr.key].history
+                    if not history.has_changes():
+                        continue
+                    old = history.deleted[0] if history.deleted else None
+                    new = history.added[0] if history.added else None
+                    record['before'].setdefault(attr.key, _serialize(old))
+                    record['after'][attr.key] = _serialize(new)
+
+
+def _parent_ids(session, model_class, resource_id):
+    """Get the foreign keys of a resource, such as its story_id. Consumers
+    need them to find the resource's parents, and events are sharded by
+    them, even when they didn't change.
+    """
+    instance = session.query(model_class).get(resource_id)
+    if instance is None:
+        return {}
+    return dict((attr.key, _serialize(getattr(instance, attr.key)))
+                for attr in inspect(model_class).column_attrs
+                if attr.key.endswith('_id'))
+
+
+def get_changes(session, model_class, resource_id):
+    """Get the recorded changes to a resource.
+
+    :param session: The request's session.
+    :param model_class: The resource's model class.
+    :param resource_id: The ID of the resource.
+    :return: The changed fields before and after the request, each
+             including the ID and the resource's foreign keys. Either is
+             None if the resource was created or deleted.
+    """
+    changes = session.info.get('notification_changes', {})
+    try:
+        resource_id = int(resource_id)
+    except (TypeError, ValueError):
+        return None, None
+
+    record = changes.get((model_class, resource_id))
+    if record is not None and record['deleted']:
+        # Everything loaded before the delete is recorded already.
+        return dict(record['before'], id=resource_id), None
+
+    parents = _parent_ids(session, model_class, resource_id)
+    if record is None:
+        return (dict(parents, id=resource_id),
+                dict(parents, id=resource_id))
+
+    before = None
+    if not record['created']:
+        before = dict(parents, id=resource_id)
+        before.update(record['before'])
+    after = dict(parents, id=resource_id)
+    after.update(record['after'])
+    return before, after
+
+
+def get_created_id(session, model_class):
+    """Get the ID of the first resource of a type created by the request.
+    """
+    changes = session.info.get('notification_changes', {})
+    created = [resource_id for (kls, resource_id), record
+               in six.iteritems(changes)
+               if kls is model_class and record['created']]
+    return min(created) if created else None
+
+
 class NotificationHook(hooks.PecanHook):
     priority = priority.DEFAULT
 
     def __init__(self):
         super(NotificationHook, self).__init__()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+
+    def wants_snapshot(self, resource):
+        """Whether the whole resource is sent, rather than just the fields
+        which changed.
+        """
+        return wants_full_payload(resource)
 
     def before(self, state):
         # Ignore get methods, we only care about changes.
@@ -60,8 +195,11 @@ class NotificationHook(hooks.PecanHook):
         (resource, resource_id, subresource, subresource_id) \
             = self.parse(request.path)
 
-        state.old_entity_values = self.get_original_resource(resource,
-                                                             resource_id)
+        if self.wants_snapshot(resource):
+            state.old_entity_values = self.get_original_resource(
+                resource, resource_id)
+        elif resource in class_mappings:
+            capture_changes(request.session)
 
     def after(self, state):
         # Ignore get methods, we only care about changes.
@@ -80,32 +218,32 @@ class NotificationHook(hooks.PecanHook):
         (resource, resource_id, subresource, subresource_id) \
             = self.parse(request.path)
 
-        # FIXME: Ignore worklists and boards for now, since they cause a
-        # 500 error when moving cards that seems to be pika breaking.
-        if resource in ['board', 'worklist']:
-            return
+        if not self.wants_snapshot(resource):
+            (resource_id, subresource_id, old_resource, new_resource) = \
+                self.get_recorded_changes(request, response, resource,
+                                          resource_id, subresource,
+                                          subresource_id)
+            # Consumers need to know that fields are missing.
+            payload_mode = 'diff'
+        else:
+            payload_mode = 'full'
 
-        # On a POST method, the server has assigned an ID to the resource,
-        # so we should be getting it from the resource rather than the URL.
-        if state.request.method == 'POST':
-            response_body = json.loads(response.body)
-            if response_body:
-                if not subresource:
-                    resource_id = response_body.get('id')
-                elif subresource == 'comment':
-                    subresource_id = response_body.get('comment').get('id')
-            else:
-                resource_id = None
+            # On a POST method, the server has assigned an ID to the
+            # resource, so we should be getting it from the resource rather
+            # than the URL.
+            if state.request.method == 'POST':
+                (resource_id, subresource_id) = self.get_created_ids(
+                    response, resource_id, subresource, subresource_id)
 
-        # Get a copy of the resource post-modification. Will return None in
-        # the case of a DELETE.
-        new_resource = self.get_original_resource(resource, resource_id)
+            # Get a copy of the resource post-modification. Will return None
+            # in the case of a DELETE.
+            new_resource = self.get_original_resource(resource, resource_id)
 
-        # Extract the old resource when possible.
-        if hasattr(state, 'old_entity_values'):
-            old_resource = state.old_entity_values
-        else:
-            old_resource = None
+            # Extract the old resource when possible.
+            if hasattr(state, 'old_entity_values'):
+                old_resource = state.old_entity_values
+            else:
+                old_resource = None
 
         # Build the payload. Use of None is included to ensure that we don't
         # accidentally blow up the API call, but we don't anticipate it
@@ -121,7 +259,53 @@ class NotificationHook(hooks.PecanHook):
                 sub_resource=subresource,
                 sub_resource_id=subresource_id,
                 resource_before=old_resource,
-                resource_after=new_resource)
+                resource_after=new_resource,
+                payload_mode=payload_mode)
+
+    def get_created_ids(self, response, resource_id, subresource,
+                        subresource_id):
+        """Read the IDs of a newly created resource from the response."""
+        response_body = json.loads(response.body)
+        if response_body:
+            if not subresource:
+                resource_id = response_body.get('id')
+            elif subresource == 'comment':
+                subresource_id = response_body.get('comment').get('id')
+        else:
+            resource_id = None
+        return resource_id, subresource_id
+
+    def get_recorded_changes(self, request, response, resource,
+                             resource_id, subresource, subresource_id):
+        """Describe the request using the changes the session flushed.
+
+        :return: The resource ID, sub-resource ID, and the changed fields
+                 before and after the request.
+        """
+        session = request.session
+        try:
+            session.flush()
+        except Exception as e:
+            LOG.debug(e)
+
+        model_class = class_mappings.get(resource, [None])[0]
+        if request.method == 'POST':
+            if model_class and not subresource:
+                resource_id = get_created_id(session, model_class)
+            elif subresource == 'comment':
+                subresource_id = get_created_id(session, models.Comment)
+
+            if resource_id is None and subresource_id is None:
+                # Nothing was recorded, so fall back to the response.
+                (resource_id, subresource_id) = self.get_created_ids(
+                    response, resource_id, subresource,
+                    subresource_id)
+
+        if model_class is None:
+            return resource_id, subresource_id, None, None
+
+        before, after = get_changes(session, model_class, resource_id)
+        return resource_id, subresource_id, before, after
 
     def get_original_resource(self, resource, resource_id):
         """Given a resource name and ID, will load that resource and map it
@@ -0,0 +1,114 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+from pika.exceptions import AMQPError
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import event_outbox
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications.publisher import Payload
+from storyboard.notifications.publisher import Publisher
+from storyboard._i18n import _LI, _LW
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+
+def relay():
+    """Publish the events stored in the event outbox, for as long as the
+    process runs.
+    """
+    try:
+        log.register_options(CONF)
+    except cfg.ArgsAlreadyParsedError:
+        pass
+
+    log.setup(CONF, 'storyboard')
+    CONF(project='storyboard')
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+
+    OutboxRelay(CONF.notifications).run()
+
+
+class OutboxRelay(object):
+    """Moves events from the event_outbox table to RabbitMQ, in the order
+    they were stored.
+
+    Events are only removed from the table once the broker has accepted
+    them, so an event may be published more than once if the relay is
+    interrupted, but it will never be lost. Only one relay should run
+    against a database at a time.
+    """
+
+    def __init__(self, conf, publisher=None):
+        """Setup the relay based on our configuration.
+
+        :param conf A configuration object.
+        :param publisher A batched Publisher to use, mostly for testing.
+        """
+        self._conf = conf
+        self._publisher = publisher or Publisher(conf, batched=True)
+
+    def _connect(self):
+        if self._publisher._open:
+            return True
+        try:
+            self._publisher.restart()
+        except AMQPError as e:
+            LOG.warning(_LW("Could not connect to RabbitMQ, retrying in "
+                            "%d seconds."), self._conf.rabbit_retry_delay)
+            LOG.debug(e)
+            return False
+        return True
+
+    def relay_batch(self):
+        """Publish the oldest batch of stored events.
+
+        :return The number of events that were published.
+        """
+        session = api_base.get_session(in_request=False)
+        try:
+            entries = event_outbox.outbox_get_batch(
+                self._conf.outbox_batch_size, session=session)
+            if not entries:
+                return 0
+
+            payloads = [Payload(entry.topic, json.loads(entry.payload))
+                        for entry in entries]
+            if not self._publisher.publish_batch(payloads):
+                # The events are still in the table, so don't keep a
+                # second copy of them around.
+                self._publisher.drop_pending(
+                    self._publisher.pending_count())
+                return 0
+
+            event_outbox.outbox_delete([entry.id for entry in entries],
+                                       session=session)
+            return len(entries)
+        finally:
+            session.close()
+
+    def run(self):
+        LOG.info(_LI("Relaying events from the event outbox."))
+        while True:
+            if not self._connect():
+                time.sleep(self._conf.rabbit_retry_delay)
+                continue
+
+            if self.relay_batch() < self._conf.outbox_batch_size:
+                time.sleep(self._conf.outbox_poll_interval)
@@ -13,14 +13,25 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import atexit
+import collections
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import log
+import pika
+from pika.exceptions import AMQPError
 from pika.exceptions import ConnectionClosed
+from six.moves import queue
 
+from storyboard.db.api import event_outbox
 from storyboard.notifications.conf import NOTIFICATION_OPTS
 from storyboard.notifications.connection_service import ConnectionService
+from storyboard.notifications.database import DatabasePublisher
+from storyboard.notifications import encoding
+from storyboard.notifications import sharding
+from storyboard.notifications import transport
 from storyboard._i18n import _, _LW, _LE
 
 
@@ -29,31 +40,64 @@ LOG = log.getLogger(__name__)
 PUBLISHER = None
 
 
-class Publisher(ConnectionService):
+class Publisher(ConnectionService, transport.PublisherBase):
     """A generic message publisher that uses delivery confirmation to ensure
     that messages are delivered, and will keep a running cache of unsent
     messages while the publisher is attempting to reconnect.
     """
 
-    def __init__(self, conf):
+    def __init__(self, conf, batched=False):
         """Setup the publisher instance based on our configuration.
 
         :param conf A configuration object.
+        :param batched Whether messages will be sent in batches using
+                       publish_batch. Batches are sent inside an AMQP
+                       transaction, so the broker is only waited on once
+                       per batch rather than once per message. A batched
+                       publisher is not thread safe, and never reconnects
+                       by itself.
         """
         super(Publisher, self).__init__(conf)
 
-        self._pending = list()
+        self._batched = batched
+
+        self._content_type = conf.rabbit_content_type
+        if not encoding.available(self._content_type):
+            LOG.warning(_LW("Cannot encode messages as %s, using JSON "
+                            "instead."), self._content_type)
+            self._content_type = encoding.JSON
+        self._properties = pika.BasicProperties(
+            app_id='storyboard', content_type=self._content_type)
+
+        # Messages waiting to be sent, oldest first. Only the keys are used.
+        self._pending = collections.OrderedDict()
 
         self.add_open_hook(self._publish_pending)
 
+    def _configure_channel(self):
+        if self._batched:
+            self._channel.tx_select()
+        else:
+            super(Publisher, self)._configure_channel()
+
+    def _reconnect(self):
+        # A batched publisher is driven by a single thread, which is
+        # responsible for reconnecting. Doing it from a timer thread would
+        # mean sharing the connection between threads.
+        if not self._batched:
+            super(Publisher, self)._reconnect()
+
     def _publish_pending(self):
         """Publishes any pending messages that were broadcast while the
         publisher was connecting.
         """
+        if self._batched:
+            self.publish_batch([])
+            return
 
         # Shallow copy, so we can iterate over it without having it be modified
         # out of band.
-        pending = list(self._pending)
+        pending = list(self._pending.keys())
 
         for payload in pending:
             self._publish(payload)
@@ -70,15 +114,13 @@ class Publisher(ConnectionService):
         # First check, are we closing?
         if self._closing:
             LOG.warning(_LW("Cannot send message, publisher is closing."))
-            if payload not in self._pending:
-                self._pending.append(payload)
+            self._pending[payload] = None
             return
 
         # Second check, are we open?
         if not self._open:
             LOG.debug(_("Cannot send message, publisher is connecting."))
-            if payload not in self._pending:
-                self._pending.append(payload)
+            self._pending[payload] = None
             self._reconnect()
             return
 
@@ -87,8 +129,7 @@ class Publisher(ConnectionService):
         if not self._connection or not self._channel:
             LOG.error(_LE("Cannot send message, publisher is "
                           "an unexpected state."))
-            if payload not in self._pending:
-                self._pending.append(payload)
+            self._pending[payload] = None
             self._reconnect()
             return
 
@@ -97,18 +138,16 @@ class Publisher(ConnectionService):
         try:
             self._channel.basic_publish(self._exchange_name,
                                         payload.topic,
-                                        json.dumps(payload.payload,
-                                                   ensure_ascii=False),
+                                        encoding.encode(payload.payload,
+                                                        self._content_type),
                                         self._properties)
-            if payload in self._pending:
-                self._pending.remove(payload)
+            self._pending.pop(payload, None)
             return True
         except (ConnectionClosed, AttributeError) as cc:
             LOG.warning(_LW("Attempted to send message on closed connection."))
             LOG.debug(cc)
             self._open = False
-            if payload not in self._pending:
-                self._pending.append(payload)
+            self._pending[payload] = None
             self._reconnect()
             return False
 
@@ -117,6 +156,202 @@ class Publisher(ConnectionService):
         """
         self._publish(Payload(topic, payload))
 
+    def publish_batch(self, payloads):
+        """Publishes a batch of payloads, along with any pending ones, in a
+        single transaction. If it fails, all of them are kept as pending.
+
+        :param payloads A list of Payload objects to send.
+        :return True if everything pending was sent.
+        """
+        self.add_pending(payloads)
+        if not self._pending:
+            return True
+        if self._closing or not self._open or not self._channel:
+            return False
+
+        batch = list(self._pending.keys())
+        try:
+            for payload in batch:
+                self._channel.basic_publish(self._exchange_name,
+                                            payload.topic,
+                                            encoding.encode(
+                                                payload.payload,
+                                                self._content_type),
+                                            self._properties)
+            self._channel.tx_commit()
+        except (AMQPError, AttributeError) as e:
+            LOG.warning(_LW("Failed to send a batch of %d messages."),
+                        len(batch))
+            LOG.debug(e)
+            self._open = False
+            return False
+
+        self.drop_pending(len(batch))
+        return True
+
+    def restart(self):
+        """Replace a broken connection with a new one. Batched publishers
+        don't reconnect by themselves, so their owner must call this.
+        """
+        try:
+            if self._connection:
+                self._close()
+        except AMQPError as e:
+            LOG.debug(e)
+            self._channel = None
+            self._connection = None
+        self.start()
+
+    def add_pending(self, payloads):
+        """Adds messages to the end of the pending messages.
+
+        :param payloads A list of Payload objects.
+        """
+        for payload in payloads:
+            self._pending[payload] = None
+
+    def pending_count(self):
+        """The number of messages waiting to be sent."""
+        return len(self._pending)
+
+    def drop_pending(self, count):
+        """Discards the oldest pending messages.
+
+        :param count The number of messages to discard.
+        """
+        for _i in range(min(count, len(self._pending))):
+            self._pending.popitem(last=False)
+
+
+class AsyncPublisher(transport.PublisherBase):
+    """Publishes messages from a background thread, so that API requests
+    don't have to wait for the broker.
+
+    Messages are put on a bounded queue, which the thread drains in batches
+    using a batched Publisher. What happens when the queue is full depends
+    on the publisher_overflow_policy option. Any queued messages are
+    flushed when the process exits.
+    """
+
+    def __init__(self, conf):
+        """Setup the publisher instance based on our configuration.
+
+        :param conf A configuration object.
+        """
+        self._conf = conf
+        self._queue = queue.Queue(maxsize=conf.publisher_queue_size)
+        self._publisher = Publisher(conf, batched=True)
+        self._stopping = threading.Event()
+        self._next_connect = 0
+        self._thread = threading.Thread(target=self._run,
+                                        name='storyboard-publisher')
+        self._thread.daemon = True
+
+    def start(self):
+        """Start the background publishing thread."""
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop accepting messages, and wait for the background thread to
+        publish everything which is queued.
+        """
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(self._conf.publisher_shutdown_timeout)
+        if self._thread.is_alive():
+            LOG.warning(_LW("Timed out publishing queued messages, "
+                            "%d messages were not sent."),
+                        self._queue.qsize() +
+                        self._publisher.pending_count())
+
+    def publish_message(self, topic, payload):
+        """Queue a message to be published to RabbitMQ.
+        """
+        if self._stopping.is_set():
+            LOG.warning(_LW("Cannot send message, publisher is closing."))
+            return
+
+        payload = Payload(topic, payload)
+        policy = self._conf.publisher_overflow_policy
+        try:
+            if policy == 'block':
+                self._queue.put(payload, True,
+                                self._conf.publisher_block_timeout)
+            else:
+                self._queue.put_nowait(payload)
+            return
+        except queue.Full:
+            if policy != 'drop_oldest':
+                LOG.warning(_LW("Publisher queue is full, dropping message "
+                                "for %s."), topic)
+                return
+
+        # Make space by throwing away the oldest message. Another thread
+        # may fill the space first, in which case the new message is lost.
+        try:
+            dropped = self._queue.get_nowait()
+            LOG.warning(_LW("Publisher queue is full, dropping message "
+                            "for %s."), dropped.topic)
+            self._queue.put_nowait(payload)
+        except (queue.Empty, queue.Full):
+            LOG.warning(_LW("Publisher queue is full, dropping message "
+                            "for %s."), topic)
+
+    def _next_batch(self):
+        """Wait for the next batch of messages to send. An empty batch is
+        returned if nothing arrives within the flush interval.
+        """
+        batch = []
+        try:
+            batch.append(self._queue.get(
+                True, self._conf.publisher_flush_interval))
+            while len(batch) < self._conf.publisher_batch_size:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _connect(self):
+        """Connect to RabbitMQ, unless we're waiting before retrying."""
+        if self._publisher._open:
+            return True
+        if time.time() < self._next_connect:
+            return False
+        try:
+            self._publisher.restart()
+        except AMQPError as e:
+            LOG.warning(_LW("Could not connect to RabbitMQ, retrying in "
+                            "%d seconds."), self._conf.rabbit_retry_delay)
+            LOG.debug(e)
+            self._next_connect = time.time() + self._conf.rabbit_retry_delay
+            return False
+        return True
+
+    def _send(self, batch):
+        self._publisher.add_pending(batch)
+        if self._connect():
+            self._publisher.publish_batch([])
+
+        # Don't let messages pile up without limit while RabbitMQ is away.
+        overflow = (self._publisher.pending_count() -
+                    self._conf.publisher_queue_size)
+        if overflow > 0:
+            LOG.warning(_LW("Dropping %d unsent messages."), overflow)
+            self._publisher.drop_pending(overflow)
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._next_batch()
+            if batch or self._publisher.pending_count():
+                self._send(batch)
+        try:
+            self._publisher.stop()
+        except AMQPError as e:
+            LOG.debug(e)
+
 
 class Payload(object):
     def __init__(self, topic, payload):
@@ -131,10 +366,28 @@ class Payload(object):
         self.payload = payload
 
 
+def create_publisher(conf):
+    """Create the publisher for the configured transport."""
+    if conf.transport == 'database':
+        return DatabasePublisher(conf)
+    if conf.publisher_async:
+        return AsyncPublisher(conf)
+    return Publisher(conf)
+
+
+def wants_full_payload(resource):
+    """Whether events for a resource type carry the whole resource before
+    and after each change, rather than just the fields which changed.
+    """
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+    return CONF.notifications.event_payload_mode == 'full' or \
+        resource in CONF.notifications.full_snapshot_resources
+
+
 def publish(resource, author_id=None, method=None, url=None, path=None,
             query_string=None, status=None, resource_id=None,
             sub_resource=None, sub_resource_id=None, resource_before=None,
-            resource_after=None):
+            resource_after=None, payload_mode='full'):
     """Send a message for an API event to the storyboard exchange. The message
     will be automatically JSON encoded.
 
@@ -150,12 +403,18 @@ def publish(resource, author_id=None, method=None, url=None, path=None,
     :param sub_resource_id: THe ID of the subresource.
     :param resource_before: The resource state before this event occurred.
     :param resource_after: The resource state after this event occurred.
+    :param payload_mode: 'diff' if the resource states only contain some of
+                         the resource's fields.
     """
     global PUBLISHER
 
-    if not PUBLISHER:
-        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
-        PUBLISHER = Publisher(CONF.notifications)
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+
+    # The database transport is already part of the request's transaction.
+    use_outbox = CONF.notifications.outbox_enabled and \
+        CONF.notifications.transport == 'rabbitmq'
+    if not PUBLISHER and not use_outbox:
+        PUBLISHER = create_publisher(CONF.notifications)
         PUBLISHER.start()
 
     payload = {
@@ -170,10 +429,32 @@ def publish(resource, author_id=None, method=None, url=None, path=None,
         "sub_resource": sub_resource,
         "sub_resource_id": sub_resource_id,
         "resource_before": resource_before,
-        "resource_after": resource_after
+        "resource_after": resource_after,
+        "published_at": time.time()
     }
 
-    if resource:
-        PUBLISHER.publish_message(resource, payload)
-    else:
+    if not resource:
         LOG.warning("Attempted to send payload with no destination resource.")
+        return
+
+    topic = resource
+    shards = CONF.notifications.rabbit_event_shards
+    if shards:
+        shard = sharding.shard_for(shards, resource, resource_id,
+                                   resource_before, resource_after)
+        topic = sharding.routing_key(resource, shard)
+
+    if payload_mode == 'full' and not wants_full_payload(resource):
+        # Consumers can load the resource themselves if they need more.
+        payload['resource_before'], payload['resource_after'] = \
+            encoding.diff(resource_before, resource_after)
+        payload_mode = 'diff'
+    if payload_mode == 'diff':
+        payload['payload_mode'] = 'diff'
+
+    if use_outbox:
+        # Stored in the request's transaction, so that the event is only
+        # sent if the change it describes is committed.
+        event_outbox.outbox_add(topic, payload)
+    else:
+        PUBLISHER.publish_message(topic, payload)
@@ -0,0 +1,58 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Helpers for splitting API events between several queues.
+
+When rabbit_event_shards is set, every event is published with a routing
+key of the form "<resource>.<shard>". All the events which affect the same
+story (or, for resources outside of stories, the same resource) end up in
+the same shard, so a single consumer sees them in the order they happened.
+"""
+
+import zlib
+
+import six
+
+
+def shard_for(shards, resource, resource_id, resource_before=None,
+              resource_after=None):
+    """Choose the shard for an event.
+
+    :param shards: The number of shards.
+    :param resource: The resource type.
+    :param resource_id: The ID of the resource.
+    :param resource_before: The resource state before the event.
+    :param resource_after: The resource state after the event.
+    :return: A shard index, between 0 and shards - 1.
+    """
+    story_id = None
+    if resource == 'story':
+        story_id = resource_id
+    else:
+        for state in (resource_after, resource_before):
+            if isinstance(state, dict) and state.get('story_id'):
+                story_id = state['story_id']
+                break
+
+    if story_id is not None:
+        key = 'story:%s' % story_id
+    else:
+        key = '%s:%s' % (resource, resource_id)
+
+    # crc32 rather than hash(), since the result must be the same in every
+    # API process.
+    return (zlib.crc32(six.b(key)) & 0xffffffff) % shards
+
+
+def routing_key(topic, shard):
+    """The routing key used for a topic within a shard."""
+    return '%s.%d' % (topic, shard)
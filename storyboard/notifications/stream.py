@@ -0,0 +1,267 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tells API processes when users get new subscription events, so that
+clients can wait for them instead of polling.
+
+The subscription worker publishes the IDs of the users it added events for
+on the subscription_events topic, once they are committed. Each API process
+has one SubscriptionEventHub, which listens on a queue of its own and wakes
+the requests waiting for those users. With the database transport there is
+no broker, so the hub looks for new events itself, with one query for all
+the waiting requests.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+from pika.exceptions import AMQPError
+from sqlalchemy import func
+
+from storyboard.db.api import base as api_base
+from storyboard.db import models
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications.connection_service import ConnectionService
+from storyboard.notifications import encoding
+from storyboard._i18n import _LW
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+SUBSCRIPTION_EVENTS_TOPIC = 'subscription_events'
+
+PUBLISHER = None
+HUB = None
+
+
+def notify(subscriber_ids):
+    """Tell the API processes that some users have new subscription events.
+    Only call this once the events are committed.
+
+    :param subscriber_ids: The IDs of the users.
+    """
+    global PUBLISHER
+
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+    if CONF.notifications.transport != 'rabbitmq' or not subscriber_ids:
+        # The hubs find new events in the database by themselves.
+        return
+
+    if PUBLISHER is None:
+        # Imported here, since the publisher needs things the API processes
+        # don't.
+        from storyboard.notifications import publisher
+        PUBLISHER = publisher.create_publisher(CONF.notifications)
+        PUBLISHER.start()
+    PUBLISHER.publish_message(SUBSCRIPTION_EVENTS_TOPIC,
+                              {'subscriber_ids': sorted(subscriber_ids)})
+
+
+def get_hub():
+    """The SubscriptionEventHub of this process, which is started the first
+    time it is needed.
+    """
+    global HUB
+
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+    # A forked process can't use its parent's threads.
+    if HUB is None or HUB.pid != os.getpid():
+        HUB = SubscriptionEventHub(CONF.notifications)
+        HUB.start()
+    return HUB
+
+
+class SubscriptionEventHub(object):
+    """Wakes the requests waiting for a user's new subscription events.
+
+    Waiting costs a threading.Event per request, and nothing else, since
+    the listener is shared by all of them.
+    """
+
+    def __init__(self, conf):
+        """Setup the hub based on our configuration.
+
+        :param conf A configuration object.
+        """
+        self.pid = os.getpid()
+        self._conf = conf
+        self._waiters = collections.defaultdict(set)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        if conf.transport == 'rabbitmq':
+            self._listener = RabbitListener(conf, self)
+        else:
+            self._listener = DatabaseListener(conf, self)
+        self._thread = threading.Thread(target=self._listener.run,
+                                        args=(self._stopping,),
+                                        name='storyboard-event-hub')
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self.notify(self.waiting_users())
+
+    def waiting_users(self):
+        """The IDs of the users with requests waiting."""
+        with self._lock:
+            return list(self._waiters.keys())
+
+    @contextlib.contextmanager
+    def listen(self, user_id):
+        """Listen for a user's new subscription events. Start listening
+        before looking for events in the database, so that none are missed
+        in between.
+
+        :param user_id: The ID of the user.
+        :return: A threading.Event, which is set when the user has new
+                 events.
+        """
+        woken = threading.Event()
+        with self._lock:
+            self._waiters[user_id].add(woken)
+        try:
+            yield woken
+        finally:
+            with self._lock:
+                waiters = self._waiters[user_id]
+                waiters.discard(woken)
+                if not waiters:
+                    del self._waiters[user_id]
+
+    def notify(self, user_ids):
+        """Wake the requests waiting for some users.
+
+        :param user_ids: The IDs of the users with new events.
+        """
+        with self._lock:
+            woken = [waiter for user_id in user_ids
+                     for waiter in self._waiters.get(user_id, ())]
+        for waiter in woken:
+            waiter.set()
+
+
+class RabbitListener(ConnectionService):
+    """Listens for new subscription events on a queue which only this
+    process consumes, and which goes away with it.
+    """
+
+    def __init__(self, conf, hub):
+        super(RabbitListener, self).__init__(conf)
+        self._hub = hub
+        self._retry_delay = conf.rabbit_retry_delay
+        self._queue_name = None
+        self.add_open_hook(self._declare_queue)
+
+    def _configure_channel(self):
+        # Nothing is published, so there is nothing to confirm.
+        pass
+
+    def _reconnect(self):
+        # The listener's thread reconnects by itself.
+        pass
+
+    def _declare_queue(self):
+        result = self._channel.queue_declare(queue='', exclusive=True,
+                                             auto_delete=True)
+        self._queue_name = result.method.queue
+        self._channel.queue_bind(exchange=self._exchange_name,
+                                 queue=self._queue_name,
+                                 routing_key=SUBSCRIPTION_EVENTS_TOPIC)
+
+    def run(self, stopping):
+        """Pass the users in each message to the hub until told to stop."""
+        while not stopping.is_set():
+            try:
+                if not self._open:
+                    self.start()
+                for method, properties, body in self._channel.consume(
+                        self._queue_name, inactivity_timeout=1):
+                    if stopping.is_set():
+                        break
+                    if method is None:
+                        continue
+                    self._channel.basic_ack(delivery_tag=method.delivery_tag)
+                    self._handle(properties, body)
+            except (AMQPError, AttributeError) as e:
+                LOG.warning(_LW("Lost the connection for subscription "
+                                "events, retrying in %d seconds."),
+                            self._retry_delay)
+                LOG.debug(e)
+                self._open = False
+                stopping.wait(self._retry_delay)
+
+        try:
+            self.stop()
+        except AMQPError as e:
+            LOG.debug(e)
+
+    def _handle(self, properties, body):
+        try:
+            payload = encoding.decode(body, properties.content_type)
+        except ValueError:
+            LOG.warning(_LW("Discarding subscription event message which "
+                            "can't be decoded."))
+            return
+        self._hub.notify(payload.get('subscriber_ids') or [])
+
+
+class DatabaseListener(object):
+    """Looks for new subscription events in the database, for the users
+    with waiting requests, every stream_database_poll_interval seconds.
+    """
+
+    def __init__(self, conf, hub):
+        self._hub = hub
+        self._interval = conf.stream_database_poll_interval
+        self._last_id = None
+
+    def run(self, stopping):
+        while not stopping.wait(self._interval):
+            try:
+                self.poll()
+            except Exception as e:
+                LOG.warning(_LW("Could not look for new subscription "
+                                "events."))
+                LOG.debug(e)
+
+    def poll(self):
+        """Wake the requests of the users who have had events since the last
+        poll.
+        """
+        session = api_base.get_session(in_request=False)
+        try:
+            last_id = session.query(
+                func.max(models.SubscriptionEvents.id)).scalar() or 0
+            previous_id, self._last_id = self._last_id, last_id
+
+            user_ids = self._hub.waiting_users()
+            if previous_id is None or not user_ids:
+                return
+            query = session.query(models.SubscriptionEvents.subscriber_id) \
+                .filter(models.SubscriptionEvents.id > previous_id) \
+                .filter(models.SubscriptionEvents.id <= last_id) \
+                .filter(models.SubscriptionEvents.subscriber_id.in_(
+                    user_ids)) \
+                .distinct()
+            woken = [user_id for (user_id,) in query]
+        finally:
+            session.close()
+
+        self._hub.notify(woken)
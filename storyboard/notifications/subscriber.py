@@ -13,24 +13,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import signal
 import time
 
 from oslo_config import cfg
 from oslo_log import log
-from pika.exceptions import ConnectionClosed
+from pika.exceptions import AMQPError
 from stevedore import enabled
 
+from storyboard.db.api import subscriptions as sub_api
+from storyboard.db.api import users as users_api
 from storyboard.notifications.conf import NOTIFICATION_OPTS
 from storyboard.notifications.connection_service import ConnectionService
-from storyboard._i18n import _, _LW
+from storyboard.notifications.database import DatabaseSubscriber
+from storyboard.notifications import encoding
+from storyboard.notifications import metrics
+from storyboard.notifications import sharding
+from storyboard.notifications import transport
+from storyboard.plugin.event_context import accepts_context
+from storyboard.plugin.event_context import EventContext
+from storyboard._i18n import _, _LE, _LI, _LW
 
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
 
-def subscribe():
+def subscribe(shard=None, metrics_queue=None):
+    """Handle API events with the worker plugins until told to stop.
+
+    :param shard: The shard to consume, when events are sharded.
+    :param metrics_queue: A multiprocessing queue to send metrics to. No
+                          metrics are collected without one.
+    """
     try:
         log.register_options(CONF)
     except cfg.ArgsAlreadyParsedError:
@@ -40,7 +57,7 @@ def subscribe():
     CONF(project='storyboard')
     CONF.register_opts(NOTIFICATION_OPTS, "notifications")
 
-    subscriber = Subscriber(CONF.notifications)
+    subscriber = create_subscriber(CONF.notifications, shard=shard)
     subscriber.start()
 
     manager = enabled.EnabledExtensionManager(
@@ -50,28 +67,239 @@ def subscribe():
         invoke_args=(CONF,)
     )
 
-    while subscriber.started:
-        (method, properties, body) = subscriber.get()
+    worker_metrics = None
+    reporter = None
+    if metrics_queue is not None:
+        worker_metrics = metrics.WorkerMetrics()
+        reporter = metrics.Reporter(
+            worker_metrics, metrics_queue,
+            CONF.notifications.worker_metrics_interval)
+        reporter.start()
+
+    project_groups = None
+    if CONF.notifications.project_group_cache_ttl:
+        project_groups = sub_api.ProjectGroupCache(
+            CONF.notifications.project_group_cache_ttl)
+
+    dispatcher = EventDispatcher(manager,
+                                 CONF.notifications.subscriber_plugin_timeout,
+                                 worker_metrics=worker_metrics,
+                                 project_groups=project_groups,
+                                 preferences=users_api.get_preference_store())
+
+    def drain(sig, frame):
+        LOG.info(_LI("Finishing in-flight messages before exiting."))
+        subscriber.drain()
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+
+    consume_events(subscriber, dispatcher, CONF.notifications)
+    subscriber.stop()
+    dispatcher.close()
+    if reporter:
+        reporter.stop()
+
+
+def create_subscriber(conf, shard=None):
+    """Create the subscriber for the configured transport.
+
+    :param conf: A configuration object.
+    :param shard: The shard to consume, when events are sharded.
+    """
+    if conf.transport == 'database':
+        return DatabaseSubscriber(conf, shard=shard)
+    return Subscriber(conf, shard=shard)
+
+
+def consume_events(subscriber, dispatcher, conf):
+    """Pass messages from the subscriber to the worker plugins until the
+    subscriber is stopped or drained. Messages are acknowledged in groups,
+    once every plugin has handled them.
 
-        if not method or not properties:
-            LOG.debug(_("No messages available, sleeping for 5 seconds."))
+    :param subscriber: A started subscriber, for any transport.
+    :param dispatcher: The EventDispatcher for the worker plugins.
+    :param conf: A configuration object.
+    """
+    while subscriber.started and not subscriber.draining:
+        if not subscriber.is_open():
+            LOG.debug(_("Not connected, sleeping for 5 seconds."))
             time.sleep(5)
             continue
 
-        manager.map(handle_event, body)
+        last_tag = None
+        unacked = 0
+        for (method, properties, body) in subscriber.consume(
+                conf.subscriber_inactivity_timeout):
+            if method:
+                dispatcher.dispatch(body, properties.content_type)
+                last_tag = method.delivery_tag
+                unacked += 1
+
+            # Acknowledge everything handled so far once the group is full,
+            # the queue has gone quiet, or we've been asked to stop.
+            if last_tag is not None and (
+                    unacked >= conf.subscriber_ack_batch_size or
+                    not method or subscriber.draining):
+                dispatcher.wait()
+                subscriber.ack(last_tag, multiple=True)
+                last_tag = None
+                unacked = 0
+
+            if subscriber.draining:
+                break
+
+    # Hand any prefetched messages that weren't handled back to the queue.
+    subscriber.cancel()
+
+
+class EventDispatcher(object):
+    """Runs every worker plugin on each event at the same time. Each plugin
+    has its own thread, so a slow or failing plugin doesn't hold up the
+    others, and each plugin still sees events in the order they arrive.
+    """
 
-        # Ack the message
-        subscriber.ack(method.delivery_tag)
+    def __init__(self, manager, timeout, worker_metrics=None,
+                 project_groups=None, preferences=None):
+        """Create a thread for each of the manager's plugins.
+
+        :param manager: The extension manager for the worker plugins.
+        :param timeout: How long (in seconds) to wait for the plugins to
+                        handle an event.
+        :param worker_metrics: The WorkerMetrics to record events in.
+        :param project_groups: A ProjectGroupCache for the plugins to
+                               find subscribers with.
+        :param preferences: A PreferenceStore for the plugins to read users'
+                            preferences from.
+        """
+        self._extensions = list(manager.extensions)
+        self._timeout = timeout
+        self._metrics = worker_metrics
+        self._project_groups = project_groups
+        self._preferences = preferences
+        self._pools = dict((ext.name, ThreadPool(1))
+                           for ext in self._extensions)
+        # Events which plugins were still handling when they timed out.
+        self._pending = []
+
+    def dispatch(self, body, content_type=None):
+        """Handle an event from the queue with every plugin, returning once
+        they have all finished or the timeout has passed.
+
+        :param body: The body of the event.
+        :param content_type: The content type of the body.
+        """
+        try:
+            payload = encoding.decode(body, content_type)
+        except ValueError:
+            LOG.error(_LE("Discarding message which can't be decoded as "
+                          "%s."), content_type or encoding.JSON)
+            return
+
+        if self._metrics:
+            published_at = payload.get('published_at')
+            self._metrics.record_event(
+                time.time() - published_at if published_at else None)
+
+        if self._project_groups and \
+                payload.get('resource') == 'project_group':
+            self._project_groups.invalidate()
+
+        if self._preferences and payload.get('resource') == 'user' \
+                and payload.get('resource_id'):
+            self._preferences.invalidate(int(payload['resource_id']))
+
+        # Shared by every plugin, so the event's author, subscribers and so
+        # on are only looked up once.
+        context = EventContext(
+            author_id=payload.get('author_id') or None,
+            resource=payload.get('resource') or None,
+            resource_id=payload.get('resource_id') or None,
+            resource_before=payload.get('resource_before') or None,
+            resource_after=payload.get('resource_after') or None,
+            diff_only=payload.get('payload_mode') == 'diff',
+            project_groups=self._project_groups,
+            preferences=self._preferences)
+
+        results = [(ext, self._pools[ext.name].apply_async(
+            handle_event, (ext, payload, context, self._metrics)))
+            for ext in self._extensions]
+
+        deadline = time.time() + self._timeout
+        for ext, result in results:
+            if not self._finish(ext, result,
+                                max(0, deadline - time.time())):
+                # The plugin's thread carries on, and its next event waits
+                # for it to finish. The event isn't acknowledged until it
+                # does, so that it isn't lost if the worker stops.
+                LOG.warning(_LW("Worker plugin %s timed out handling an "
+                                "event."), ext.name)
+                if self._metrics:
+                    self._metrics.record_timeout(ext.name)
+                self._pending.append((ext, result))
+
+    def wait(self):
+        """Wait for the plugins which timed out to finish handling their
+        events, before the events are acknowledged.
+        """
+        pending, self._pending = self._pending, []
+        for ext, result in pending:
+            self._finish(ext, result)
+
+    def _finish(self, ext, result, timeout=None):
+        """Wait for a plugin to handle an event, and log it if it failed.
+
+        :return: False if the plugin is still handling the event once the
+                 timeout has passed.
+        """
+        try:
+            result.get(timeout)
+        except multiprocessing.TimeoutError:
+            return False
+        except Exception:
+            LOG.exception(_LE("Worker plugin %s failed to handle an "
+                              "event."), ext.name)
+            if self._metrics:
+                self._metrics.record_failure(ext.name)
+        return True
+
+    def close(self):
+        """Stop accepting events. The threads are daemons, so a plugin that
+        is stuck won't keep the process alive.
+        """
+        for pool in self._pools.values():
+            pool.close()
 
 
-def handle_event(ext, body):
+def handle_event(ext, payload, context=None, worker_metrics=None):
     """Handle an event from the queue.
 
     :param ext: The extension that's handling this event.
-    :param body: The body of the event.
+    :param payload: The decoded body of the event.
+    :param context: The EventContext shared by the plugins.
+    :param worker_metrics: The WorkerMetrics to record the plugin's time
+                           and database queries in.
     :return: The result of the handler.
     """
-    payload = json.loads(body)
+    if worker_metrics is None:
+        return _call_plugin(ext, payload, context)
+
+    # Each plugin has its own thread, so only its own queries are counted.
+    started = time.time()
+    metrics.start_counting_queries()
+    try:
+        return _call_plugin(ext, payload, context)
+    finally:
+        worker_metrics.record_plugin(ext.name, time.time() - started,
+                                     metrics.stop_counting_queries())
+
+
+def _call_plugin(ext, payload, context):
+    # Plugins which override event() may not take the context.
+    kwargs = {}
+    if accepts_context(ext.obj.event):
+        kwargs['context'] = context
+
     return ext.obj.event(author_id=payload['author_id'] or None,
                          method=payload['method'] or None,
                          url=payload['url'] or None,
@@ -83,7 +311,8 @@ def handle_event(ext, body):
                          sub_resource=payload['sub_resource'] or None,
                          sub_resource_id=payload['sub_resource_id'] or None,
                          resource_before=payload['resource_before'] or None,
-                         resource_after=payload['resource_after'] or None)
+                         resource_after=payload['resource_after'] or None,
+                         **kwargs)
 
 
 def check_enabled(ext):
@@ -95,17 +324,22 @@ def check_enabled(ext):
     return ext.obj.enabled()
 
 
-class Subscriber(ConnectionService):
-    def __init__(self, conf):
+class Subscriber(ConnectionService, transport.SubscriberBase):
+    def __init__(self, conf, shard=None):
         """Setup the subscriber instance based on our configuration.
 
         :param conf A configuration object.
+        :param shard The shard to consume, when events are sharded.
         """
         super(Subscriber, self).__init__(conf)
 
         self._queue_name = conf.rabbit_event_queue_name
-        self._binding_keys = ['task', 'story', 'project', 'project_group',
-                              'timeline_event']
+        self._prefetch_count = conf.rabbit_prefetch_count
+        self.draining = False
+        self._binding_keys = transport.binding_keys(shard)
+
+        if shard is not None:
+            self._queue_name = sharding.routing_key(self._queue_name, shard)
         self.add_open_hook(self._declare_queue)
 
     def _declare_queue(self):
@@ -113,6 +347,7 @@ class Subscriber(ConnectionService):
         """
         self._channel.queue_declare(queue=self._queue_name,
                                     durable=True)
+        self._channel.basic_qos(prefetch_count=self._prefetch_count)
 
         # Set up the queue bindings.
         for binding_key in self._binding_keys:
@@ -120,35 +355,62 @@ class Subscriber(ConnectionService):
                                      queue=self._queue_name,
                                      routing_key=binding_key)
 
-    def ack(self, delivery_tag):
-        """Acknowledge receipt and processing of the message.
-        """
-        self._channel.basic_ack(delivery_tag)
+    def is_open(self):
+        """Whether the subscriber is connected, and able to consume."""
+        return self._open and not self._closing
 
-    def get(self):
-        """Get a single message from the queue. If the subscriber is currently
-        waiting to reconnect, it will return None. Note that you must
-        manually ack the message after it has been successfully processed.
+    def ack(self, delivery_tag, multiple=False):
+        """Acknowledge receipt and processing of the message.
 
-        :rtype: (None, None, None)|(spec.Basic.Get,
-                                    spec.Basic.Properties,
-                                    str or unicode)
+        :param delivery_tag The delivery tag of the message.
+        :param multiple Also acknowledge every earlier unacknowledged
+                        message.
         """
+        try:
+            self._channel.basic_ack(delivery_tag=delivery_tag,
+                                    multiple=multiple)
+        except (AMQPError, AttributeError) as e:
+            # The broker will redeliver the messages after we reconnect.
+            LOG.warning(_LW("Attempted to ack message on closed "
+                            "connection."))
+            LOG.debug(e)
+            self._open = False
+            self._reconnect()
 
-        # Sanity check one, are we closing?
-        if self._closing:
-            return None, None, None
-
-        # Sanity check two, are we open, or reconnecting?
-        if not self._open:
-            return None, None, None
+    def consume(self, inactivity_timeout=None):
+        """Iterate over the messages delivered to the subscriber. The broker
+        pushes up to rabbit_prefetch_count messages ahead of the ones which
+        have been acknowledged. If nothing arrives within the inactivity
+        timeout, (None, None, None) is yielded. Note that you must manually
+        ack the messages after they have been successfully processed.
+
+        :param inactivity_timeout Seconds to wait for a message.
+        :rtype: generator of (None, None, None)|(spec.Basic.Deliver,
+                                                 spec.BasicProperties,
+                                                 str or unicode)
+        """
+        if not self.is_open():
+            return
 
         try:
-            return self._channel.basic_get(queue=self._queue_name,
-                                           no_ack=False)
-        except ConnectionClosed as cc:
-            LOG.warning(_LW("Attempted to get message on closed connection."))
-            LOG.debug(cc)
+            for message in self._channel.consume(
+                    self._queue_name,
+                    inactivity_timeout=inactivity_timeout):
+                yield message
+        except (AMQPError, AttributeError) as e:
+            LOG.warning(_LW("Attempted to get message on closed "
+                            "connection."))
+            LOG.debug(e)
             self._open = False
             self._reconnect()
-            return None, None, None
+
+    def cancel(self):
+        """Stop consuming. Messages which were delivered but not yet
+        acknowledged are returned to the queue.
+        """
+        if not self.is_open():
+            return
+        try:
+            self._channel.cancel()
+        except (AMQPError, AttributeError) as e:
+            LOG.debug(e)
@@ -0,0 +1,109 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The interface between API events and the service that carries them to
+the worker daemon.
+
+The transport option chooses the implementation. 'rabbitmq' uses a
+RabbitMQ topic exchange, and 'database' uses the event_queue table, so
+that small deployments don't need a broker.
+"""
+
+import abc
+
+import six
+
+from storyboard.notifications import sharding
+
+
+# The topics consumed by the worker daemon. Events on other topics are
+# dropped, unless something else is listening to the exchange. User events
+# also make the worker daemon forget the users' cached preferences.
+EVENT_TOPICS = ['task', 'story', 'project', 'project_group',
+                'timeline_event', 'user']
+
+
+def binding_keys(shard=None):
+    """The topics consumed from a shard, or from the unsharded queue."""
+    if shard is None:
+        return list(EVENT_TOPICS)
+    return [sharding.routing_key(topic, shard) for topic in EVENT_TOPICS]
+
+
+@six.add_metaclass(abc.ABCMeta)
+class PublisherBase(object):
+    """Sends API events to the worker daemon."""
+
+    @abc.abstractmethod
+    def start(self):
+        """Get ready to publish messages."""
+
+    @abc.abstractmethod
+    def stop(self):
+        """Stop publishing, sending anything still waiting if possible."""
+
+    @abc.abstractmethod
+    def publish_message(self, topic, payload):
+        """Publish a message.
+
+        :param topic: The topic of the message.
+        :param payload: The payload, made of JSON compatible types.
+        """
+
+
+@six.add_metaclass(abc.ABCMeta)
+class SubscriberBase(object):
+    """Receives API events for the worker daemon.
+
+    Messages are delivered as (method, properties, body) tuples. The
+    method's delivery_tag is used to acknowledge the message, and the
+    properties' content_type is used to decode the body.
+    """
+
+    started = False
+    draining = False
+
+    @abc.abstractmethod
+    def start(self):
+        """Start receiving messages."""
+
+    @abc.abstractmethod
+    def stop(self):
+        """Stop receiving messages."""
+
+    @abc.abstractmethod
+    def is_open(self):
+        """Whether the subscriber is able to consume."""
+
+    @abc.abstractmethod
+    def consume(self, inactivity_timeout=None):
+        """Iterate over delivered messages, yielding (None, None, None)
+        whenever nothing arrives within the inactivity timeout.
+        """
+
+    @abc.abstractmethod
+    def ack(self, delivery_tag, multiple=False):
+        """Acknowledge that a message has been handled.
+
+        :param delivery_tag: The delivery tag of the message.
+        :param multiple: Also acknowledge every earlier unacknowledged
+                         message.
+        """
+
+    @abc.abstractmethod
+    def cancel(self):
+        """Stop consuming, returning unacknowledged messages to the queue.
+        """
+
+    def drain(self):
+        """Stop consuming after the message currently being handled."""
+        self.draining = True
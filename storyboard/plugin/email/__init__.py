@@ -64,7 +64,76 @@ PLUGIN_OPTS = [
                help="Username/login for the SMTP server."),
     cfg.StrOpt("smtp_password",
                default=None,
-               help="Password for the SMTP server.")
+               help="Password for the SMTP server."),
+    cfg.IntOpt("smtp_pool_size",
+               default=2,
+               help="The number of idle SMTP connections each worker "
+                    "process keeps open between emails. 0 opens a new "
+                    "connection for every event."),
+    cfg.IntOpt("smtp_pool_max_messages",
+               default=100,
+               help="The number of emails to send over an SMTP connection "
+                    "before replacing it."),
+    cfg.IntOpt("smtp_pool_idle_timeout",
+               default=60,
+               help="How long, in seconds, to keep an idle SMTP connection "
+                    "open."),
+    cfg.IntOpt("smtp_pool_keepalive_interval",
+               default=15,
+               help="How long, in seconds, an SMTP connection can be idle "
+                    "before it is checked with NOOP before being reused."),
+    cfg.IntOpt("smtp_recipients_per_message",
+               default=1,
+               help="The number of subscribers to send an event's email to "
+                    "in one SMTP transaction. Above 1, the recipients are "
+                    "hidden from each other, and the To header doesn't name "
+                    "them."),
+    cfg.StrOpt("template_cache_dir",
+               default=None,
+               help="A directory in which to cache the compiled email "
+                    "templates, so that new worker processes don't need "
+                    "to compile them again (optional)."),
+    cfg.IntOpt("digest_batch_size",
+               default=100,
+               help="The number of email digests to send before recording "
+                    "which users have been sent theirs."),
+    cfg.BoolOpt("spool",
+                default=False,
+                help="Write emails to the mail_queue table instead of "
+                     "sending them, for storyboard-mail-sender to deliver."),
+    cfg.IntOpt("spool_batch_size",
+               default=50,
+               help="The number of spooled emails the sender claims at "
+                    "once."),
+    cfg.IntOpt("spool_poll_interval",
+               default=5,
+               help="How long, in seconds, the sender waits before looking "
+                    "for more emails when the spool is empty."),
+    cfg.IntOpt("spool_concurrency",
+               default=2,
+               help="The number of emails the sender sends at once. Keep "
+                    "this at or below smtp_pool_size."),
+    cfg.IntOpt("spool_claim_timeout",
+               default=300,
+               help="How long, in seconds, a sender has to deliver the "
+                    "emails it claimed before other senders may take "
+                    "them."),
+    cfg.IntOpt("spool_domain_rate_limit",
+               default=0,
+               help="The number of emails each sender may send to a domain "
+                    "a minute. 0 means no limit."),
+    cfg.IntOpt("spool_max_attempts",
+               default=8,
+               help="The number of times to try sending an email before "
+                    "keeping it as a dead letter."),
+    cfg.IntOpt("spool_retry_delay",
+               default=60,
+               help="How long, in seconds, to wait before trying to send an "
+                    "email again. It doubles with each failed attempt."),
+    cfg.IntOpt("spool_retry_max_delay",
+               default=3600,
+               help="The longest time, in seconds, to wait before trying to "
+                    "send an email again.")
 ]
 
 CONF.register_opts(PLUGIN_OPTS, "plugin_email")
@@ -0,0 +1,284 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+from datetime import datetime
+from datetime import timedelta
+import json
+import smtplib
+
+from apscheduler.triggers.interval import IntervalTrigger
+from jinja2.exceptions import TemplateNotFound
+from oslo_config import cfg
+from oslo_log import log
+import pytz
+import six
+from sqlalchemy import and_
+from sqlalchemy import or_
+
+import storyboard.db.api.base as api_base
+import storyboard.db.models as models
+from storyboard.plugin.email.base import EmailPluginBase
+from storyboard.plugin.email.factory import EmailFactory
+from storyboard.plugin.email import spool
+from storyboard.plugin.scheduler.base import SchedulerPluginBase
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+DIGEST_PREFERENCES = ('plugin_email_enable', 'plugin_email_digest',
+                      'plugin_email_digest_time')
+DEFAULT_DIGEST_TIME = 8 * 60 * 60
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def last_digest_time(digest_time, now):
+    """The most recent time a user's digest was due.
+
+    :param digest_time: The time of day the user wants their digest, as
+                        seconds past midnight UTC.
+    :param now: The current time.
+    """
+    try:
+        digest_time = int(digest_time) % SECONDS_PER_DAY
+    except (TypeError, ValueError):
+        digest_time = DEFAULT_DIGEST_TIME
+
+    due = now.replace(hour=0, minute=0, second=0, microsecond=0) + \
+        timedelta(seconds=digest_time)
+    if due > now:
+        due -= timedelta(days=1)
+    return due
+
+
+class EmailDigest(EmailPluginBase, SchedulerPluginBase):
+    """A Cron Plugin which sends a daily email to each user who asked for
+    a digest, with the subscription events they've had since their last
+    one. Events are grouped by the story they are about.
+    """
+
+    def trigger(self):
+        """This plugin executes every ten minutes, so digests are sent
+        shortly after the time users ask for them.
+        """
+        return IntervalTrigger(minutes=10, timezone=pytz.utc)
+
+    def run(self):
+        """Send the digests which are due."""
+        now = datetime.now(pytz.utc)
+        session = api_base.get_session(in_request=False,
+                                       autocommit=False,
+                                       expire_on_commit=True)
+        try:
+            due = self.get_due_users(session, now)
+            if not due:
+                return
+
+            try:
+                factory = self.get_factory()
+            except TemplateNotFound as e:
+                LOG.error("Digest templates not found: %s" % (e,))
+                return
+
+            batch_size = max(1, CONF.plugin_email.digest_batch_size)
+            with spool.get_mail_client(session) as smtp_client:
+                for start in range(0, len(due), batch_size):
+                    self.send_digests(session, smtp_client, factory,
+                                      due[start:start + batch_size], now)
+                    # Record progress, so that if this run stops, nobody
+                    # gets the same digest twice.
+                    session.commit()
+        except Exception as e:
+            LOG.error("Cannot send email digests: %s" % (e,))
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_factory(self):
+        email_config = CONF.plugin_email
+        factory = EmailFactory(sender=email_config.sender,
+                               subject='digest/digest_subject.txt',
+                               text_template='digest/digest.txt')
+        if email_config.reply_to:
+            factory.add_header('Reply-To', email_config.reply_to)
+        factory.add_header('X-StoryBoard-Subscription-Type', 'digest')
+        return factory
+
+    def get_due_users(self, session, now):
+        """Find the users who want email digests, and haven't had one since
+        it was last due.
+
+        :return: A list of (user, state, due) tuples, where state is the
+                 user's EmailDigestState, or None if they've never had a
+                 digest.
+        """
+        preferences = collections.defaultdict(dict)
+        query = api_base.model_query(models.UserPreference, session) \
+            .filter(models.UserPreference.key.in_(DIGEST_PREFERENCES))
+        for preference in query:
+            preferences[preference.user_id][preference.key] = \
+                preference.cast_value
+
+        # Only the users the individual email worker skips.
+        user_ids = [user_id for user_id, values in six.iteritems(preferences)
+                    if values.get('plugin_email_enable') == 'true' and
+                    values.get('plugin_email_digest')]
+        if not user_ids:
+            return []
+
+        users = api_base.model_query(models.User, session) \
+            .filter(models.User.id.in_(user_ids)) \
+            .order_by(models.User.id).all()
+        states = dict(
+            (state.user_id, state) for state in
+            api_base.model_query(models.EmailDigestState, session)
+            .filter(models.EmailDigestState.user_id.in_(user_ids)))
+
+        due_users = []
+        for user in users:
+            due = last_digest_time(
+                preferences[user.id].get('plugin_email_digest_time',
+                                         DEFAULT_DIGEST_TIME), now)
+            state = states.get(user.id)
+            if state is None or state.last_sent_at is None or \
+                    state.last_sent_at < due:
+                due_users.append((user, state, due))
+        return due_users
+
+    def get_pending_events(self, session, due_users):
+        """Get the subscription events which haven't been sent to a batch of
+        users yet, in a single query.
+
+        :return: A dict of lists of events, keyed by user ID.
+        """
+        conditions = []
+        for user, state, due in due_users:
+            if state is not None and state.last_event_id is not None:
+                conditions.append(and_(
+                    models.SubscriptionEvents.subscriber_id == user.id,
+                    models.SubscriptionEvents.id > state.last_event_id))
+            else:
+                conditions.append(and_(
+                    models.SubscriptionEvents.subscriber_id == user.id,
+                    models.SubscriptionEvents.created_at >=
+                    self.get_since(state, due)))
+
+        events = collections.defaultdict(list)
+        query = api_base.model_query(models.SubscriptionEvents, session) \
+            .filter(or_(*conditions)) \
+            .order_by(models.SubscriptionEvents.id)
+        for event in query:
+            events[event.subscriber_id].append(event)
+        return events
+
+    def send_digests(self, session, smtp_client, factory, due_users, now):
+        """Send the digests for a batch of users, and record how far each
+        one got.
+        """
+        pending = self.get_pending_events(session, due_users)
+
+        # Resolve everything the digests mention at once.
+        infos = {}
+        author_ids = set()
+        story_ids = set()
+        for events in six.itervalues(pending):
+            for event in events:
+                info = self.get_event_info(event)
+                infos[event.id] = info
+                author_ids.add(event.author_id)
+                if info.get('story_id') is not None:
+                    story_ids.add(info['story_id'])
+        authors = self.get_by_id(session, models.User, author_ids)
+        stories = self.get_by_id(session, models.Story, story_ids)
+
+        url = CONF.plugin_email.default_url
+        for user, state, due in due_users:
+            events = pending.get(user.id, [])
+            if events:
+                sections = self.group_by_story(events, infos, authors,
+                                               stories)
+                message = factory.build(recipient=user.email,
+                                        user=user,
+                                        stories=sections[0],
+                                        other_events=sections[1],
+                                        event_count=len(events),
+                                        since=self.get_since(state, due),
+                                        url=url)
+                try:
+                    smtp_client.sendmail(from_addr=message.get('From'),
+                                         to_addrs=message.get('To'),
+                                         msg=message.as_string())
+                except smtplib.SMTPException as e:
+                    # Try again next time.
+                    LOG.error('Cannot send email digest to user %s: %s' %
+                              (user.id, e))
+                    continue
+
+            if state is None:
+                state = models.EmailDigestState(user_id=user.id)
+                session.add(state)
+            if events:
+                state.last_event_id = events[-1].id
+            state.last_sent_at = now
+
+    def get_since(self, state, due):
+        """When a user's digest starts. A user's first digest has the events
+        of the day before it was due.
+        """
+        if state is not None and state.last_sent_at is not None:
+            return state.last_sent_at
+        return due - timedelta(days=1)
+
+    def get_event_info(self, event):
+        try:
+            info = json.loads(event.event_info or '{}')
+        except ValueError:
+            return {}
+        if not isinstance(info, dict):
+            return {}
+        return info
+
+    def get_by_id(self, session, model, ids):
+        if not ids:
+            return {}
+        query = api_base.model_query(model, session) \
+            .filter(model.id.in_(ids))
+        return dict((entity.id, entity) for entity in query)
+
+    def group_by_story(self, events, infos, authors, stories):
+        """Group a user's events by the story they are about.
+
+        :return: A list of stories, each with its list of events, and a list
+                 of the events which aren't about a story.
+        """
+        sections = collections.OrderedDict()
+        other_events = []
+        for event in events:
+            info = infos[event.id]
+            entry = {'event_type': event.event_type,
+                     'author': authors.get(event.author_id),
+                     'created_at': event.created_at,
+                     'info': info}
+            story_id = info.get('story_id')
+            if story_id is None:
+                other_events.append(entry)
+                continue
+            if story_id not in sections:
+                story = stories.get(story_id)
+                sections[story_id] = {
+                    'id': story_id,
+                    'title': story.title if story else info.get(
+                        'story_title'),
+                    'events': []}
+            sections[story_id]['events'].append(entry)
+        return list(sections.values()), other_events
@@ -14,15 +14,92 @@
 
 
 import collections
+import posixpath
 import re
 import six
+import threading
 
+from email.header import Header
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate
+from email.utils import make_msgid
 
 from jinja2 import Environment
+from jinja2 import FileSystemBytecodeCache
 from jinja2 import PackageLoader
+from oslo_config import cfg
+
+
+CONF = cfg.CONF
+
+DEFAULT_TEMPLATE_PACKAGE = 'storyboard.plugin.email'
+SUBJECT_SUFFIX = '_subject.txt'
+
+_ENVIRONMENTS = {}
+_MATRICES = {}
+_LOCK = threading.Lock()
+
+
+def get_environment(template_package=DEFAULT_TEMPLATE_PACKAGE):
+    """The Jinja2 environment for a package's templates, shared by the
+    whole process. Templates are compiled once and kept. If the
+    template_cache_dir option is set, the compiled code is also cached on
+    disk for the next process.
+    """
+    with _LOCK:
+        if template_package not in _ENVIRONMENTS:
+            cache_dir = CONF.plugin_email.template_cache_dir
+            bytecode_cache = None
+            if cache_dir:
+                bytecode_cache = FileSystemBytecodeCache(cache_dir)
+            _ENVIRONMENTS[template_package] = Environment(
+                loader=PackageLoader(template_package, 'templates'),
+                bytecode_cache=bytecode_cache,
+                cache_size=-1,
+                auto_reload=False)
+        return _ENVIRONMENTS[template_package]
+
+
+def get_template_matrix(template_package=DEFAULT_TEMPLATE_PACKAGE):
+    """Find and compile the templates for every resource, sub-resource and
+    method which has them. See SubscriptionEmailWorker.get_templates for
+    how they are laid out.
+
+    :return: A dict of (subject, text, html) template names, keyed by
+             (resource, sub_resource, method). The HTML template name is
+             None if there isn't one.
+    """
+    with _LOCK:
+        if template_package in _MATRICES:
+            return _MATRICES[template_package]
+
+    env = get_environment(template_package)
+    names = set(env.list_templates())
+    matrix = {}
+    for name in names:
+        if not name.endswith(SUBJECT_SUFFIX):
+            continue
+        base, subject_file = posixpath.split(name)
+        method = subject_file[:-len(SUBJECT_SUFFIX)]
+        text = posixpath.join(base, '%s.txt' % (method,))
+        if not base or text not in names:
+            continue
+        html = posixpath.join(base, '%s.html' % (method,))
+        if html not in names:
+            html = None
+
+        parts = base.split('/')
+        sub_resource = parts[1] if len(parts) > 1 else None
+        matrix[(parts[0], sub_resource, method)] = (name, text, html)
+
+        for template in (name, text, html):
+            if template:
+                env.get_template(template)
+
+    with _LOCK:
+        _MATRICES[template_package] = matrix
+    return matrix
 
 
 class EmailFactory(object):
@@ -32,7 +109,7 @@ class EmailFactory(object):
     """
 
     def __init__(self, sender, subject, text_template,
-                 template_package='storyboard.plugin.email'):
+                 template_package=DEFAULT_TEMPLATE_PACKAGE):
         """Create a new instance of the email renderer.
 
         :param sender: The sender of this email.
@@ -42,12 +119,12 @@ class EmailFactory(object):
         """
         super(EmailFactory, self).__init__()
 
-        # Build our template classpath loader and template cache. Default
-        # text encoding is UTF-8. The use of OrderedDict is important,
-        # as the Email RFC specifies rendering priority based on order.
+        # Use the shared environment, which has already compiled the
+        # templates. Default text encoding is UTF-8. The use of OrderedDict
+        # is important, as the Email RFC specifies rendering priority based
+        # on order.
         self.template_cache = collections.OrderedDict()
-        self.env = Environment(loader=PackageLoader(template_package,
-                                                    'templates'))
+        self.env = get_environment(template_package)
 
         # Store internal values.
         self.sender = sender
@@ -83,11 +160,22 @@ class EmailFactory(object):
         :param kwargs: Additional key/value arguments to be rendered.
         :return: The email instance.
         """
+        return self._build(recipient, **kwargs)
+
+    def render(self, **kwargs):
+        """Render this email once, for any number of recipients.
+
+        :param kwargs: Additional key/value arguments to be rendered.
+        :return: A RenderedEmail.
+        """
+        return RenderedEmail(self._build(None, **kwargs))
 
+    def _build(self, recipient, **kwargs):
         # Create message container as multipart/alternative.
         msg = MIMEMultipart('alternative')
         msg['From'] = self.sender
-        msg['To'] = recipient
+        if recipient is not None:
+            msg['To'] = recipient
         msg['Date'] = formatdate(localtime=True)
 
         # Render the subject template. Add length and \r\n sanity check
@@ -113,3 +201,36 @@ class EmailFactory(object):
             msg.attach(MIMEText(body_part, type, "utf-8"))
 
         return msg
+
+
+class RenderedEmail(object):
+    """An email which has been rendered and serialized once. Only the
+    headers which differ for each recipient are added when it is sent.
+    """
+
+    UNDISCLOSED_RECIPIENTS = 'undisclosed-recipients:;'
+
+    def __init__(self, message):
+        """Create a rendered email.
+
+        :param message: The email, without a To header.
+        """
+        self.sender = message.get('From')
+        self.headers, self.body = message.as_string().split('\n\n', 1)
+
+    def _stamp(self, to):
+        return '\n'.join([self.headers,
+                          'To: %s' % (Header(to, header_name='To').encode(),),
+                          'Message-ID: %s' % (make_msgid(),),
+                          '',
+                          self.body])
+
+    def for_recipient(self, recipient):
+        """The email as sent to a single recipient."""
+        return self._stamp(recipient)
+
+    def for_recipients(self):
+        """The email as sent to several recipients in one transaction, which
+        don't see each others' addresses.
+        """
+        return self._stamp(self.UNDISCLOSED_RECIPIENTS)
@@ -0,0 +1,229 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+from multiprocessing.pool import ThreadPool
+import smtplib
+import socket
+import threading
+import time
+import uuid
+
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_log import log
+import six
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import mail_queue
+from storyboard.plugin.email import smtp_client as smtp
+from storyboard._i18n import _LE, _LI, _LW
+
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+
+def run():
+    """Deliver the emails in the mail spool, for as long as the process
+    runs.
+    """
+    try:
+        log.register_options(CONF)
+    except cfg.ArgsAlreadyParsedError:
+        pass
+
+    log.setup(CONF, 'storyboard')
+    CONF(project='storyboard')
+
+    MailSender(CONF.plugin_email).run()
+
+
+def is_permanent(error):
+    """Whether an error means the email will never be accepted, so there's
+    no point trying again.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _message in
+                 six.itervalues(error.recipients)]
+        return bool(codes) and all(code >= 500 for code in codes)
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class DomainRateLimiter(object):
+    """Limits how many emails are sent to each domain, so that busy
+    subscribers don't get StoryBoard's emails throttled or rejected. Each
+    domain may have up to a minute's worth of emails sent at once.
+    """
+
+    def __init__(self, per_minute):
+        """Setup the limiter.
+
+        :param per_minute: The number of emails each domain may be sent a
+                           minute, or 0 for no limit.
+        """
+        self._rate = per_minute / 60.0
+        self._capacity = float(per_minute)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, domain):
+        """Take the right to send an email to a domain.
+
+        :return: 0 if an email can be sent now, or else how long (in
+                 seconds) until one can be.
+        """
+        if not self._capacity:
+            return 0
+
+        now = time.time()
+        with self._lock:
+            tokens, updated = self._buckets.get(domain,
+                                                (self._capacity, now))
+            tokens = min(self._capacity,
+                         tokens + (now - updated) * self._rate)
+            if tokens < 1:
+                self._buckets[domain] = (tokens, now)
+                return (1 - tokens) / self._rate
+            self._buckets[domain] = (tokens - 1, now)
+            return 0
+
+
+class MailSender(object):
+    """Delivers the emails in the mail_queue table.
+
+    Emails are claimed in batches and sent by several threads, each with
+    its own SMTP connection from the pool. Emails which can't be sent are
+    tried again with exponential backoff, until they have been tried
+    spool_max_attempts times or the server rejects them permanently. Then
+    they are kept in the table as dead letters.
+    """
+
+    def __init__(self, conf):
+        """Setup the sender based on our configuration.
+
+        :param conf A configuration object.
+        """
+        self._conf = conf
+        self._consumer = uuid.uuid4().hex
+        self._limiter = DomainRateLimiter(conf.spool_domain_rate_limit)
+        self._threads = None
+
+    def retry_delay(self, attempts):
+        """How long to wait after a number of failed attempts."""
+        delay = self._conf.spool_retry_delay * 2 ** (attempts - 1)
+        return min(delay, self._conf.spool_retry_max_delay)
+
+    def deliver(self, entry):
+        """Send a claimed email, and record the outcome. Each delivery
+        thread records it with a session of its own.
+
+        :return: Whether the email was sent.
+        """
+        session = api_base.get_session(in_request=False)
+        try:
+            try:
+                with smtp.get_pooled_smtp_client() as smtp_client:
+                    smtp_client.sendmail(
+                        from_addr=entry.sender,
+                        to_addrs=json.loads(entry.recipients),
+                        msg=entry.message)
+            except (smtplib.SMTPException, socket.error) as e:
+                self.failed(entry, e, session)
+                return False
+
+            mail_queue.mail_delete(self._consumer, entry.id,
+                                   session=session)
+            return True
+        except Exception as e:
+            # Anything else, like recipients which can't be decoded, would
+            # only fail again, and stop the sender every time.
+            LOG.exception(_LE("Could not send email %d."), entry.id)
+            self.failed(entry, e, session, permanent=True)
+            return False
+        finally:
+            session.close()
+
+    def failed(self, entry, error, session, permanent=False):
+        attempts = entry.attempts + 1
+        message = six.text_type(error)
+        if permanent or is_permanent(error) or \
+                attempts >= self._conf.spool_max_attempts:
+            LOG.warning(_LW("Giving up on email %(id)d after %(attempts)d "
+                            "attempts: %(error)s"),
+                        {'id': entry.id, 'attempts': attempts,
+                         'error': message})
+            mail_queue.mail_dead_letter(self._consumer, entry.id, attempts,
+                                        message, session=session)
+            return
+
+        delay = self.retry_delay(attempts)
+        LOG.info(_LI("Could not send email %(id)d, trying again in "
+                     "%(delay)d seconds: %(error)s"),
+                 {'id': entry.id, 'delay': delay, 'error': message})
+        mail_queue.mail_retry(self._consumer, entry.id, attempts, delay,
+                              message, session=session)
+
+    def send_batch(self):
+        """Send the next batch of emails which are due.
+
+        :return: The number of emails which were claimed.
+        """
+        session = api_base.get_session(in_request=False)
+        try:
+            entries = mail_queue.mail_claim(
+                self._consumer, self._conf.spool_batch_size,
+                self._conf.spool_claim_timeout, session=session)
+
+            ready = []
+            for entry in entries:
+                wait = self._limiter.acquire(entry.domain)
+                if wait:
+                    mail_queue.mail_defer(self._consumer, entry.id, wait,
+                                          session=session)
+                else:
+                    ready.append(entry)
+        finally:
+            session.close()
+
+        if ready:
+            if self._threads is None:
+                self._threads = ThreadPool(
+                    max(1, self._conf.spool_concurrency))
+            self._threads.map(self.deliver, ready)
+        return len(entries)
+
+    def run(self):
+        LOG.info(_LI("Sending emails from the mail spool."))
+        try:
+            while True:
+                try:
+                    claimed = self.send_batch()
+                except db_exc.DBError as e:
+                    LOG.warning(_LW("Could not read the mail spool."))
+                    LOG.debug(e)
+                    claimed = 0
+
+                if claimed < self._conf.spool_batch_size:
+                    time.sleep(self._conf.spool_poll_interval)
+        finally:
+            if self._threads is not None:
+                self._threads.close()
+                self._threads.join()
+            session = api_base.get_session(in_request=False)
+            try:
+                mail_queue.mail_release(self._consumer, session=session)
+            finally:
+                session.close()
+            smtp.close_pool()
@@ -12,7 +12,12 @@
 # implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
+import os
 import smtplib
+import socket
+import threading
+import time
 
 from oslo_config import cfg
 from oslo_log import log
@@ -20,6 +25,65 @@ from oslo_log import log
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
+# The reply code of a server which is closing the connection.
+SERVICE_NOT_AVAILABLE = 421
+
+_POOL = None
+_POOL_PID = None
+_POOL_LOCK = threading.Lock()
+
+
+def connect():
+    """Open an SMTP connection, using the options configured in
+    storyboard.conf. If authentication options are provided, it will
+    attempt to use these to log in to the server.
+    """
+    email_config = CONF.plugin_email
+
+    # SSL or not SSL?
+    if not email_config.smtp_ssl_certfile \
+            or not email_config.smtp_ssl_keyfile:
+        client = smtplib.SMTP(
+            host=email_config.smtp_host,
+            port=email_config.smtp_port,
+            local_hostname=email_config.smtp_local_hostname,
+            timeout=email_config.smtp_timeout)
+    else:
+        client = smtplib.SMTP_SSL(
+            host=email_config.smtp_host,
+            port=email_config.smtp_port,
+            keyfile=email_config.smtp_ssl_keyfile,
+            certfile=email_config.smtp_ssl_certfile,
+            local_hostname=email_config.smtp_local_hostname,
+            timeout=email_config.smtp_timeout)
+
+    # Do we need to log in?
+    if email_config.smtp_user and email_config.smtp_password:
+        client.login(email_config.smtp_user,
+                     email_config.smtp_password)
+
+    return client
+
+
+def _connection_lost(error):
+    """Whether an error means the connection can't be used any more, rather
+    than that the server refused a particular message.
+    """
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code == SERVICE_NOT_AVAILABLE
+    if isinstance(error, smtplib.SMTPException):
+        # On Python 3 these are socket errors too.
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    return isinstance(error, socket.error)
+
+
+def _close(client):
+    try:
+        client.quit()
+    except (smtplib.SMTPException, socket.error):
+        # The connection is already gone.
+        pass
+
 
 class get_smtp_client(object):
     """This will construct an SMTP client given the options configured
@@ -28,31 +92,186 @@ class get_smtp_client(object):
     """
 
     def __enter__(self):
-        email_config = CONF.plugin_email
-
-        # SSL or not SSL?
-        if not email_config.smtp_ssl_certfile \
-                or not email_config.smtp_ssl_keyfile:
-            self.s = smtplib.SMTP(
-                host=email_config.smtp_host,
-                port=email_config.smtp_port,
-                local_hostname=email_config.smtp_local_hostname,
-                timeout=email_config.smtp_timeout)
-        else:
-            self.s = smtplib.SMTP_SSL(
-                host=email_config.smtp_host,
-                port=email_config.smtp_port,
-                keyfile=email_config.smtp_ssl_keyfile,
-                certfile=email_config.smtp_ssl_certfile,
-                local_hostname=email_config.smtp_local_hostname,
-                timeout=email_config.smtp_timeout)
-
-        # Do we need to log in?
-        if email_config.smtp_user and email_config.smtp_password:
-            self.s.login(email_config.smtp_user,
-                         email_config.smtp_password)
-
+        self.s = connect()
         return self.s
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.s.quit()
+
+
+class PooledConnection(object):
+    """An SMTP connection borrowed from a SMTPConnectionPool. If the
+    connection fails while sending, a new one is opened and the message is
+    sent again.
+    """
+
+    def __init__(self, pool, client=None):
+        self.pool = pool
+        self.client = client
+        self.messages = 0
+        self.last_used = time.time()
+
+    def connect(self):
+        if self.client is None:
+            self.client = connect()
+            self.messages = 0
+        return self.client
+
+    def close(self):
+        if self.client is not None:
+            _close(self.client)
+            self.client = None
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=[],
+                 rcpt_options=[]):
+        try:
+            result = self.connect().sendmail(
+                from_addr, to_addrs, msg, mail_options, rcpt_options)
+        except (smtplib.SMTPException, socket.error) as e:
+            if not _connection_lost(e):
+                raise
+            LOG.debug('SMTP connection failed, reconnecting: %s' % (e,))
+            self.close()
+            result = self.connect().sendmail(
+                from_addr, to_addrs, msg, mail_options, rcpt_options)
+
+        self.messages += 1
+        self.last_used = time.time()
+        if self.messages >= self.pool.max_messages:
+            # Start again with a fresh connection if there's more to send.
+            self.close()
+        return result
+
+
+class SMTPConnectionPool(object):
+    """Keeps SMTP connections open between events, so that each email
+    doesn't need its own connection, handshake and login. Idle connections
+    are checked with NOOP before they're reused, and are closed once they
+    have been idle too long or have sent enough messages.
+    """
+
+    def __init__(self, size, max_messages, idle_timeout, keepalive_interval):
+        """Setup the pool.
+
+        :param size: The number of idle connections to keep open.
+        :param max_messages: The number of messages to send over a
+                             connection before replacing it.
+        :param idle_timeout: How long (in seconds) to keep an idle
+                             connection open.
+        :param keepalive_interval: How long (in seconds) a connection can
+                                   be idle before it's checked with NOOP.
+        """
+        self.size = size
+        self.max_messages = max(1, max_messages)
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _expired(self, connection, now):
+        return now - connection.last_used > self.idle_timeout
+
+    def _alive(self, connection):
+        try:
+            code = connection.client.noop()[0]
+        except (smtplib.SMTPException, socket.error):
+            return False
+        return code == 250
+
+    def acquire(self):
+        """Borrow a connection. The SMTP connection itself is only opened
+        when the first message is sent.
+        """
+        now = time.time()
+        stale = []
+        connection = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if self._expired(candidate, now):
+                    stale.append(candidate)
+                    continue
+                connection = candidate
+                break
+
+        for candidate in stale:
+            candidate.close()
+
+        if connection is not None:
+            if now - connection.last_used <= self.keepalive_interval or \
+                    self._alive(connection):
+                return connection
+            connection.close()
+            return connection
+        return PooledConnection(self)
+
+    def release(self, connection, broken=False):
+        """Return a connection to the pool.
+
+        :param connection: The connection.
+        :param broken: Whether the connection may be in an unknown state, so
+                       shouldn't be reused.
+        """
+        if connection.client is not None and not broken:
+            with self._lock:
+                if len(self._idle) < self.size:
+                    self._idle.append(connection)
+                    return
+        connection.close()
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+def get_pool():
+    """The SMTP connection pool of the current process. Worker processes
+    are forked, so a process never uses connections opened by another.
+    """
+    global _POOL, _POOL_PID
+    email_config = CONF.plugin_email
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_PID != os.getpid():
+            _POOL = SMTPConnectionPool(
+                size=email_config.smtp_pool_size,
+                max_messages=email_config.smtp_pool_max_messages,
+                idle_timeout=email_config.smtp_pool_idle_timeout,
+                keepalive_interval=email_config.smtp_pool_keepalive_interval)
+            _POOL_PID = os.getpid()
+        return _POOL
+
+
+def close_pool():
+    """Close the idle connections of the current process's pool, and make
+    the next one use the current configuration.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None and _POOL_PID == os.getpid():
+        pool.close_all()
+
+
+atexit.register(close_pool)
+
+
+class get_pooled_smtp_client(object):
+    """Borrow a connection from the process's SMTP connection pool, and
+    return it when done. The connection has a sendmail method, like an
+    SMTP client.
+    """
+
+    def __enter__(self):
+        self.pool = get_pool()
+        self.connection = self.pool.acquire()
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # smtplib resets the connection after a refused message, so it can
+        # still be used. Anything else may have left it mid-conversation.
+        broken = exc_val is not None and (
+            not isinstance(exc_val, smtplib.SMTPException) or
+            _connection_lost(exc_val))
+        self.pool.release(self.connection, broken=broken)
@@ -0,0 +1,84 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""The outbound mail spool.
+
+When the spool option is set, the email plugins write their emails to the
+mail_queue table instead of sending them, and storyboard-mail-sender
+delivers them. A slow or broken SMTP server then can't hold up the
+worker daemon, and emails which can't be sent yet aren't lost.
+"""
+
+import collections
+
+from oslo_config import cfg
+import six
+
+from storyboard.db.api import mail_queue
+from storyboard.plugin.email import smtp_client as smtp
+
+
+CONF = cfg.CONF
+
+
+def get_domain(address):
+    """The domain of an email address, in lower case."""
+    return address.rpartition('@')[2].lower()
+
+
+class SpoolClient(object):
+    """Has the sendmail method of an SMTP client, but writes the emails to
+    the spool, in the given session's transaction.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+
+    def sendmail(self, from_addr, to_addrs, msg, mail_options=[],
+                 rcpt_options=[]):
+        if isinstance(to_addrs, six.string_types):
+            to_addrs = [to_addrs]
+
+        # The sender limits the rate of emails to each domain, so each
+        # spooled email only goes to one.
+        by_domain = collections.OrderedDict()
+        for address in to_addrs:
+            by_domain.setdefault(get_domain(address), []).append(address)
+
+        for domain, addresses in six.iteritems(by_domain):
+            mail_queue.mail_add(from_addr, addresses, domain, msg,
+                                session=self.session)
+        # Like SMTP.sendmail, return the refused recipients.
+        return {}
+
+
+class get_mail_client(object):
+    """Get something to send emails with: the spool if it's enabled, or
+    else an SMTP connection from the pool.
+
+    :param session: The session to spool emails in, so that they are only
+                    sent if its transaction commits.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self.smtp = None
+
+    def __enter__(self):
+        if CONF.plugin_email.spool:
+            return SpoolClient(self.session)
+        self.smtp = smtp.get_pooled_smtp_client()
+        return self.smtp.__enter__()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.smtp is not None:
+            return self.smtp.__exit__(exc_type, exc_val, exc_tb)
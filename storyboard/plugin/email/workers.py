@@ -21,18 +21,21 @@ import six
 import smtplib
 
 from email.utils import make_msgid
-from jinja2.exceptions import TemplateNotFound
 from oslo_config import cfg
 from oslo_log import log
 from socket import getfqdn
+from sqlalchemy.orm import object_session
 
+from storyboard.common import event_types
 import storyboard.db.api.base as db_base
-from storyboard.db.api.subscriptions import subscription_get_all_subscriber_ids
 from storyboard.db.api import timeline_events as events_api
+from storyboard.db.api import users as users_api
 import storyboard.db.models as models
 from storyboard.plugin.email.base import EmailPluginBase
 from storyboard.plugin.email.factory import EmailFactory
-from storyboard.plugin.email import smtp_client as smtp
+from storyboard.plugin.email.factory import get_template_matrix
+from storyboard.plugin.email import spool
+from storyboard.plugin.event_context import EventContext
 from storyboard.plugin.event_worker import WorkerTaskBase
 
 
@@ -51,7 +54,7 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
 
     def handle(self, session, author, method, url, path, query_string, status,
                resource, resource_id, sub_resource=None, sub_resource_id=None,
-               resource_before=None, resource_after=None):
+               resource_before=None, resource_after=None, context=None):
         """Handle an event.
 
         :param session: An event-specific SQLAlchemy session.
@@ -67,7 +70,9 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
         :param sub_resource_id: The ID of the subresource.
         :param resource_before: The resource state before this event occurred.
         :param resource_after: The resource state after this event occurred.
+        :param context: The EventContext shared by all the worker plugins.
         """
+        context = context or EventContext()
 
         # We only care about a subset of resource types.
         if resource not in ['task', 'project_group', 'project', 'story',
@@ -85,7 +90,11 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
             if 'created' not in resource_after['event_type']:
                 method = 'PUT'
 
-            if 'contents' in resource_after['event_type']:
+            if resource_after['event_type'] == \
+                    event_types.WORKLIST_CONTENTS_BATCH_CHANGED:
+                # Each of these holds lists of changes, rather than one.
+                sub_resource = 'item_batch'
+            elif 'contents' in resource_after['event_type']:
                 sub_resource = 'item'
 
             if 'filters' in resource_after['event_type']:
@@ -107,9 +116,11 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
             # NOTE: People who are only subscribed to the task (not the story)
             # won't get an email.
             subscribers = self.get_subscribers(session, 'story',
-                                               resource_before['story_id'])
+                                               resource_before['story_id'],
+                                               context=context)
         else:
-            subscribers = self.get_subscribers(session, resource, resource_id)
+            subscribers = self.get_subscribers(session, resource, resource_id,
+                                               context=context)
         if not subscribers:
             return
 
@@ -127,13 +138,15 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
                           sub_resource=sub_resource,
                           sub_resource_id=sub_resource_id,
                           resource_before=resource_before,
-                          resource_after=resource_after)
+                          resource_after=resource_after,
+                          context=context)
 
     @abc.abstractmethod
     def handle_email(self, session, author, subscribers, method, url, path,
                      query_string, status, resource, resource_id,
                      sub_resource=None, sub_resource_id=None,
-                     resource_before=None, resource_after=None):
+                     resource_before=None, resource_after=None,
+                     context=None):
         """Handle an email notification for the given subscribers.
 
         :param session: An event-specific SQLAlchemy session.
@@ -150,41 +163,46 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
         :param sub_resource_id: The ID of the subresource.
         :param resource_before: The resource state before this event occurred.
         :param resource_after: The resource state after this event occurred.
+        :param context: The EventContext shared by all the worker plugins.
         """
 
-    def get_subscribers(self, session, resource, resource_id):
+    def get_subscribers(self, session, resource, resource_id, context=None):
         """Get a list of users who are subscribed to the resource,
         whose email address is valid, and whose email preferences indicate
         that they'd like to receive non-digest email.
         """
+        context = context or EventContext()
         subscribers = []
 
         # Resolve all the subscriber ID's.
-        subscriber_ids = subscription_get_all_subscriber_ids(resource,
-                                                             resource_id,
-                                                             session=session)
+        subscriber_ids = context.subscriber_ids(session, resource,
+                                                resource_id)
         users = db_base.model_query(models.User, session) \
             .filter(models.User.id.in_(subscriber_ids)).all()
+        context.load_preferences(session, [user.id for user in users])
 
         for user in users:
-            if not self.get_preference('plugin_email_enable', user) == 'true':
+            if not context.preference(user, 'plugin_email_enable') == 'true':
                 continue
             subscribers.append(user)
 
         return subscribers
 
     def get_preference(self, name, user):
-        if name not in user.preferences:
-            return None
-        return user.preferences[name].cast_value
+        return users_api.get_preference_store().get(
+            user.id, name, session=object_session(user))
 
-    def get_changed_properties(self, original, new):
+    def get_changed_properties(self, original, new, context=None):
         """Shallow comparison diff.
 
         This method creates a shallow comparison between two dicts,
         and returns two dicts containing only the changed properties from
         before and after. It intentionally excludes created_at and updated_at,
         as those aren't true 'values' so to say.
+
+        For events sent with only the changed fields, `new` may be the whole
+        resource, from EventContext.full_state, so only the fields in
+        `original` are compared.
         """
 
         # Clone our value arrays, since we might return them.
@@ -206,6 +224,11 @@ class EmailWorkerBase(EmailPluginBase, WorkerTaskBase):
         before_keys = set(before.keys())
         after_keys = set(after.keys())
         keys = before_keys | after_keys
+        if context is not None and context.diff_only:
+            # Only the fields in the original were sent.
+            keys = before_keys
+            for key in after_keys - before_keys:
+                del after[key]
 
         # Run the comparison.
         for key in keys:
@@ -226,10 +249,17 @@ class SubscriptionEmailWorker(EmailWorkerBase):
     have indicated that they wish to receive emails, but don't want digests.
     """
 
+    def __init__(self, config):
+        super(SubscriptionEmailWorker, self).__init__(config)
+
+        # Compile all the templates now, rather than for each event.
+        self.templates = get_template_matrix()
+
     def handle_email(self, session, author, subscribers, method, url, path,
                      query_string, status, resource, resource_id,
                      sub_resource=None, sub_resource_id=None,
-                     resource_before=None, resource_after=None):
+                     resource_before=None, resource_after=None,
+                     context=None):
         """Send an email for a specific event.
 
         We assume that filtering logic has already occurred when this method
@@ -249,32 +279,29 @@ class SubscriptionEmailWorker(EmailWorkerBase):
         :param sub_resource_id: The ID of the subresource.
         :param resource_before: The resource state before this event occurred.
         :param resource_after: The resource state after this event occurred.
+        :param context: The EventContext shared by all the worker plugins.
         """
-
+        context = context or EventContext()
         email_config = CONF.plugin_email
 
-        # Retrieve the template names.
-        (subject_template, text_template, html_template) = \
-            self.get_templates(method=method,
-                               resource_name=resource,
-                               sub_resource_name=sub_resource)
-
-        # Build our factory. If an HTML template exists, add it. If it can't
-        # find the template, skip.
-        try:
-            factory = EmailFactory(sender=email_config.sender,
-                                   subject=subject_template,
-                                   text_template=text_template)
-        except TemplateNotFound:
+        # Look up the template names. If there aren't any, skip.
+        templates = self.templates.get((resource, sub_resource, method))
+        if templates is None:
+            (subject_template, text_template, _html_template) = \
+                self.get_templates(method=method,
+                                   resource_name=resource,
+                                   sub_resource_name=sub_resource)
             LOG.error("Templates not found [%s, %s]" % (subject_template,
                                                         text_template))
             return
+        (subject_template, text_template, html_template) = templates
 
-        # Try to add an HTML template
-        try:
+        # Build our factory. If an HTML template exists, add it.
+        factory = EmailFactory(sender=email_config.sender,
+                               subject=subject_template,
+                               text_template=text_template)
+        if html_template:
             factory.add_text_template(html_template, 'html')
-        except TemplateNotFound:
-            LOG.debug('Template %s not found' % (html_template,))
 
         # If there's a reply-to in our config, add that.
         if email_config.reply_to:
@@ -285,11 +312,9 @@ class SubscriptionEmailWorker(EmailWorkerBase):
             url = email_config.default_url
 
         # Resolve the resource instance
-        resource_instance = self.resolve_resource_by_name(session, resource,
-                                                          resource_id)
-        sub_resource_instance = self.resolve_resource_by_name(session,
-                                                              sub_resource,
-                                                              sub_resource_id)
+        resource_instance = context.resolve(session, resource, resource_id)
+        sub_resource_instance = context.resolve(session, sub_resource,
+                                                sub_resource_id)
 
         # Set In-Reply-To message id for 'task', 'story', and
         # 'worklist' resources
@@ -300,8 +325,8 @@ class SubscriptionEmailWorker(EmailWorkerBase):
             # in the database anymore if it has been deleted.
             # We should archive instead of delete to solve this.
             story_id = resource_before['story_id']
-            created_at = self.resolve_resource_by_name(session, 'story',
-                story_id).created_at
+            created_at = context.resolve(session, 'story',
+                                         story_id).created_at
         elif resource == 'task':
             story_id = resource_instance.story.id
             created_at = resource_instance.story.created_at
@@ -330,60 +355,90 @@ class SubscriptionEmailWorker(EmailWorkerBase):
         factory.add_header("In-Reply-To", thread_id)
         factory.add_header("X-StoryBoard-Subscription-Type", resource)
 
+        # Events sent with only the changed fields don't have the rest of
+        # the resource, which the templates may need.
+        if context.diff_only and resource == context.resource:
+            resource_after = context.full_state(session)
+
         # Figure out the diff between old and new.
         before, after = self.get_changed_properties(resource_before,
-                                                    resource_after)
-
-        # For each subscriber, create the email and send it.
-        with smtp.get_smtp_client() as smtp_client:
-            for subscriber in subscribers:
-
-                # Make sure this subscriber's preferences indicate they want
-                # email and they're not receiving digests.
-                if not self.get_preference('plugin_email_enable', subscriber) \
-                        or self.get_preference('plugin_email_digest',
-                                               subscriber):
-                    continue
-
-                send_notification = self.get_preference(
-                    'receive_notifications_worklists', subscriber)
-                if send_notification != 'true' and story_id is None:
-                    continue
-
-                # Don't send a notification if the user isn't allowed to see
-                # the thing this event is about.
-                if 'event_type' in resource:
-                    event = events_api.event_get(
-                        resource['id'],
-                        current_user=subscriber.id,
-                        session=session)
-                    if not events_api.is_visible(
-                            event, subscriber.id, session=session):
-                        continue
-
-                try:
-                    # Build an email.
-                    message = factory.build(recipient=subscriber.email,
-                                            author=author,
-                                            resource=resource_instance,
-                                            sub_resource=sub_resource_instance,
-                                            url=url,
-                                            query_string=query_string,
-                                            before=before,
-                                            after=after)
-                    # Send the email.
-                    from_addr = message.get('From')
-                    to_addrs = message.get('To')
-
-                    try:
-                        smtp_client.sendmail(from_addr=from_addr,
-                                             to_addrs=to_addrs,
-                                             msg=message.as_string())
-                    except smtplib.SMTPException as e:
-                        LOG.error('Cannot send email, discarding: %s' % (e,))
-                except Exception as e:
-                    # Skip, keep going.
-                    LOG.error("Cannot schedule email: %s" % (e.message,))
+                                                    resource_after,
+                                                    context=context)
+
+        recipients = []
+        context.load_preferences(session, [user.id for user in subscribers])
+        for subscriber in subscribers:
+
+            # Make sure this subscriber's preferences indicate they want
+            # email and they're not receiving digests.
+            if not context.preference(subscriber, 'plugin_email_enable') \
+                    or context.preference(subscriber, 'plugin_email_digest'):
+                continue
+
+            send_notification = context.preference(
+                subscriber, 'receive_notifications_worklists')
+            if send_notification != 'true' and story_id is None:
+                continue
+
+            recipients.append(subscriber)
+
+        # Don't send a notification to users who aren't allowed to see the
+        # thing this event is about.
+        if recipients and resource_after and 'event_type' in resource_after:
+            event = db_base.entity_get(models.TimeLineEvent,
+                                       resource_after['id'],
+                                       session=session)
+            visible = set()
+            if event is not None:
+                visible = set(user_id for (user_id,) in
+                              events_api.event_visible_users(
+                                  event, [user.id for user in recipients],
+                                  session=session))
+            recipients = [user for user in recipients if user.id in visible]
+
+        if not recipients:
+            return
+
+        # Everyone gets the same email, so it's only rendered once.
+        try:
+            email = factory.render(author=author,
+                                   resource=resource_instance,
+                                   sub_resource=sub_resource_instance,
+                                   url=url,
+                                   query_string=query_string,
+                                   before=before,
+                                   after=after)
+        except Exception as e:
+            LOG.error("Cannot schedule email: %s" % (e,))
+            return
+
+        with spool.get_mail_client(session) as smtp_client:
+            self.send(smtp_client, email,
+                      [subscriber.email for subscriber in recipients])
+
+    def send(self, smtp_client, email, addresses):
+        """Send a rendered email. Each recipient gets their own copy, unless
+        smtp_recipients_per_message allows several recipients per copy.
+
+        :param smtp_client: The SMTP connection.
+        :param email: The RenderedEmail.
+        :param addresses: The recipients' email addresses.
+        """
+        per_message = max(1, CONF.plugin_email.smtp_recipients_per_message)
+        for start in range(0, len(addresses), per_message):
+            to_addrs = addresses[start:start + per_message]
+            if len(to_addrs) == 1:
+                to_addrs = to_addrs[0]
+                msg = email.for_recipient(to_addrs)
+            else:
+                msg = email.for_recipients()
+
+            try:
+                smtp_client.sendmail(from_addr=email.sender,
+                                     to_addrs=to_addrs,
+                                     msg=msg)
+            except smtplib.SMTPException as e:
+                LOG.error('Cannot send email, discarding: %s' % (e,))
 
     def get_templates(self, method, resource_name, sub_resource_name=None):
         """Return the email templates for the given resource.
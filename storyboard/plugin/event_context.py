@@ -0,0 +1,182 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import inspect
+import threading
+
+import six
+from sqlalchemy.orm import object_session
+from wsme.rest.json import tojson
+
+import storyboard.db.api.base as db_api
+from storyboard.db.api import subscriptions as sub_api
+from storyboard.db.api import users as users_api
+from storyboard.notifications.notification_hook import class_mappings
+
+
+def accepts_context(method):
+    """Whether a plugin's event() or handle() method can be given the
+    EventContext. Plugins written before it existed don't take one.
+    """
+    try:
+        if six.PY2:
+            spec = inspect.getargspec(method)
+            return 'context' in spec.args or spec.keywords is not None
+        parameters = inspect.signature(method).parameters
+    except (TypeError, ValueError):
+        return True
+    return 'context' in parameters or any(
+        parameter.kind == parameter.VAR_KEYWORD
+        for parameter in parameters.values())
+
+
+class EventContext(object):
+    """Information about a single API event, shared by all of the worker
+    plugins which handle it.
+
+    Anything that needs the database is looked up the first time a plugin
+    asks for it, and remembered for the others. Plugins run in their own
+    threads with their own sessions, so only plain values (IDs and
+    preference values) are shared between them. Model instances are
+    remembered for each session separately.
+    """
+
+    def __init__(self, author_id=None, resource=None, resource_id=None,
+                 resource_before=None, resource_after=None, diff_only=False,
+                 project_groups=None, preferences=None):
+        self.author_id = author_id
+        self.resource = resource
+        self.resource_id = resource_id
+        self.resource_before = resource_before
+        self.resource_after = resource_after
+
+        # Whether resource_before and resource_after only contain the
+        # fields which changed.
+        self.diff_only = diff_only
+
+        # The worker's ProjectGroupCache, if it has one.
+        self.project_groups = project_groups
+
+        # The worker's PreferenceStore, if it has one.
+        self.preferences = preferences
+
+        self._lock = threading.RLock()
+        self._subscriber_ids = {}
+        self._preferences = {}
+        self._full_state = {}
+
+    @property
+    def story_id(self):
+        """The ID of the story this event affects, if any."""
+        if self.resource == 'story':
+            return self.resource_id
+        for state in (self.resource_after, self.resource_before):
+            if isinstance(state, dict) and state.get('story_id'):
+                return state['story_id']
+        return None
+
+    @property
+    def worklist_id(self):
+        """The ID of the worklist this event affects, if any."""
+        if self.resource == 'worklist':
+            return self.resource_id
+        if isinstance(self.resource_after, dict):
+            return self.resource_after.get('worklist_id')
+        return None
+
+    def resolve(self, session, resource_name, resource_id):
+        """Get a resource, loading it only once for each session.
+
+        :param session: The session to load the resource with.
+        :param resource_name: The name of the resource type.
+        :param resource_id: The ID of the resource.
+        """
+        if resource_name not in class_mappings or resource_id is None:
+            return None
+
+        instances = session.info.setdefault('event_context', {})
+        key = (resource_name, resource_id)
+        if key not in instances:
+            klass = class_mappings[resource_name][0]
+            instances[key] = db_api.entity_get(klass, resource_id,
+                                               session=session)
+        return instances[key]
+
+    def full_state(self, session):
+        """The resource after the event, with all of its fields. For events
+        sent with only the changed fields, it is loaded from the database.
+
+        :param session: The session to use if it isn't known yet.
+        """
+        if not self.diff_only or self.resource not in class_mappings:
+            return self.resource_after
+
+        with self._lock:
+            if 'after' not in self._full_state:
+                wmodel = class_mappings[self.resource][1]
+                entity = self.resolve(session, self.resource,
+                                      self.resource_id)
+                self._full_state['after'] = None
+                if entity:
+                    self._full_state['after'] = tojson(
+                        wmodel, wmodel.from_db_model(entity))
+            return self._full_state['after']
+
+    def author(self, session):
+        """The author's user record, loaded with the given session."""
+        return self.resolve(session, 'user', self.author_id)
+
+    def subscriber_ids(self, session, resource, resource_id):
+        """The IDs of the users subscribed to a resource.
+
+        :param session: The session to use if they aren't known yet.
+        :param resource: The name of the resource type.
+        :param resource_id: The ID of the resource.
+        """
+        key = (resource, resource_id)
+        with self._lock:
+            if key not in self._subscriber_ids:
+                self._subscriber_ids[key] = \
+                    sub_api.subscription_get_all_subscriber_ids(
+                        resource, resource_id, session=session,
+                        project_groups=self.project_groups)
+            return self._subscriber_ids[key]
+
+    def load_preferences(self, session, user_ids):
+        """Load the preferences of several users at once, so that asking
+        for them one at a time doesn't need a query for each.
+
+        :param session: The session to use for those which aren't known yet.
+        :param user_ids: The IDs of the users.
+        """
+        with self._lock:
+            missing = [user_id for user_id in set(user_ids)
+                       if user_id not in self._preferences]
+            if not missing:
+                return
+            if self.preferences is not None:
+                loaded = self.preferences.load(missing, session=session)
+            else:
+                loaded = users_api.user_load_preferences(missing,
+                                                         session=session)
+            self._preferences.update(loaded)
+
+    def preference(self, user, name):
+        """Get one of a user's preferences.
+
+        :param user: A user record.
+        :param name: The name of the preference.
+        """
+        with self._lock:
+            if user.id not in self._preferences:
+                self.load_preferences(object_session(user), [user.id])
+            return self._preferences[user.id].get(name)
@@ -14,18 +14,25 @@
 
 import abc
 from multiprocessing import Process
+from multiprocessing import Queue
 import signal
 from threading import Timer
+import time
 
 from oslo_config import cfg
 from oslo_log import log
 import six
+from six.moves import queue
 
 import storyboard.db.api.base as db_api
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import metrics
 from storyboard.notifications.notification_hook import class_mappings
 from storyboard.notifications.subscriber import subscribe
 from storyboard._i18n import _LI, _LW
 from storyboard.plugin.base import PluginBase
+from storyboard.plugin.event_context import accepts_context
+from storyboard.plugin.event_context import EventContext
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
@@ -52,12 +59,28 @@ def run_daemon():
 
     log.setup(CONF, 'storyboard')
     CONF(project='storyboard')
+    CONF.register_opts(NOTIFICATION_OPTS, "notifications")
 
     signal.signal(signal.SIGTERM, terminate)
     signal.signal(signal.SIGINT, terminate)
 
-    MANAGER = DaemonManager(daemon_method=subscribe,
-                            child_process_count=CONF.worker_count)
+    metrics_file = CONF.notifications.worker_metrics_file
+    metrics_interval = CONF.notifications.worker_metrics_interval
+    shards = CONF.notifications.rabbit_event_shards
+    if shards:
+        if shards != CONF.worker_count:
+            LOG.warning(_LW("Events are split into %d shards, so %d worker "
+                            "processes will be used.") % (shards, shards))
+        MANAGER = DaemonManager(daemon_method=subscribe,
+                                child_process_count=shards,
+                                sharded=True,
+                                metrics_file=metrics_file,
+                                metrics_interval=metrics_interval)
+    else:
+        MANAGER = DaemonManager(daemon_method=subscribe,
+                                child_process_count=CONF.worker_count,
+                                metrics_file=metrics_file,
+                                metrics_interval=metrics_interval)
     MANAGER.start()
 
 
@@ -74,7 +97,8 @@ def terminate(sig, frame):
 class DaemonManager(object):
     """A Daemon manager to handle multiple subprocesses.
     """
-    def __init__(self, child_process_count, daemon_method):
+    def __init__(self, child_process_count, daemon_method, sharded=False,
+                 metrics_file=None, metrics_interval=15.0):
         """Create a new daemon manager with N processes running the passed
         method. Once start() is called, The daemon method will be spawned N
         times and continually checked/restarted until the process is
@@ -82,17 +106,37 @@ class DaemonManager(object):
 
         :param child_process_count: The number of child processes to spawn.
         :param daemon_method: The method to run in the child process.
+        :param sharded: Whether to pass each process its own shard index.
+                        A restarted process gets the index of the process
+                        it replaces.
+        :param metrics_file: Where to write the metrics of all the child
+                             processes. When set, the daemon method is
+                             passed a metrics_queue to send them to.
+        :param metrics_interval: How often (in seconds) to write the
+                                 metrics.
         """
 
         # Number of child procs.
         self._child_process_count = child_process_count
+        self._sharded = sharded
 
         # Process management threads.
         self._procs = list()
 
+        # The shard handled by each process, when sharded.
+        self._shards = dict()
+
         # Save the daemon method
         self._daemon_method = daemon_method
 
+        # Metrics from each child process, including ones which have died
+        # so that the totals never go down.
+        self._metrics_file = metrics_file
+        self._metrics_interval = metrics_interval
+        self._metrics_queue = Queue() if metrics_file else None
+        self._snapshots = dict()
+        self._last_write = None
+
         # Health check timer
         self._timer = PerpetualTimer(1, self._health_check)
 
@@ -107,8 +151,51 @@ class DaemonManager(object):
                 dead_processes += 1
                 self._procs.remove(process)
 
-        for i in range(dead_processes):
-            self._add_process()
+                if self._sharded:
+                    self._add_process(self._shards.pop(process))
+
+        if not self._sharded:
+            for i in range(dead_processes):
+                self._add_process()
+
+        self._collect_metrics()
+
+    def _collect_metrics(self, force=False):
+        """Gather the metrics sent by the child processes, and write their
+        totals once the interval has passed.
+
+        :param force: Write the metrics now.
+        """
+        if self._metrics_queue is None:
+            return
+
+        try:
+            while True:
+                key, snapshot = self._metrics_queue.get_nowait()
+                self._snapshots[key] = snapshot
+        except queue.Empty:
+            pass
+
+        now = time.time()
+        if not force and self._last_write and \
+                now - self._last_write[0] < self._metrics_interval:
+            return
+
+        total = metrics.merge(self._snapshots.values())
+        events_per_second = None
+        if self._last_write and now > self._last_write[0]:
+            events_per_second = float(total['events'] -
+                                      self._last_write[1]) / \
+                (now - self._last_write[0])
+
+        try:
+            metrics.write_text_file(
+                self._metrics_file,
+                metrics.to_prometheus(total, events_per_second))
+        except (IOError, OSError) as e:
+            LOG.warning(_LW("Could not write metrics to %(file)s: %(err)s"),
+                        {'file': self._metrics_file, 'err': e})
+        self._last_write = (now, total['events'])
 
     def start(self):
         """Start the daemon manager and spawn child processes.
@@ -117,7 +204,7 @@ class DaemonManager(object):
                  (self._child_process_count,))
         self._timer.start()
         for i in range(self._child_process_count):
-            self._add_process()
+            self._add_process(i if self._sharded else None)
 
     def stop(self):
         self._timer.cancel()
@@ -128,9 +215,20 @@ class DaemonManager(object):
                 process.terminate()
                 process.join()
             self._procs.remove(process)
-
-    def _add_process(self):
-        process = Process(target=self._daemon_method)
+        self._shards.clear()
+        self._collect_metrics(force=True)
+
+    def _add_process(self, shard=None):
+        kwargs = dict()
+        if self._metrics_queue is not None:
+            kwargs['metrics_queue'] = self._metrics_queue
+
+        if shard is None:
+            process = Process(target=self._daemon_method, kwargs=kwargs)
+        else:
+            process = Process(target=self._daemon_method, args=(shard,),
+                              kwargs=kwargs)
+            self._shards[process] = shard
         process.start()
         self._procs.append(process)
 
@@ -164,29 +262,46 @@ class WorkerTaskBase(PluginBase):
 
     def event(self, author_id, method, url, path, query_string, status,
               resource, resource_id, sub_resource=None, sub_resource_id=None,
-              resource_before=None, resource_after=None):
+              resource_before=None, resource_after=None, context=None):
         """Handle an event.
 
         A database session is created, and passed to the abstract method.
+        If no EventContext is given, one is created for this plugin. It is
+        only passed on if the handle method takes one.
+
+        :return: Whatever the handle method returns, once the session's
+                 transaction is committed.
         """
+        if context is None:
+            context = EventContext(author_id=author_id,
+                                   resource=resource,
+                                   resource_id=resource_id,
+                                   resource_before=resource_before,
+                                   resource_after=resource_after)
+
         session = db_api.get_session(in_request=False)
 
         with session.begin(subtransactions=True):
-            author = self.resolve_resource_by_name(session, 'user', author_id)
-
-            self.handle(session=session,
-                        author=author,
-                        method=method,
-                        url=url,
-                        path=path,
-                        query_string=query_string,
-                        status=status,
-                        resource=resource,
-                        resource_id=resource_id,
-                        sub_resource=sub_resource,
-                        sub_resource_id=sub_resource_id,
-                        resource_before=resource_before,
-                        resource_after=resource_after)
+            author = context.author(session)
+
+            kwargs = {}
+            if accepts_context(self.handle):
+                kwargs['context'] = context
+
+            return self.handle(session=session,
+                               author=author,
+                               method=method,
+                               url=url,
+                               path=path,
+                               query_string=query_string,
+                               status=status,
+                               resource=resource,
+                               resource_id=resource_id,
+                               sub_resource=sub_resource,
+                               sub_resource_id=sub_resource_id,
+                               resource_before=resource_before,
+                               resource_after=resource_after,
+                               **kwargs)
 
     def resolve_resource_by_name(self, session, resource_name, resource_id):
         if resource_name not in class_mappings:
@@ -198,7 +313,7 @@ class WorkerTaskBase(PluginBase):
     @abc.abstractmethod
     def handle(self, session, author, method, url, path, query_string, status,
                resource, resource_id, sub_resource=None, sub_resource_id=None,
-               resource_before=None, resource_after=None):
+               resource_before=None, resource_after=None, context=None):
         """Handle an event.
 
         :param session: An event-specific SQLAlchemy session.
@@ -214,4 +329,5 @@ class WorkerTaskBase(PluginBase):
         :param sub_resource_id: The ID of the subresource.
         :param resource_before: The resource state before this event occurred.
         :param resource_after: The resource state after this event occurred.
+        :param context: The EventContext shared by all the worker plugins.
         """
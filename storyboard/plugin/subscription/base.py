@@ -14,17 +14,23 @@
 
 import json
 
+from sqlalchemy import and_
+from sqlalchemy import exists
+from sqlalchemy.orm import object_session
+
 import storyboard.db.api.base as db_api
-from storyboard.db.api import subscriptions as sub_api
+from storyboard.db.api import subscription_events as subscription_events_api
 from storyboard.db.api import timeline_events as events_api
+from storyboard.db.api import users as users_api
 import storyboard.db.models as models
+from storyboard.notifications import stream
+from storyboard.plugin.event_context import EventContext
 from storyboard.plugin.event_worker import WorkerTaskBase
 
 
 def get_preference(name, user):
-    if name not in user.preferences:
-        return None
-    return user.preferences[name].cast_value
+    return users_api.get_preference_store().get(
+        user.id, name, session=object_session(user))
 
 
 class Subscription(WorkerTaskBase):
@@ -35,9 +41,18 @@ class Subscription(WorkerTaskBase):
         """
         return True
 
+    def event(self, *args, **kwargs):
+        """Handle an event, and once the subscription events it created are
+        committed, tell the API processes who has new events.
+        """
+        subscriber_ids = super(Subscription, self).event(*args, **kwargs)
+        if subscriber_ids:
+            stream.notify(subscriber_ids)
+        return subscriber_ids
+
     def handle(self, session, author, method, url, path, query_string, status,
                resource, resource_id, sub_resource=None, sub_resource_id=None,
-               resource_before=None, resource_after=None):
+               resource_before=None, resource_after=None, context=None):
         """This worker handles API events and attempts to determine whether
         they correspond to user subscriptions.
 
@@ -54,34 +69,42 @@ class Subscription(WorkerTaskBase):
         :param sub_resource_id: The ID of the subresource.
         :param resource_before: The resource state before this event occurred.
         :param resource_after: The resource state after this event occurred.
+        :param context: The EventContext shared by all the worker plugins.
+        :return: The IDs of the users who were sent subscription events.
         """
+        context = context or EventContext()
+        notified = set()
+
         if resource == 'timeline_event':
             story_id = resource_after.get('story_id')
             worklist_id = resource_after.get('worklist_id')
             if story_id is not None:
-                subscribers = sub_api.subscription_get_all_subscriber_ids(
-                    'story', story_id, session=session)
-                self.handle_timeline_events(
-                    session, resource_after, author, subscribers)
+                subscribers = context.subscriber_ids(session, 'story',
+                                                     story_id)
+                notified.update(self.handle_timeline_events(
+                    session, resource_after, author, subscribers))
             if worklist_id is not None:
-                subscribers = sub_api.subscription_get_all_subscriber_ids(
-                    'worklist', worklist_id, session=session)
-                self.handle_timeline_events(
-                    session, resource_after, author, subscribers)
+                subscribers = context.subscriber_ids(session, 'worklist',
+                                                     worklist_id)
+                notified.update(self.handle_timeline_events(
+                    session, resource_after, author, subscribers))
 
         elif resource == 'project_group':
-            subscribers = sub_api.subscription_get_all_subscriber_ids(
-                resource, resource_id, session=session)
-            self.handle_resources(session=session,
-                                  method=method,
-                                  resource_id=resource_id,
-                                  sub_resource_id=sub_resource_id,
-                                  author=author,
-                                  subscribers=subscribers)
+            subscribers = context.subscriber_ids(session, resource,
+                                                 resource_id)
+            notified.update(self.handle_resources(
+                session=session,
+                method=method,
+                resource_id=resource_id,
+                sub_resource_id=sub_resource_id,
+                author=author,
+                subscribers=subscribers))
 
         if method == 'DELETE' and not (sub_resource_id or sub_resource):
             self.handle_deletions(session, resource, resource_id)
 
+        return sorted(notified)
+
     def handle_deletions(self, session, resource_name, resource_id):
         target_subs = []
         sub_ids = set()
@@ -102,36 +125,50 @@ class Subscription(WorkerTaskBase):
                                       session=session)
 
     def handle_timeline_events(self, session, resource, author, subscribers):
+        """Add a subscription event for each subscriber who can see a
+        timeline event.
 
-        for user_id in subscribers:
-            user = db_api.entity_get(models.User, user_id, session=session)
-            send_notification = get_preference(
-                'receive_notifications_worklists', user)
-            if (send_notification != 'true' and
-                    resource.get('worklist_id') is not None):
-                continue
-
-            if resource['event_type'] == 'user_comment':
-                event_info = json.dumps(
-                    self.resolve_comments(session=session, event=resource)
-                )
-
-            else:
-                event_info = resource['event_info']
-
-            # Don't send a notification if the user isn't allowed to see the
-            # thing this event is about.
-            event = events_api.event_get(
-                resource['id'], current_user=user_id, session=session)
-            if not events_api.is_visible(event, user_id, session=session):
-                continue
+        :return: The IDs of the users who were sent the event.
+        """
+        if not subscribers:
+            return []
+        event = db_api.entity_get(models.TimeLineEvent, resource['id'],
+                                  session=session)
+        if event is None:
+            return []
+
+        # Don't send a notification if the user isn't allowed to see the
+        # thing this event is about.
+        query = events_api.event_visible_users(event, subscribers,
+                                               session=session)
+        if resource.get('worklist_id') is not None:
+            query = query.filter(exists().where(and_(
+                models.UserPreference.user_id == models.User.id,
+                models.UserPreference.key ==
+                'receive_notifications_worklists',
+                models.UserPreference.type == 'string',
+                models.UserPreference.value == 'true')))
+        user_ids = [user_id for (user_id,) in query]
+        if not user_ids:
+            return []
+
+        if resource['event_type'] == 'user_comment':
+            event_info = json.dumps(
+                self.resolve_comments(session=session, event=resource)
+            )
+        else:
+            event_info = resource['event_info']
 
-            db_api.entity_create(models.SubscriptionEvents, {
+        with session.begin(subtransactions=True):
+            session.bulk_insert_mappings(models.SubscriptionEvents, [{
                 "author_id": author.id,
                 "subscriber_id": user_id,
                 "event_type": resource['event_type'],
                 "event_info": event_info
-            }, session=session)
+            } for user_id in user_ids])
+            subscription_events_api.subscription_events_count_new(
+                dict.fromkeys(user_ids, 1), session=session)
+        return user_ids
 
     def handle_resources(self, session, method, resource_id, sub_resource_id,
                          author, subscribers):
@@ -168,6 +205,12 @@ class Subscription(WorkerTaskBase):
                         "event_info": json.dumps(
                             {'project_group_id': resource_id})
                     }, session=session)
+            else:
+                return []
+
+        subscription_events_api.subscription_events_count_new(
+            dict.fromkeys(subscribers, 1), session=session)
+        return subscribers
 
     def resolve_comments(self, session, event):
 
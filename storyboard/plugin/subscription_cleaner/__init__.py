@@ -0,0 +1,47 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from oslo_config import cfg
+
+from storyboard.common import event_types
+
+CONF = cfg.CONF
+
+PLUGIN_OPTS = [
+    cfg.BoolOpt("enable",
+                default=False,
+                help="Enable, or disable, the subscription event cleaner"),
+    cfg.IntOpt("max_age",
+               default=180,
+               help="The number of days to keep subscription events for. "
+                    "0 keeps them forever."),
+    cfg.IntOpt("compact_after",
+               default=48,
+               help="The number of hours after which repeated subscription "
+                    "events of the same type on the same story are merged "
+                    "into one. 0 never merges them."),
+    cfg.ListOpt("compact_event_types",
+                default=[event_types.STORY_DETAILS_CHANGED,
+                         event_types.TAGS_ADDED,
+                         event_types.TAGS_DELETED,
+                         event_types.TASK_DETAILS_CHANGED,
+                         event_types.TASK_STATUS_CHANGED,
+                         event_types.TASK_PRIORITY_CHANGED,
+                         event_types.TASK_ASSIGNEE_CHANGED],
+                help="The types of subscription event which may be merged."),
+    cfg.IntOpt("chunk_size",
+               default=1000,
+               help="The number of subscription events to remove in each "
+                    "transaction.")
+]
+
+CONF.register_opts(PLUGIN_OPTS, "plugin_subscription_cleaner")
@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime
+from datetime import timedelta
+import json
+
+from apscheduler.triggers.interval import IntervalTrigger
+from oslo_log import log
+import pytz
+from sqlalchemy import and_
+from sqlalchemy import or_
+
+import storyboard.db.api.base as api_base
+from storyboard.db.api import subscription_events as subscription_events_api
+from storyboard.db.models import SubscriptionEvents
+from storyboard.plugin.scheduler.base import SchedulerPluginBase
+
+LOG = log.getLogger(__name__)
+
+
+class SubscriptionEventCleaner(SchedulerPluginBase):
+    """A Cron Plugin which keeps the subscription_events table from growing
+    forever. Events older than max_age days are removed, and repeated
+    events of the same type on the same story are merged into the latest
+    one once they are compact_after hours old. The merged event's info
+    records how many events it stands for.
+    """
+
+    def enabled(self):
+        """Indicate whether this plugin is enabled. This indicates whether
+        this plugin alone is runnable, as opposed to the entire cron system.
+        """
+        if 'plugin_subscription_cleaner' in self.config:
+            return self.config.plugin_subscription_cleaner.enable or False
+        return False
+
+    def trigger(self):
+        """This plugin executes every hour."""
+        return IntervalTrigger(hours=1, timezone=pytz.utc)
+
+    def run(self):
+        """Purge and compact the subscription events, in chunks, and count
+        the unread events of their subscribers again.
+        """
+        config = self.config.plugin_subscription_cleaner
+        now = datetime.now(pytz.utc)
+        chunk_size = max(1, config.chunk_size)
+
+        session = api_base.get_session(in_request=False,
+                                       autocommit=False,
+                                       expire_on_commit=True)
+        try:
+            subscriber_ids = set()
+            if config.max_age > 0:
+                subscriber_ids.update(self.purge(
+                    session, now - timedelta(days=config.max_age),
+                    chunk_size))
+            if config.compact_after > 0 and config.compact_event_types:
+                subscriber_ids.update(self.compact(
+                    session, now - timedelta(hours=config.compact_after),
+                    config.compact_event_types, chunk_size))
+
+            subscriber_ids = sorted(subscriber_ids)
+            for start in range(0, len(subscriber_ids), chunk_size):
+                subscription_events_api.subscription_events_recount(
+                    subscriber_ids[start:start + chunk_size],
+                    session=session)
+                session.commit()
+        except Exception as e:
+            LOG.error("Cannot clean up subscription events: %s" % (e,))
+            session.rollback()
+        finally:
+            session.close()
+
+    def purge(self, session, cutoff, chunk_size):
+        """Remove the events created before the cutoff.
+
+        :return: The IDs of the users who had events removed.
+        """
+        subscriber_ids = set()
+        while True:
+            rows = session.query(SubscriptionEvents.id,
+                                 SubscriptionEvents.subscriber_id) \
+                .filter(SubscriptionEvents.created_at < cutoff) \
+                .order_by(SubscriptionEvents.id) \
+                .limit(chunk_size).all()
+            if not rows:
+                break
+
+            self.delete(session, [event_id for event_id, _ in rows])
+            session.commit()
+            subscriber_ids.update(user_id for _, user_id in rows)
+            LOG.debug("Removed %d old subscription events" % len(rows))
+        return subscriber_ids
+
+    def compact(self, session, cutoff, event_types, chunk_size):
+        """Merge each user's events of the same type on the same story,
+        created before the cutoff, into the latest of them.
+
+        :return: The IDs of the users who had events merged.
+        """
+        subscriber_ids = set()
+        subscriber_id = None
+        kept = {}
+        last = None
+        while True:
+            query = api_base.model_query(SubscriptionEvents, session) \
+                .filter(SubscriptionEvents.event_type.in_(event_types)) \
+                .filter(SubscriptionEvents.created_at < cutoff) \
+                .filter(SubscriptionEvents.subscriber_id.isnot(None))
+            if last is not None:
+                query = query.filter(or_(
+                    SubscriptionEvents.subscriber_id > last[0],
+                    and_(SubscriptionEvents.subscriber_id == last[0],
+                         SubscriptionEvents.id > last[1])))
+            events = query.order_by(SubscriptionEvents.subscriber_id,
+                                    SubscriptionEvents.id) \
+                .limit(chunk_size).all()
+            if not events:
+                break
+
+            merged_ids = []
+            for event in events:
+                if event.subscriber_id != subscriber_id:
+                    subscriber_id = event.subscriber_id
+                    kept = {}
+
+                info = self.get_event_info(event)
+                if info.get('story_id') is None:
+                    continue
+                count = info.get('compacted', 1)
+                key = (event.event_type, info['story_id'])
+                if key in kept:
+                    merged_id, merged_count = kept[key]
+                    merged_ids.append(merged_id)
+                    count += merged_count
+                    info['compacted'] = count
+                    event.event_info = json.dumps(info)
+                    subscriber_ids.add(subscriber_id)
+                kept[key] = (event.id, count)
+            last = (events[-1].subscriber_id, events[-1].id)
+
+            self.delete(session, merged_ids)
+            session.commit()
+        return subscriber_ids
+
+    def delete(self, session, event_ids):
+        if not event_ids:
+            return
+        session.query(SubscriptionEvents) \
+            .filter(SubscriptionEvents.id.in_(event_ids)) \
+            .delete(synchronize_session=False)
+
+    def get_event_info(self, event):
+        try:
+            info = json.loads(event.event_info or '{}')
+        except ValueError:
+            return {}
+        if not isinstance(info, dict):
+            return {}
+        return info
@@ -0,0 +1,113 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+import fixtures
+from oslo_config import cfg
+
+from storyboard.db.models import SubscriptionEvents
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import stream
+from storyboard.tests import base
+from storyboard.tests.mock_data import load_data
+
+
+CONF = cfg.CONF
+
+
+class TestSubscriptionEventsAsUser(base.FunctionalTest):
+    def setUp(self):
+        super(TestSubscriptionEventsAsUser, self).setUp()
+        self.resource = '/subscription_events'
+        self.default_headers['Authorization'] = 'Bearer valid_user_token'
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(transport='database', group='notifications')
+
+        self.event_ids = [101, 102, 103, 104]
+        load_data([SubscriptionEvents(id=event_id,
+                                      subscriber_id=subscriber_id,
+                                      author_id=1,
+                                      event_type='story_created',
+                                      event_info='{"story_id": 1}')
+                   for event_id, subscriber_id in zip(self.event_ids,
+                                                      (2, 2, 2, 1))])
+
+    def test_latest(self):
+        response = self.get_json(self.resource + '/latest?limit=2',
+                                 expect_errors=True)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.event_ids[2], self.event_ids[1]],
+                         [event['id'] for event in response.json])
+        self.assertEqual(str(self.event_ids[1]),
+                         response.headers['X-Marker'])
+
+        response = self.get_json(self.resource + '/latest?before=%d' %
+                                 self.event_ids[1])
+        self.assertEqual([self.event_ids[0]],
+                         [event['id'] for event in response])
+
+    def test_latest_other_user(self):
+        response = self.get_json(self.resource + '/latest?subscriber_id=1',
+                                 expect_errors=True)
+        self.assertEqual(403, response.status_code)
+
+    def test_unread(self):
+        response = self.get_json(self.resource + '/unread')
+        self.assertEqual(2, response['user_id'])
+        self.assertEqual(3, response['unread_count'])
+
+        response = self.put_json(self.resource + '/read',
+                                 {'last_read_id': self.event_ids[1]})
+        self.assertEqual(1, response.json['unread_count'])
+
+        response = self.put_json(self.resource + '/read', {})
+        self.assertEqual(0, response.json['unread_count'])
+        self.assertEqual(self.event_ids[2], response.json['last_read_id'])
+
+    def test_poll(self):
+        """Assert that new events are returned straight away, and that
+        requests wait for new ones otherwise.
+        """
+        hub = stream.SubscriptionEventHub(CONF.notifications)
+        self.useFixture(fixtures.MockPatchObject(stream, 'HUB', hub))
+
+        response = self.get_json(self.resource + '/poll?after=%d' %
+                                 self.event_ids[0], expect_errors=True)
+        self.assertEqual([self.event_ids[1], self.event_ids[2]],
+                         [event['id'] for event in response.json])
+        self.assertEqual(str(self.event_ids[2]),
+                         response.headers['X-Marker'])
+
+        response = self.get_json(self.resource + '/poll?timeout=0',
+                                 expect_errors=True)
+        self.assertEqual([], response.json)
+        self.assertEqual(str(self.event_ids[2]),
+                         response.headers['X-Marker'])
+
+        def add_event():
+            load_data([SubscriptionEvents(id=105,
+                                          subscriber_id=2,
+                                          author_id=1,
+                                          event_type='story_created')])
+            hub.notify([2])
+
+        # Wake the request once it is waiting.
+        def listen(user_id):
+            listening = real_listen(user_id)
+            threading.Timer(0.1, add_event).start()
+            return listening
+        real_listen = hub.listen
+        self.useFixture(fixtures.MockPatchObject(hub, 'listen', listen))
+
+        response = self.get_json(self.resource + '/poll?timeout=10')
+        self.assertEqual([105], [event['id'] for event in response])
@@ -0,0 +1,73 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from storyboard.db.api import subscription_events as events_api
+from storyboard.tests.db import base
+
+
+class SubscriptionEventsTest(base.BaseDbTestCase):
+
+    def _create(self, subscriber_id, event_type='story_created'):
+        return events_api.subscription_events_create({
+            'subscriber_id': subscriber_id,
+            'author_id': 1,
+            'event_type': event_type,
+            'event_info': '{"story_id": 1}'
+        })
+
+    def test_get_latest(self):
+        ids = [self._create(2).id for _ in range(5)]
+        self._create(3)
+        self._create(2, 'user_comment')
+
+        latest = events_api.subscription_events_get_latest(
+            2, limit=2, event_type='story_created')
+        self.assertEqual([ids[4], ids[3]], [e.id for e in latest])
+
+        latest = events_api.subscription_events_get_latest(
+            2, limit=2, before=ids[3], event_type='story_created')
+        self.assertEqual([ids[2], ids[1]], [e.id for e in latest])
+
+        self.assertEqual(6, len(
+            events_api.subscription_events_get_latest(2)))
+
+    def test_unread(self):
+        """Assert that the unread counter is kept up to date as events are
+        added, read and removed.
+        """
+        first = self._create(2)
+        self._create(2)
+        counter = events_api.subscription_events_get_unread(2)
+        self.assertEqual(2, counter.unread_count)
+        self.assertIsNone(counter.last_read_id)
+
+        third = self._create(2)
+        self._create(3)
+        self.assertEqual(
+            3, events_api.subscription_events_get_unread(2).unread_count)
+
+        counter = events_api.subscription_events_mark_read(2, first.id)
+        self.assertEqual(first.id, counter.last_read_id)
+        self.assertEqual(2, counter.unread_count)
+
+        # Events can't be marked unread again.
+        counter = events_api.subscription_events_mark_read(2, first.id - 1)
+        self.assertEqual(first.id, counter.last_read_id)
+
+        events_api.subscription_events_delete(third.id)
+        self.assertEqual(
+            1, events_api.subscription_events_get_unread(2).unread_count)
+
+        counter = events_api.subscription_events_mark_read(2)
+        self.assertEqual(0, counter.unread_count)
+        self.assertEqual(
+            1, events_api.subscription_events_get_unread(3).unread_count)
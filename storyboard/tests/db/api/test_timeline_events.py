@@ -0,0 +1,154 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from mock import Mock
+
+from storyboard.common import event_types as event
+from storyboard.db.api import base as api_base
+from storyboard.db.api import timeline_events as events_api
+from storyboard.db import models
+from storyboard.plugin.subscription.base import Subscription
+from storyboard.tests.db import base
+from storyboard.tests import mock_data
+
+
+class TimelineEventsTest(base.BaseDbTestCase):
+
+    def setUp(self):
+        super(TimelineEventsTest, self).setUp()
+
+        permission = models.Permission(id=1, name='private_things',
+                                       codename='edit_things')
+        team_permission = models.Permission(id=2, name='team_things',
+                                            codename='edit_team_things')
+        mock_data.load_data([permission, team_permission])
+        session = api_base.get_session(in_request=False)
+        with session.begin():
+            # Story 2 can be seen by user 2, and story 3 by the members of
+            # team 1, which is user 3.
+            session.query(models.Story).filter(
+                models.Story.id.in_([2, 3])).update(
+                    {'private': True}, synchronize_session=False)
+            session.execute(models.story_permissions.insert(), [
+                {'story_id': 2, 'permission_id': 1},
+                {'story_id': 3, 'permission_id': 2}])
+            session.execute(models.user_permissions.insert(), [
+                {'user_id': 2, 'permission_id': 1}])
+            session.execute(models.team_permissions.insert(), [
+                {'team_id': 1, 'permission_id': 2}])
+            session.execute(models.team_membership.insert(), [
+                {'team_id': 1, 'user_id': 3}])
+
+        mock_data.load_data([
+            # A private worklist user 2 can see, and a public lane in a
+            # private board which user 3 can see.
+            models.Worklist(id=1, title='Private', private=True),
+            models.Worklist(id=2, title='Lane', private=False),
+            models.Board(id=1, title='Private Board', private=True),
+            models.BoardWorklist(id=1, board_id=1, list_id=2, position=0),
+        ])
+        with session.begin():
+            session.execute(models.worklist_permissions.insert(), [
+                {'worklist_id': 1, 'permission_id': 1}])
+            session.execute(models.board_permissions.insert(), [
+                {'board_id': 1, 'permission_id': 2}])
+            session.execute(models.user_permissions.insert(), [
+                {'user_id': 3, 'permission_id': 2}])
+
+        self.session = session
+
+    def _add_event(self, event_id, **kwargs):
+        kwargs.setdefault('event_info', '{}')
+        return mock_data.load_data([
+            models.TimeLineEvent(id=event_id, author_id=1, **kwargs)])[0]
+
+    def _contents_event(self, event_id, worklist_id, *items):
+        # A single item is added the usual way, several by a batch.
+        added = [{'item_type': item_type, 'item_id': item_id}
+                 for item_type, item_id in items]
+        if len(added) == 1:
+            event_type = event.WORKLIST_CONTENTS_CHANGED
+            added = added[0]
+        else:
+            event_type = event.WORKLIST_CONTENTS_BATCH_CHANGED
+        return self._add_event(
+            event_id, worklist_id=worklist_id, event_type=event_type,
+            event_info=json.dumps({'added': added, 'removed': None,
+                                   'updated': None}))
+
+    def _assert_visible_users(self, expected, event_id):
+        timeline_event = api_base.entity_get(models.TimeLineEvent, event_id,
+                                             session=self.session)
+        visible = set(user_id for (user_id,) in events_api.event_visible_users(
+            timeline_event, [1, 2, 3], session=self.session))
+        self.assertEqual(expected, visible)
+
+        # The query gives the same answer as checking each user.
+        checked = set(
+            user_id for user_id in (1, 2, 3) if events_api.is_visible(
+                events_api.event_get(event_id, current_user=user_id,
+                                     session=self.session),
+                user_id, session=self.session))
+        self.assertEqual(checked, visible)
+
+    def test_event_visible_users(self):
+        self._assert_visible_users({1, 2, 3}, 1)
+        self._assert_visible_users({2}, 2)
+        self._assert_visible_users({3}, 3)
+
+        self._contents_event(100, 1, ('story', 1))
+        self._assert_visible_users({2}, 100)
+        self._contents_event(101, 2, ('story', 1))
+        self._assert_visible_users({3}, 101)
+        self._contents_event(102, 2, ('task', 4), ('story', 3))
+        self._assert_visible_users(set(), 102)
+        self._contents_event(103, 1, ('task', 4))
+        self._assert_visible_users({2}, 103)
+        self._contents_event(104, 1, ('story', 100))
+        self._assert_visible_users(set(), 104)
+
+        self._add_event(105, board_id=1, event_type=event.WORKLIST_CREATED)
+        self._assert_visible_users({3}, 105)
+
+    def test_subscription_fan_out(self):
+        """Subscribers are notified of the events they can see, with the
+        comment resolved for each of them.
+        """
+        mock_data.load_data([
+            models.UserPreference(user_id=2,
+                                  key='receive_notifications_worklists',
+                                  value='true', type='string')])
+        author = Mock(id=1)
+        plugin = Subscription(None)
+
+        resource = {'id': 7, 'event_type': event.USER_COMMENT,
+                    'comment_id': 1, 'story_id': 1}
+        self.assertEqual([1, 2, 3], sorted(plugin.handle_timeline_events(
+            self.session, resource, author, [1, 2, 3])))
+        self._contents_event(100, 1, ('task', 4))
+        resource = {'id': 100, 'event_type': event.WORKLIST_CONTENTS_CHANGED,
+                    'event_info': '{}', 'worklist_id': 1}
+        self.assertEqual([2], plugin.handle_timeline_events(
+            self.session, resource, author, [1, 2, 3]))
+
+        sent = self.session.query(models.SubscriptionEvents) \
+            .order_by(models.SubscriptionEvents.id).all()
+        self.assertEqual([(1, event.USER_COMMENT), (2, event.USER_COMMENT),
+                          (3, event.USER_COMMENT),
+                          (2, event.WORKLIST_CONTENTS_CHANGED)],
+                         [(sent_event.subscriber_id, sent_event.event_type)
+                          for sent_event in sent])
+        self.assertEqual('Test Comment',
+                         json.loads(sent[0].event_info)['comment_content'])
+        self.assertIsNotNone(sent[0].created_at)
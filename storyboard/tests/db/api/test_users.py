@@ -0,0 +1,85 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import mock
+
+from storyboard.db.api import users as users_api
+from storyboard.tests.db import base
+
+
+class UserPreferencesTest(base.BaseDbTestCase):
+
+    def setUp(self):
+        super(UserPreferencesTest, self).setUp()
+        self.users = [users_api.user_create({
+            'full_name': 'User %d' % i,
+            'email': 'user%d@example.com' % i
+        }) for i in range(3)]
+        users_api.user_update_preferences(self.users[0].id, {
+            'foo': 'bar',
+            'count': 3,
+            'enabled': True
+        })
+        users_api.user_update_preferences(self.users[1].id, {'foo': 'baz'})
+
+    def test_load_preferences(self):
+        """Assert that the preferences of several users are loaded at once,
+        with their values cast.
+        """
+        preferences = users_api.user_load_preferences(
+            [user.id for user in self.users])
+        self.assertEqual({'foo': 'bar', 'count': 3, 'enabled': True},
+                         preferences[self.users[0].id])
+        self.assertEqual({'foo': 'baz'}, preferences[self.users[1].id])
+        self.assertEqual({}, preferences[self.users[2].id])
+
+    def test_store(self):
+        """Assert that the store keeps preferences until they are
+        invalidated or expire.
+        """
+        store = users_api.PreferenceStore(60)
+        user_ids = [self.users[0].id, self.users[1].id]
+        with mock.patch.object(users_api, 'user_load_preferences',
+                               wraps=users_api.user_load_preferences) as load:
+            self.assertEqual('bar', store.get(user_ids[0], 'foo'))
+            self.assertEqual('baz', store.load(user_ids)[user_ids[1]]['foo'])
+            self.assertEqual(2, load.call_count)
+            self.assertEqual([user_ids[1]], load.call_args[0][0])
+
+            store.load(user_ids)
+            self.assertEqual(2, load.call_count)
+
+            store.invalidate(user_ids[0])
+            self.assertEqual('bar', store.get(user_ids[0], 'foo'))
+            self.assertEqual(3, load.call_count)
+
+            with mock.patch('time.time', return_value=10 ** 10):
+                store.load(user_ids)
+            self.assertEqual(4, load.call_count)
+
+        store = users_api.PreferenceStore(0)
+        self.assertEqual('bar', store.get(user_ids[0], 'foo'))
+        users_api.user_update_preferences(user_ids[0], {'foo': 'qux'})
+        self.assertEqual('qux', store.get(user_ids[0], 'foo'))
+
+    def test_update_invalidates(self):
+        """Assert that changed preferences aren't read from the store."""
+        store = users_api.PreferenceStore(60)
+        with mock.patch.object(users_api, 'PREFERENCE_STORE', store):
+            user_id = self.users[0].id
+            self.assertEqual('bar',
+                             users_api.user_get_preferences(user_id)['foo'])
+            preferences = users_api.user_update_preferences(
+                user_id, {'foo': 'qux', 'count': None})
+            self.assertEqual('qux', preferences['foo'])
+            self.assertNotIn('count', preferences)
+            self.assertEqual('qux', store.get(user_id, 'foo'))
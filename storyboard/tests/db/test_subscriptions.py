@@ -12,7 +12,13 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import mock
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import subscriptions
+from storyboard.db.api.subscriptions import ProjectGroupCache
 from storyboard.db.api.subscriptions import subscription_get_all_subscriber_ids
+from storyboard.db import models
 from storyboard.tests.db import base
 
 
@@ -70,3 +76,55 @@ class TestSubscription(base.BaseDbTestCase):
         self.assertSetEqual(set(), subscribers)
         subscribers = subscription_get_all_subscriber_ids('project_group', 3)
         self.assertSetEqual(set(), subscribers)
+
+    def test_get_subscribers_cached_groups(self):
+        '''The same subscribers are found using a cache of the project
+        groups.
+        '''
+        cache = ProjectGroupCache(60)
+        for resource in ('timeline_event', 'story', 'task', 'project',
+                         'project_group'):
+            for resource_id in range(1, 6):
+                self.assertSetEqual(
+                    subscription_get_all_subscriber_ids(resource,
+                                                        resource_id),
+                    subscription_get_all_subscriber_ids(
+                        resource, resource_id, project_groups=cache))
+
+        self.assertSetEqual({1}, cache.groups([1]))
+        self.assertSetEqual({1, 2}, cache.groups([2, 3]))
+
+    def test_get_subscribers_cached_groups_filtered(self):
+        '''Only the subscriptions to the affected project groups are
+        looked up when using the cache.
+        '''
+        cache = ProjectGroupCache(60)
+        with mock.patch.object(subscriptions, '_subscribed',
+                               wraps=subscriptions._subscribed) as subscribed:
+            subscription_get_all_subscriber_ids('task', 1,
+                                                project_groups=cache)
+        group_ids = [call[0][1] for call in subscribed.call_args_list
+                     if call[0][0] == 'project_group']
+        self.assertEqual([sorted(cache.groups([1]))], group_ids)
+
+    def test_get_subscribers_private_story(self):
+        '''Only users with permission to see a private story are told
+        about it.
+        '''
+        session = api_base.get_session(in_request=False)
+        with session.begin():
+            user = session.query(models.User).get(3)
+            permission = models.Permission(name='view_story_1',
+                                           codename='view_story')
+            permission.users.append(user)
+            story = session.query(models.Story).get(1)
+            story.private = True
+            story.permissions.append(permission)
+
+        self.assertSetEqual({3}, subscription_get_all_subscriber_ids(
+            'story', 1, session=session))
+        self.assertSetEqual({3}, subscription_get_all_subscriber_ids(
+            'task', 1, session=session,
+            project_groups=ProjectGroupCache(60)))
+        self.assertSetEqual({1}, subscription_get_all_subscriber_ids(
+            'project', 1, session=session))
@@ -42,8 +42,18 @@ class DummySMTP(OLD_SMTP):
         self.username = username
         self.password = password
 
+    def noop(self):
+        self.noop_invoked = getattr(self, 'noop_invoked', 0) + 1
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected('Connection closed')
+        return (250, b'OK')
+
     def sendmail(self, from_addr, to_addrs, msg, mail_options=[],
                  rcpt_options=[]):
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected('Connection closed')
+        if getattr(self, 'exception', None) is not None:
+            raise self.exception
         self.sendmail_invoked += 1
         self.from_addr = from_addr
         self.to_addr = to_addrs
@@ -53,6 +63,7 @@ class DummySMTP(OLD_SMTP):
 
     def quit(self):
         self.has_quit = True
+        self.is_connected = False
 
 
 class DummySMTP_SSL(DummySMTP):
@@ -0,0 +1,122 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+
+from mock import Mock
+from mock import patch
+from oslo_config import cfg
+import pytz
+
+from storyboard.db.api import base as api_base
+from storyboard.db.api import event_queue
+from storyboard.db import models
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications.database import DatabasePublisher
+from storyboard.notifications.database import DatabaseSubscriber
+from storyboard.notifications import publisher
+from storyboard.notifications.subscriber import consume_events
+from storyboard.notifications.subscriber import create_subscriber
+from storyboard.tests.db import base
+
+
+CONF = cfg.CONF
+
+
+class TestDatabaseTransport(base.BaseDbTestCase):
+    def setUp(self):
+        super(TestDatabaseTransport, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(transport='database', rabbit_prefetch_count=2,
+                    subscriber_ack_batch_size=2, group='notifications')
+        self.session = api_base.get_session(in_request=False)
+
+    def _publish(self, *topics):
+        db_publisher = DatabasePublisher(CONF.notifications)
+        for i, topic in enumerate(topics):
+            db_publisher.publish_message(topic, {'resource_id': i},
+                                         session=self.session)
+
+    def _subscriber(self):
+        subscriber = create_subscriber(CONF.notifications)
+        self.assertIsInstance(subscriber, DatabaseSubscriber)
+        subscriber.start()
+        return subscriber
+
+    def _queued(self):
+        return self.session.query(models.EventQueue) \
+            .order_by(models.EventQueue.id).all()
+
+    @patch.object(publisher, 'PUBLISHER', None)
+    def test_publish(self):
+        """Events are queued, unless no subscriber would consume them."""
+        with patch.object(event_queue, 'queue_add') as mock_add:
+            publisher.publish('story', resource_id=1, method='PUT')
+            publisher.publish('worklist', resource_id=2, method='PUT')
+        self.assertIsInstance(publisher.PUBLISHER, DatabasePublisher)
+        self.assertEqual(1, mock_add.call_count)
+        self.assertEqual('story', mock_add.call_args[0][0])
+
+    def test_consume(self):
+        """Events are delivered in order, and removed once acknowledged."""
+        self._publish('story', 'task', 'story')
+        subscriber = self._subscriber()
+
+        messages = subscriber.consume(0)
+        first = [next(messages) for _i in range(2)]
+        self.assertEqual([0, 1], [json.loads(body)['resource_id']
+                                  for _m, _p, body in first])
+
+        # Nothing more is claimed until earlier events are acknowledged.
+        self.assertEqual((None, None, None), next(messages))
+        subscriber.ack(first[1][0].delivery_tag, multiple=True)
+        method, properties, body = next(messages)
+        self.assertEqual(2, json.loads(body)['resource_id'])
+        self.assertEqual('application/json', properties.content_type)
+
+        subscriber.ack(method.delivery_tag)
+        self.assertEqual([], self._queued())
+
+    def test_competing_subscribers(self):
+        """Events claimed by one subscriber aren't given to another, until
+        they are handed back or the claim expires.
+        """
+        self._publish('story', 'task')
+        one = self._subscriber()
+        two = self._subscriber()
+
+        messages = one.consume(0)
+        claimed = [next(messages), next(messages)]
+        self.assertEqual((None, None, None), next(two.consume(0)))
+
+        one.cancel()
+        method, _properties, _body = next(two.consume(0))
+        self.assertEqual(claimed[0][0].delivery_tag, method.delivery_tag)
+
+        self.session.query(models.EventQueue).update(
+            {'claimed_until': datetime.datetime.now(pytz.utc) -
+             datetime.timedelta(seconds=1)})
+        self.assertEqual(claimed[0][0].delivery_tag,
+                         next(one.consume(0))[0].delivery_tag)
+
+    def test_consume_events(self):
+        """The worker daemon consumes from the database queue."""
+        self._publish('story', 'task', 'project')
+        subscriber = self._subscriber()
+        dispatcher = Mock()
+        dispatcher.dispatch.side_effect = \
+            lambda *args: len(self._queued()) == 1 and subscriber.drain()
+
+        consume_events(subscriber, dispatcher, CONF.notifications)
+        self.assertEqual(3, dispatcher.dispatch.call_count)
+        self.assertEqual([], self._queued())
@@ -0,0 +1,61 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from mock import patch
+
+from storyboard.notifications import encoding
+from storyboard.tests import base
+
+
+class TestEncoding(base.TestCase):
+    payload = {
+        'resource': 'story',
+        'resource_id': 1,
+        'resource_after': {'title': u'Café', 'tags': ['a', 'b']},
+        'resource_before': None
+    }
+
+    def test_json(self):
+        body = encoding.encode(self.payload, encoding.JSON)
+        self.assertEqual(self.payload, encoding.decode(body, encoding.JSON))
+        self.assertEqual(self.payload, encoding.decode(body))
+        self.assertEqual(self.payload,
+                         encoding.decode(body.encode('utf-8')))
+
+    def test_msgpack(self):
+        body = encoding.encode(self.payload, encoding.MSGPACK)
+        self.assertEqual(self.payload,
+                         encoding.decode(body, encoding.MSGPACK))
+        self.assertLess(len(body),
+                        len(encoding.encode(self.payload).encode('utf-8')))
+
+    def test_msgpack_unavailable(self):
+        with patch.object(encoding, 'msgpack', None):
+            self.assertFalse(encoding.available(encoding.MSGPACK))
+            self.assertRaises(ValueError, encoding.decode, b'\x80',
+                              encoding.MSGPACK)
+        self.assertTrue(encoding.available(encoding.JSON))
+
+    def test_diff(self):
+        before = {'id': 1, 'story_id': 2, 'title': 'Old', 'status': 'todo',
+                  'updated_at': 'yesterday'}
+        after = {'id': 1, 'story_id': 2, 'title': 'New', 'status': 'todo',
+                 'updated_at': 'today'}
+
+        self.assertEqual(
+            ({'id': 1, 'story_id': 2, 'title': 'Old'},
+             {'id': 1, 'story_id': 2, 'title': 'New'}),
+            encoding.diff(before, after))
+
+        # Creations and deletions are sent whole.
+        self.assertEqual((None, after), encoding.diff(None, after))
+        self.assertEqual((before, None), encoding.diff(before, None))
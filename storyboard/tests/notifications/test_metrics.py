@@ -0,0 +1,68 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import sqlalchemy
+
+from storyboard.notifications import metrics
+from storyboard.tests import base
+
+
+class TestMetrics(base.TestCase):
+    def test_merge(self):
+        """The metrics of several processes are added up."""
+        one = metrics.WorkerMetrics()
+        one.record_event(0.02)
+        one.record_plugin('email', 0.2, 3)
+        two = metrics.WorkerMetrics()
+        two.record_event()
+        two.record_plugin('email', 20, 300)
+        two.record_failure('email')
+        two.record_timeout('subscription')
+
+        total = metrics.merge([one.snapshot(), two.snapshot()])
+        self.assertEqual(2, total['events'])
+        self.assertEqual(1, total['lag']['count'])
+        email = total['plugins']['email']
+        self.assertEqual(2, email['events'])
+        self.assertEqual(1, email['failures'])
+        self.assertEqual(20.2, email['latency']['sum'])
+        self.assertEqual(1, email['queries']['counts'][-1])
+        self.assertEqual(1, total['plugins']['subscription']['timeouts'])
+
+    def test_to_prometheus(self):
+        """Histograms are written with cumulative buckets."""
+        worker_metrics = metrics.WorkerMetrics()
+        worker_metrics.record_plugin('email', 0.004, 1)
+        worker_metrics.record_plugin('email', 0.3, 2)
+
+        text = metrics.to_prometheus(worker_metrics.snapshot(), 1.5)
+        self.assertIn('storyboard_worker_events_per_second 1.5\n', text)
+        self.assertIn('storyboard_worker_plugin_events_total'
+                      '{plugin="email"} 2\n', text)
+        self.assertIn('storyboard_worker_plugin_latency_seconds_bucket'
+                      '{plugin="email",le="0.005"} 1\n', text)
+        self.assertIn('storyboard_worker_plugin_latency_seconds_bucket'
+                      '{plugin="email",le="+Inf"} 2\n', text)
+        self.assertIn('storyboard_worker_plugin_queries_count'
+                      '{plugin="email"} 2\n', text)
+        self.assertIn('storyboard_worker_event_lag_seconds_count 0\n', text)
+
+    def test_count_queries(self):
+        """Queries are counted for the current thread."""
+        engine = sqlalchemy.create_engine('sqlite://')
+        metrics.start_counting_queries()
+        engine.execute('SELECT 1')
+        engine.execute('SELECT 2')
+        self.assertEqual(2, metrics.stop_counting_queries())
+
+        engine.execute('SELECT 3')
+        self.assertEqual(0, metrics.stop_counting_queries())
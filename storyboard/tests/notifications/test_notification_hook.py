@@ -17,8 +17,13 @@ from mock import patch
 from storyboard.api.v1.v1_controller import V1Controller
 from storyboard.api.v1.wmodels import Task as TaskWmodel
 import storyboard.common.hook_priorities as priority
+from storyboard.db.api import base as api_base
 from storyboard.db.models import Task
+from storyboard.notifications.notification_hook import capture_changes
+from storyboard.notifications.notification_hook import get_changes
+from storyboard.notifications.notification_hook import get_created_id
 from storyboard.notifications.notification_hook import NotificationHook
+from storyboard.notifications import sharding
 from storyboard.tests.db import base
 from wsme.rest.json import tojson
 
@@ -273,4 +278,128 @@ class TestNotificationHook(base.BaseDbTestCase):
             sub_resource=None,
             sub_resource_id=None,
             resource_before=sot_json,
-            resource_after=smt_json)
+            resource_after=smt_json,
+            payload_mode='full')
+
+    def test_wants_snapshot(self):
+        """Whole resources are sent unless the payload mode is 'diff', and
+        the resource type isn't listed as still wanting them.
+        """
+        n = NotificationHook()
+        self.assertTrue(n.wants_snapshot('story'))
+
+        self.config(event_payload_mode='diff',
+                    full_snapshot_resources=['task'],
+                    group='notifications')
+        self.assertTrue(n.wants_snapshot('task'))
+        self.assertFalse(n.wants_snapshot('story'))
+
+    def test_capture_changes(self):
+        """Only the fields a request changes are recorded."""
+        session = api_base.get_session(in_request=False)
+        capture_changes(session)
+
+        with session.begin():
+            task = Task(creator_id=1, title='Test', status='todo',
+                        story_id=1, project_id=1, priority='medium')
+            session.add(task)
+        task_id = get_created_id(session, Task)
+        self.assertEqual(task.id, task_id)
+        before, after = get_changes(session, Task, task_id)
+        self.assertIsNone(before)
+        self.assertEqual('Test', after['title'])
+
+        session.info['notification_changes'].clear()
+        with session.begin():
+            task.status = 'merged'
+            task.title = 'Renamed'
+        with session.begin():
+            task.title = 'Renamed again'
+        before, after = get_changes(session, Task, task_id)
+        # The foreign keys are always included.
+        parents = {'id': task_id, 'story_id': 1, 'project_id': 1,
+                   'creator_id': 1, 'assignee_id': None, 'branch_id': None,
+                   'milestone_id': None}
+        self.assertEqual(dict(parents, status='todo', title='Test'), before)
+        self.assertEqual(dict(parents, status='merged',
+                              title='Renamed again'),
+                         dict((k, v) for k, v in after.items()
+                              if k != 'updated_at'))
+
+        session.info['notification_changes'].clear()
+        with session.begin():
+            session.delete(task)
+        before, after = get_changes(session, Task, task_id)
+        self.assertEqual('Renamed again', before['title'])
+        self.assertEqual(1, before['story_id'])
+        self.assertIsNone(after)
+
+    @patch('storyboard.notifications.notification_hook.publish')
+    @patch.object(NotificationHook, 'get_original_resource')
+    def test_after_publishes_changes(self, mock_get_original_resource,
+                                     mock_publish):
+        """Resources are only loaded again when a consumer asks for them.
+        """
+        self.config(event_payload_mode='diff', group='notifications')
+        n = NotificationHook()
+        session = api_base.get_session(in_request=False)
+
+        mock_state = Mock()
+        mock_state.request.method = 'PUT'
+        mock_state.request.path = '/v1/tasks/1'
+        mock_state.request.session = session
+        mock_state.response.status_code = 200
+        n.before(mock_state)
+
+        n.after(mock_state)
+        self.assertFalse(mock_get_original_resource.called)
+        kwargs = mock_publish.call_args[1]
+        # Nothing changed, so only the IDs are sent.
+        self.assertEqual(kwargs['resource_before'], kwargs['resource_after'])
+        self.assertEqual(set(['id', 'creator_id', 'story_id', 'project_id',
+                              'assignee_id', 'branch_id', 'milestone_id']),
+                         set(kwargs['resource_after']))
+        self.assertEqual(1, kwargs['resource_after']['id'])
+        self.assertEqual('diff', kwargs['payload_mode'])
+
+    def test_changes_keep_story_shard(self):
+        """A task change which doesn't touch story_id is sharded with the
+        rest of its story's events.
+        """
+        session = api_base.get_session(in_request=False)
+        with session.begin():
+            task = Task(creator_id=1, title='Test', status='todo',
+                        story_id=7, project_id=1, priority='medium')
+            session.add(task)
+
+        capture_changes(session)
+        with session.begin():
+            task.status = 'merged'
+        before, after = get_changes(session, Task, task.id)
+        self.assertEqual(7, after['story_id'])
+
+        for shards in (2, 5, 16):
+            self.assertEqual(
+                sharding.shard_for(shards, 'timeline_event', 100,
+                                   resource_after={'story_id': 7}),
+                sharding.shard_for(shards, 'task', task.id, before, after))
+
+    @patch('storyboard.notifications.notification_hook.publish')
+    def test_after_unmapped_resource(self, mock_publish):
+        """Resources without a model are published without their state."""
+        n = NotificationHook()
+
+        mock_state = Mock()
+        mock_state.request.method = 'POST'
+        mock_state.request.path = '/v1/subscriptions'
+        mock_state.request.session = api_base.get_session(in_request=False)
+        mock_state.response.status_code = 200
+        mock_state.response.body = '{"id": 3}'
+        n.before(mock_state)
+
+        n.after(mock_state)
+        kwargs = mock_publish.call_args[1]
+        self.assertEqual('subscription', kwargs['resource'])
+        self.assertEqual(3, kwargs['resource_id'])
+        self.assertIsNone(kwargs['resource_before'])
+        self.assertIsNone(kwargs['resource_after'])
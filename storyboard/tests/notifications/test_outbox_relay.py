@@ -0,0 +1,73 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from mock import Mock
+from mock import patch
+from oslo_config import cfg
+
+from storyboard.db.api import event_outbox
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications.outbox_relay import OutboxRelay
+from storyboard.notifications import publisher
+from storyboard.tests.db import base
+
+
+CONF = cfg.CONF
+
+
+class TestOutboxRelay(base.BaseDbTestCase):
+    def setUp(self):
+        super(TestOutboxRelay, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(outbox_enabled=True, outbox_batch_size=2,
+                    group='notifications')
+
+    @patch.object(publisher, 'PUBLISHER', None)
+    def test_publish_to_outbox(self):
+        """Events are stored instead of being sent."""
+        publisher.publish('story', resource_id=1, method='PUT')
+        publisher.publish('task', resource_id=2, method='POST')
+        self.assertIsNone(publisher.PUBLISHER)
+
+        entries = event_outbox.outbox_get_batch(10)
+        self.assertEqual(['story', 'task'], [e.topic for e in entries])
+
+    def test_relay_batch(self):
+        """Events are published in order, and removed once sent."""
+        for i in range(3):
+            event_outbox.outbox_add('story', {'resource_id': i})
+
+        sent = []
+        mock_publisher = Mock()
+        mock_publisher.publish_batch.side_effect = \
+            lambda payloads: sent.extend(payloads) or True
+        relay = OutboxRelay(CONF.notifications, publisher=mock_publisher)
+
+        self.assertEqual(2, relay.relay_batch())
+        self.assertEqual(1, relay.relay_batch())
+        self.assertEqual(0, relay.relay_batch())
+        self.assertEqual([0, 1, 2],
+                         [p.payload['resource_id'] for p in sent])
+        self.assertEqual([], event_outbox.outbox_get_batch(10))
+
+    def test_relay_failure(self):
+        """Events are kept when the broker doesn't accept them."""
+        event_outbox.outbox_add('story', {'resource_id': 1})
+
+        mock_publisher = Mock()
+        mock_publisher.publish_batch.return_value = False
+        mock_publisher.pending_count.return_value = 1
+        relay = OutboxRelay(CONF.notifications, publisher=mock_publisher)
+
+        self.assertEqual(0, relay.relay_batch())
+        mock_publisher.drop_pending.assert_called_once_with(1)
+        self.assertEqual(1, len(event_outbox.outbox_get_batch(10)))
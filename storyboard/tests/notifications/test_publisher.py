@@ -0,0 +1,141 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from mock import Mock
+from mock import patch
+from oslo_config import cfg
+from pika.exceptions import AMQPError
+
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import encoding
+from storyboard.notifications.publisher import AsyncPublisher
+from storyboard.notifications.publisher import Payload
+from storyboard.notifications.publisher import Publisher
+from storyboard.tests import base
+
+
+CONF = cfg.CONF
+
+
+class TestPublisher(base.TestCase):
+    def setUp(self):
+        super(TestPublisher, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.publisher = Publisher(CONF.notifications, batched=True)
+        self.publisher._connection = Mock()
+        self.publisher._channel = Mock()
+        self.publisher._open = True
+
+    def test_publish_batch(self):
+        """A batch is committed in a single transaction."""
+        payloads = [Payload('test', {'id': i}) for i in range(3)]
+        self.assertTrue(self.publisher.publish_batch(payloads))
+
+        channel = self.publisher._channel
+        self.assertEqual(3, channel.basic_publish.call_count)
+        self.assertEqual(1, channel.tx_commit.call_count)
+        self.assertEqual(0, self.publisher.pending_count())
+
+    def test_publish_msgpack(self):
+        """Messages are encoded with the configured content type."""
+        self.config(rabbit_content_type=encoding.MSGPACK,
+                    group='notifications')
+        self.publisher = Publisher(CONF.notifications, batched=True)
+        self.publisher._connection = Mock()
+        self.publisher._channel = Mock()
+        self.publisher._open = True
+
+        self.publisher.publish_batch([Payload('test', {'id': 1})])
+        args = self.publisher._channel.basic_publish.call_args[0]
+        self.assertEqual({'id': 1}, encoding.decode(args[2],
+                                                    encoding.MSGPACK))
+        self.assertEqual(encoding.MSGPACK, args[3].content_type)
+
+    def test_publish_batch_failure(self):
+        """A failed batch is kept for the next attempt."""
+        channel = self.publisher._channel
+        channel.tx_commit.side_effect = AMQPError()
+        payloads = [Payload('test', {'id': i}) for i in range(3)]
+
+        self.assertFalse(self.publisher.publish_batch(payloads))
+        self.assertFalse(self.publisher._open)
+        self.assertEqual(3, self.publisher.pending_count())
+
+        self.publisher._open = True
+        channel.tx_commit.side_effect = None
+        self.assertTrue(self.publisher.publish_batch([]))
+        self.assertEqual(0, self.publisher.pending_count())
+
+
+class TestAsyncPublisher(base.TestCase):
+    def setUp(self):
+        super(TestAsyncPublisher, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(publisher_queue_size=2,
+                    publisher_block_timeout=0,
+                    publisher_flush_interval=0.01,
+                    group='notifications')
+
+    def _topics(self, publisher):
+        topics = []
+        while not publisher._queue.empty():
+            topics.append(publisher._queue.get_nowait().topic)
+        return topics
+
+    def test_drop_new(self):
+        self.config(publisher_overflow_policy='drop_new',
+                    group='notifications')
+        publisher = AsyncPublisher(CONF.notifications)
+        for topic in ('a', 'b', 'c'):
+            publisher.publish_message(topic, {})
+        self.assertEqual(['a', 'b'], self._topics(publisher))
+
+    def test_drop_oldest(self):
+        self.config(publisher_overflow_policy='drop_oldest',
+                    group='notifications')
+        publisher = AsyncPublisher(CONF.notifications)
+        for topic in ('a', 'b', 'c'):
+            publisher.publish_message(topic, {})
+        self.assertEqual(['b', 'c'], self._topics(publisher))
+
+    def test_block(self):
+        publisher = AsyncPublisher(CONF.notifications)
+        for topic in ('a', 'b', 'c'):
+            publisher.publish_message(topic, {})
+        self.assertEqual(['a', 'b'], self._topics(publisher))
+
+    @patch.object(Publisher, 'start')
+    @patch.object(Publisher, 'stop')
+    def test_flush_on_stop(self, mock_stop, mock_start):
+        """Queued messages are published before the thread exits."""
+        publisher = AsyncPublisher(CONF.notifications)
+        sent = []
+
+        def start():
+            publisher._publisher._open = True
+
+        def publish_batch(payloads):
+            sent.extend(p.topic for p in publisher._publisher._pending)
+            publisher._publisher._pending.clear()
+            return True
+
+        mock_start.side_effect = start
+        publisher._publisher.publish_batch = publish_batch
+        publisher.publish_message('a', {})
+        publisher.publish_message('b', {})
+        publisher.start()
+        publisher.stop()
+
+        self.assertEqual(['a', 'b'], sent)
+        self.assertTrue(mock_stop.called)
+        publisher.publish_message('c', {})
+        self.assertEqual(['a', 'b'], sent)
@@ -0,0 +1,51 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from oslo_config import cfg
+
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import sharding
+from storyboard.notifications.subscriber import Subscriber
+from storyboard.tests import base
+
+
+CONF = cfg.CONF
+
+
+class TestSharding(base.TestCase):
+
+    def test_story_events_share_a_shard(self):
+        """Everything that happens to a story goes to the same shard."""
+        for story_id in range(1, 20):
+            shard = sharding.shard_for(4, 'story', story_id)
+            self.assertEqual(shard, sharding.shard_for(
+                4, 'task', 100, resource_after={'story_id': story_id}))
+            self.assertEqual(shard, sharding.shard_for(
+                4, 'task', 100, resource_before={'story_id': story_id}))
+            self.assertEqual(shard, sharding.shard_for(
+                4, 'story', str(story_id)))
+
+    def test_shards_are_used(self):
+        shards = set(sharding.shard_for(4, 'story', story_id)
+                     for story_id in range(100))
+        self.assertEqual(set(range(4)), shards)
+
+    def test_subscriber_queue(self):
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+
+        subscriber = Subscriber(CONF.notifications, shard=2)
+        self.assertEqual('storyboard_events.2', subscriber._queue_name)
+        self.assertIn('story.2', subscriber._binding_keys)
+
+        subscriber = Subscriber(CONF.notifications)
+        self.assertEqual('storyboard_events', subscriber._queue_name)
+        self.assertIn('story', subscriber._binding_keys)
@@ -0,0 +1,108 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+
+from mock import Mock
+from mock import patch
+from oslo_config import cfg
+
+from storyboard.db import models
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import encoding
+from storyboard.notifications import publisher
+from storyboard.notifications import stream
+from storyboard.tests import base as test_base
+from storyboard.tests.db import base
+from storyboard.tests.mock_data import load_data
+
+
+CONF = cfg.CONF
+
+
+class TestSubscriptionEventHub(test_base.TestCase):
+    def setUp(self):
+        super(TestSubscriptionEventHub, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(transport='database', group='notifications')
+        self.hub = stream.SubscriptionEventHub(CONF.notifications)
+
+    def test_notify(self):
+        """Assert that only the requests waiting for a user are woken."""
+        with self.hub.listen(1) as first:
+            with self.hub.listen(1) as second:
+                with self.hub.listen(2) as other:
+                    self.assertEqual([1, 2],
+                                     sorted(self.hub.waiting_users()))
+                    self.hub.notify([1, 3])
+                    self.assertTrue(first.is_set())
+                    self.assertTrue(second.is_set())
+                    self.assertFalse(other.is_set())
+        self.assertEqual([], self.hub.waiting_users())
+
+    def test_rabbit_listener(self):
+        self.config(transport='rabbitmq', group='notifications')
+        hub = stream.SubscriptionEventHub(CONF.notifications)
+        self.assertIsInstance(hub._listener, stream.RabbitListener)
+
+        with hub.listen(2) as woken:
+            hub._listener._handle(
+                Mock(content_type=encoding.JSON),
+                json.dumps({'subscriber_ids': [1, 2]}).encode('utf-8'))
+            self.assertTrue(woken.is_set())
+
+    @patch.object(stream, 'PUBLISHER', None)
+    @patch.object(publisher, 'create_publisher')
+    def test_notify_publishes(self, mock_create_publisher):
+        """Assert that new events are only published for the rabbitmq
+        transport.
+        """
+        stream.notify([2, 1])
+        self.assertFalse(mock_create_publisher.called)
+
+        self.config(transport='rabbitmq', group='notifications')
+        stream.notify([2, 1])
+        mock_create_publisher.return_value.publish_message \
+            .assert_called_once_with('subscription_events',
+                                     {'subscriber_ids': [1, 2]})
+
+
+class TestDatabaseListener(base.BaseDbTestCase):
+    def setUp(self):
+        super(TestDatabaseListener, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(transport='database', group='notifications')
+        self.hub = stream.SubscriptionEventHub(CONF.notifications)
+        self.listener = self.hub._listener
+
+    def _add(self, *subscriber_ids):
+        load_data([models.SubscriptionEvents(subscriber_id=subscriber_id,
+                                             author_id=1,
+                                             event_type='story_created')
+                   for subscriber_id in subscriber_ids])
+
+    def test_poll(self):
+        """Assert that waiting users are woken by events added since the
+        last poll.
+        """
+        self._add(1)
+        with self.hub.listen(1) as woken:
+            self.listener.poll()
+            self.assertFalse(woken.is_set())
+
+            self._add(2)
+            self.listener.poll()
+            self.assertFalse(woken.is_set())
+
+            self._add(1, 3)
+            self.listener.poll()
+            self.assertTrue(woken.is_set())
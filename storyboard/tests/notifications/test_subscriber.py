@@ -0,0 +1,287 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+import time
+
+from mock import call
+from mock import Mock
+from oslo_config import cfg
+
+from storyboard.notifications.conf import NOTIFICATION_OPTS
+from storyboard.notifications import encoding
+from storyboard.notifications import metrics
+from storyboard.notifications.subscriber import consume_events
+from storyboard.notifications.subscriber import EventDispatcher
+from storyboard.notifications.subscriber import Subscriber
+from storyboard.tests import base
+
+
+CONF = cfg.CONF
+
+
+class TestConsumeEvents(base.TestCase):
+    def setUp(self):
+        super(TestConsumeEvents, self).setUp()
+        CONF.register_opts(NOTIFICATION_OPTS, "notifications")
+        self.config(subscriber_ack_batch_size=2, group='notifications')
+
+        self.subscriber = Subscriber(CONF.notifications)
+        self.subscriber._open = True
+        self.subscriber._channel = Mock()
+        self.subscriber.started = True
+        self.dispatcher = Mock()
+
+    def _deliver(self, *tags):
+        """Deliver messages with the given delivery tags, where None means
+        that the inactivity timeout passed. The subscriber is drained once
+        they have all been delivered.
+        """
+        def consume(queue, inactivity_timeout=None):
+            for tag in tags:
+                if tag is None:
+                    yield None, None, None
+                else:
+                    yield (Mock(delivery_tag=tag),
+                           Mock(content_type='application/json'), '{}')
+            self.subscriber.drain()
+            yield None, None, None
+
+        self.subscriber._channel.consume.side_effect = consume
+
+    def test_batched_acks(self):
+        """Messages are acked in groups, after the plugins handle them."""
+        self._deliver(1, 2, 3, 4, 5)
+        consume_events(self.subscriber, self.dispatcher, CONF.notifications)
+
+        self.assertEqual(5, self.dispatcher.dispatch.call_count)
+        self.dispatcher.dispatch.assert_called_with('{}',
+                                                    'application/json')
+        self.assertEqual([call(delivery_tag=2, multiple=True),
+                          call(delivery_tag=4, multiple=True),
+                          call(delivery_tag=5, multiple=True)],
+                         self.subscriber._channel.basic_ack.call_args_list)
+        self.assertTrue(self.subscriber._channel.cancel.called)
+
+    def test_ack_when_idle(self):
+        """Handled messages are acked when the queue goes quiet."""
+        self._deliver(1, None, None, 2)
+        consume_events(self.subscriber, self.dispatcher, CONF.notifications)
+
+        self.assertEqual([call(delivery_tag=1, multiple=True),
+                          call(delivery_tag=2, multiple=True)],
+                         self.subscriber._channel.basic_ack.call_args_list)
+
+    def test_wait_before_ack(self):
+        """Plugins which timed out finish their events before they're
+        acked.
+        """
+        calls = []
+        self.dispatcher.wait.side_effect = lambda: calls.append('wait')
+        self.subscriber._channel.basic_ack.side_effect = \
+            lambda **kwargs: calls.append('ack')
+        self._deliver(1, 2)
+        consume_events(self.subscriber, self.dispatcher, CONF.notifications)
+
+        self.assertEqual(['wait', 'ack'], calls)
+
+    def test_drain(self):
+        """The message being handled is finished and acked on shutdown."""
+        self._deliver(1, 2, 3)
+        self.dispatcher.dispatch.side_effect = \
+            lambda *args: self.subscriber.drain()
+        consume_events(self.subscriber, self.dispatcher, CONF.notifications)
+
+        self.assertEqual(1, self.dispatcher.dispatch.call_count)
+        self.assertEqual([call(delivery_tag=1, multiple=True)],
+                         self.subscriber._channel.basic_ack.call_args_list)
+        self.assertTrue(self.subscriber._channel.cancel.called)
+
+
+class TestEventDispatcher(base.TestCase):
+    def _extension(self, name, event):
+        ext = Mock()
+        ext.name = name
+        ext.obj.event.side_effect = event
+        return ext
+
+    def _payload(self):
+        return ('{"author_id": 1, "method": "PUT", "url": null, '
+                '"path": "/v1/stories/1", "query_string": null, '
+                '"status": 200, "resource": "story", "resource_id": 1, '
+                '"sub_resource": null, "sub_resource_id": null, '
+                '"resource_before": null, "resource_after": null}')
+
+    def test_dispatch(self):
+        """Every plugin gets the decoded event."""
+        handled = []
+        extensions = [self._extension(name, lambda name=name, **kwargs:
+                                      handled.append((name, kwargs)))
+                      for name in ('one', 'two')]
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 5)
+        self.addCleanup(dispatcher.close)
+
+        dispatcher.dispatch(self._payload())
+        self.assertEqual(['one', 'two'], sorted(name for name, _ in handled))
+        self.assertEqual('story', handled[0][1]['resource'])
+        self.assertIsNone(handled[0][1]['url'])
+
+    def test_dispatch_without_context(self):
+        """Plugins whose event method doesn't take an EventContext are
+        called without one.
+        """
+        handled = []
+
+        def event(author_id, method, url, path, query_string, status,
+                  resource, resource_id, sub_resource=None,
+                  sub_resource_id=None, resource_before=None,
+                  resource_after=None):
+            handled.append(resource)
+
+        extension = self._extension('one', None)
+        extension.obj.event = event
+        dispatcher = EventDispatcher(Mock(extensions=[extension]), 5)
+        self.addCleanup(dispatcher.close)
+
+        dispatcher.dispatch(self._payload())
+        self.assertEqual(['story'], handled)
+
+    def test_dispatch_msgpack(self):
+        """Messages are decoded using their content type."""
+        handled = []
+        extensions = [self._extension('one', lambda **kwargs:
+                                      handled.append(kwargs))]
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 5)
+        self.addCleanup(dispatcher.close)
+
+        body = encoding.encode(encoding.decode(self._payload()),
+                               encoding.MSGPACK)
+        dispatcher.dispatch(body, encoding.MSGPACK)
+        self.assertEqual('/v1/stories/1', handled[0]['path'])
+        self.assertFalse(handled[0]['context'].diff_only)
+
+    def test_isolation(self):
+        """A failing or stuck plugin doesn't stop the others."""
+        release = threading.Event()
+        handled = []
+
+        def fail(**kwargs):
+            raise ValueError()
+
+        extensions = [
+            self._extension('stuck', lambda **kwargs: release.wait(5)),
+            self._extension('failing', fail),
+            self._extension('working', lambda **kwargs: handled.append(1))
+        ]
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 0.1)
+        self.addCleanup(dispatcher.close)
+        self.addCleanup(release.set)
+
+        dispatcher.dispatch(self._payload())
+        dispatcher.dispatch('not json')
+        dispatcher.dispatch(self._payload())
+        self.assertEqual([1, 1], handled)
+
+    def test_wait(self):
+        """Events which a plugin timed out on can be waited for."""
+        release = threading.Event()
+        handled = []
+
+        def stuck(**kwargs):
+            release.wait(5)
+            handled.append(1)
+
+        extensions = [self._extension('stuck', stuck)]
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 0.01)
+        self.addCleanup(dispatcher.close)
+        self.addCleanup(release.set)
+
+        dispatcher.dispatch(self._payload())
+        self.assertEqual([], handled)
+
+        threading.Timer(0.1, release.set).start()
+        dispatcher.wait()
+        self.assertEqual([1], handled)
+
+        # Nothing is waited for twice.
+        dispatcher.wait()
+
+    def test_metrics(self):
+        """Events, plugin times, failures and timeouts are recorded."""
+        release = threading.Event()
+
+        def fail(**kwargs):
+            raise ValueError()
+
+        extensions = [
+            self._extension('stuck', lambda **kwargs: release.wait(5)),
+            self._extension('failing', fail),
+            self._extension('working', lambda **kwargs: None)
+        ]
+        worker_metrics = metrics.WorkerMetrics()
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 0.1,
+                                     worker_metrics=worker_metrics)
+        self.addCleanup(dispatcher.close)
+        self.addCleanup(release.set)
+
+        payload = encoding.decode(self._payload())
+        payload['published_at'] = time.time() - 2
+        dispatcher.dispatch(encoding.encode(payload))
+
+        snapshot = worker_metrics.snapshot()
+        self.assertEqual(1, snapshot['events'])
+        self.assertTrue(snapshot['lag']['sum'] >= 2)
+        self.assertEqual(1, snapshot['plugins']['stuck']['timeouts'])
+        self.assertEqual(1, snapshot['plugins']['failing']['failures'])
+        self.assertEqual(1, snapshot['plugins']['working']['events'])
+
+    def test_project_group_cache(self):
+        """The cache is shared by every event, and reloaded when a project
+        group changes.
+        """
+        contexts = []
+        extensions = [self._extension('one', lambda **kwargs:
+                                      contexts.append(kwargs['context']))]
+        project_groups = Mock()
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 5,
+                                     project_groups=project_groups)
+        self.addCleanup(dispatcher.close)
+
+        dispatcher.dispatch(self._payload())
+        self.assertFalse(project_groups.invalidate.called)
+        dispatcher.dispatch(self._payload().replace('"story"',
+                                                    '"project_group"'))
+        self.assertTrue(project_groups.invalidate.called)
+        self.assertIs(project_groups, contexts[0].project_groups)
+
+    def test_preference_store(self):
+        """User events forget the user's preferences before they are
+        handled by the plugins.
+        """
+        contexts = []
+        extensions = [self._extension('one', lambda **kwargs:
+                                      contexts.append(kwargs['context']))]
+        preferences = Mock()
+        dispatcher = EventDispatcher(Mock(extensions=extensions), 5,
+                                     preferences=preferences)
+        self.addCleanup(dispatcher.close)
+
+        dispatcher.dispatch(self._payload())
+        self.assertFalse(preferences.invalidate.called)
+        self.assertIs(preferences, contexts[0].preferences)
+
+        dispatcher.dispatch(self._payload()
+                            .replace('"story"', '"user"')
+                            .replace('"resource_id": 1', '"resource_id": "2"'))
+        preferences.invalidate.assert_called_once_with(2)
+        self.assertEqual(2, len(contexts))
+        self.assertEqual('user', contexts[1].resource)
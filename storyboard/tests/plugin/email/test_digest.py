@@ -0,0 +1,137 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime
+from datetime import timedelta
+import email
+import json
+import smtplib
+
+import mock
+from oslo_config import cfg
+import pytz
+
+import storyboard.db.api.base as db_api
+from storyboard.db import models
+from storyboard.plugin.email.digest import EmailDigest
+from storyboard.plugin.email.digest import last_digest_time
+import storyboard.tests.db.base as db_base
+from storyboard.tests.mock_data import load_data
+
+
+CONF = cfg.CONF
+
+
+class TestEmailDigest(db_base.BaseDbTestCase):
+
+    def setUp(self):
+        super(TestEmailDigest, self).setUp()
+        self.config(default_url='https://storyboard.example.org/',
+                    digest_batch_size=1, group='plugin_email')
+
+        patcher = mock.patch(
+            'storyboard.plugin.email.smtp_client.get_pooled_smtp_client')
+        get_smtp_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.smtp = mock.Mock(smtplib.SMTP)
+        get_smtp_client.return_value.__enter__ = self.smtp
+
+    def _add_events(self, subscriber_id, *events):
+        load_data([models.SubscriptionEvents(subscriber_id=subscriber_id,
+                                             author_id=2,
+                                             event_type=event_type,
+                                             event_info=json.dumps(info))
+                   for event_type, info in events])
+
+    def _sent(self):
+        sent = []
+        for call in self.smtp.return_value.sendmail.call_args_list:
+            message = email.message_from_string(call[1]['msg'])
+            body = message.get_payload()[0].get_payload(decode=True)
+            sent.append((call[1]['to_addrs'], body.decode('utf-8')))
+        return sent
+
+    def _state(self, user_id):
+        return db_api.model_query(models.EmailDigestState) \
+            .filter_by(user_id=user_id).first()
+
+    def test_trigger(self):
+        """Assert that this plugin runs every ten minutes."""
+        plugin = EmailDigest(CONF)
+        self.assertEqual(600, plugin.trigger().interval_length)
+
+    def test_last_digest_time(self):
+        now = datetime(2026, 10, 19, 9, 30, tzinfo=pytz.utc)
+        self.assertEqual(datetime(2026, 10, 19, 8, 0, tzinfo=pytz.utc),
+                         last_digest_time(8 * 60 * 60, now))
+        self.assertEqual(datetime(2026, 10, 18, 10, 0, tzinfo=pytz.utc),
+                         last_digest_time(10 * 60 * 60, now))
+        self.assertEqual(datetime(2026, 10, 19, 8, 0, tzinfo=pytz.utc),
+                         last_digest_time('invalid', now))
+
+    def test_run(self):
+        """Digest users get one email, grouped by story, each time their
+        digest is due.
+        """
+        self._add_events(
+            1,
+            ('task_status_changed', {'story_id': 1, 'task_title': 'A task',
+                                     'old_status': 'todo',
+                                     'new_status': 'merged'}),
+            ('user_comment', {'story_id': 1, 'story_title': 'Old title',
+                              'comment_content': 'Looks good'}),
+            ('project added to project_group', {'project_group_id': 1,
+                                                'project_id': 2}))
+        # User 3 gets individual emails instead.
+        self._add_events(3, ('story_created', {'story_id': 2}))
+
+        EmailDigest(CONF).run()
+        sent = self._sent()
+        self.assertEqual(1, len(sent))
+        recipient, body = sent[0]
+        self.assertEqual('superuser@example.com', recipient)
+        self.assertIn('Story "E Test story 1 - foo"', body)
+        self.assertIn('#!/story/1', body)
+        self.assertIn('Regular User changed the status of "A task" from '
+                      'todo to merged.', body)
+        self.assertIn('Looks good', body)
+        self.assertIn('project added to project group', body)
+        self.assertIsNotNone(self._state(1).last_event_id)
+        self.assertIsNone(self._state(3))
+
+        # Nothing more is sent until the digest is due again, and then only
+        # the new events are sent.
+        EmailDigest(CONF).run()
+        self.assertEqual(1, len(self._sent()))
+
+        db_api.model_query(models.EmailDigestState).update(
+            {'last_sent_at': datetime.now(pytz.utc) - timedelta(days=2)})
+        self._add_events(1, ('story_created', {'story_id': 2}))
+        EmailDigest(CONF).run()
+        sent = self._sent()
+        self.assertEqual(2, len(sent))
+        self.assertIn('D Test story 2 - bar', sent[1][1])
+        self.assertNotIn('Looks good', sent[1][1])
+
+    def test_run_failure(self):
+        """Digests which can't be sent are tried again next time."""
+        self._add_events(1, ('story_created', {'story_id': 2}))
+        self.smtp.return_value.sendmail.side_effect = \
+            smtplib.SMTPRecipientsRefused({})
+
+        EmailDigest(CONF).run()
+        self.assertIsNone(self._state(1))
+
+        self.smtp.return_value.sendmail.side_effect = None
+        EmailDigest(CONF).run()
+        self.assertEqual(2, self.smtp.return_value.sendmail.call_count)
+        self.assertIsNotNone(self._state(1))
@@ -13,11 +13,19 @@
 # implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import email
+import os
+import shutil
+import tempfile
+
+import mock
 import six
 
 from jinja2.exceptions import TemplateNotFound
 
+from storyboard.plugin.email import factory as email_factory
 from storyboard.plugin.email.factory import EmailFactory
+from storyboard.plugin.email.factory import get_template_matrix
 from storyboard.tests import base
 
 
@@ -161,3 +169,79 @@ class TestEmailFactory(base.TestCase):
             self.assertFalse(True)
         except TemplateNotFound:
             self.assertFalse(False)
+
+    def test_shared_environment(self):
+        """Assert that factories share one environment, so that templates
+        are only compiled once.
+        """
+        factory = EmailFactory('test@example.org',
+                               'test_subject.txt',
+                               'test.txt',
+                               'storyboard.tests.plugin.email')
+        other_factory = EmailFactory('test@example.org',
+                                     'test_subject.txt',
+                                     'test.txt',
+                                     'storyboard.tests.plugin.email')
+        self.assertIs(factory.env, other_factory.env)
+        self.assertIs(factory.subject, other_factory.subject)
+        self.assertIs(factory.template_cache['plain'],
+                      other_factory.template_cache['plain'])
+
+    def test_render(self):
+        """Assert that an email can be rendered once, and addressed to each
+        recipient.
+        """
+        factory = EmailFactory('test@example.org',
+                               'test_subject.txt',
+                               'test.txt',
+                               'storyboard.tests.plugin.email')
+        factory.add_header('X-Custom-Header', 'test-header-value')
+        rendered = factory.render(test_parameter='value')
+
+        first = email.message_from_string(
+            rendered.for_recipient('first@example.org'))
+        second = email.message_from_string(
+            rendered.for_recipient('second@example.org'))
+        self.assertEqual('first@example.org', first.get('To'))
+        self.assertEqual('second@example.org', second.get('To'))
+        self.assertNotEqual(first.get('Message-ID'),
+                            second.get('Message-ID'))
+        for msg in (first, second):
+            self.assertEqual('test@example.org', msg.get('From'))
+            self.assertEqual('value', msg.get('Subject'))
+            self.assertEqual('test-header-value',
+                             msg.get('X-Custom-Header'))
+            self.assertEqual(b'value',
+                             msg.get_payload(0).get_payload(decode=True))
+
+        msg = email.message_from_string(rendered.for_recipients())
+        self.assertEqual('undisclosed-recipients:;', msg.get('To'))
+
+    @mock.patch.dict(email_factory._ENVIRONMENTS, clear=True)
+    def test_bytecode_cache(self):
+        """Assert that compiled templates are cached on disk, if a cache
+        directory is configured.
+        """
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        self.config(template_cache_dir=cache_dir, group='plugin_email')
+
+        EmailFactory('test@example.org',
+                     'test_subject.txt',
+                     'test.txt',
+                     'storyboard.tests.plugin.email')
+        self.assertEqual(2, len(os.listdir(cache_dir)))
+
+    def test_template_matrix(self):
+        """Assert that the templates are found for each resource,
+        sub-resource and method which has them.
+        """
+        matrix = get_template_matrix()
+        self.assertEqual(('story/PUT_subject.txt', 'story/PUT.txt', None),
+                         matrix[('story', None, 'PUT')])
+        self.assertEqual(('story/comment/POST_subject.txt',
+                          'story/comment/POST.txt', None),
+                         matrix[('story', 'comment', 'POST')])
+        self.assertNotIn(('story', None, 'DELETE'), matrix)
+        self.assertNotIn(('project', None, 'PUT'), matrix)
+        self.assertIs(matrix, get_template_matrix())
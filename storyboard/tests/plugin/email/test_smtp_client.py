@@ -12,8 +12,13 @@
 # implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import smtplib
+import time
+
 from oslo_config import cfg
 
+from storyboard.plugin.email import smtp_client as smtp
+from storyboard.plugin.email.smtp_client import get_pooled_smtp_client
 from storyboard.plugin.email.smtp_client import get_smtp_client
 from storyboard.tests import base
 from storyboard.tests import mock_smtp as mock
@@ -108,3 +113,96 @@ class TestGetSender(base.TestCase):
 
         self.assertTrue(smtp_client.has_quit)
         self.clear_config()
+
+
+class TestSMTPConnectionPool(base.TestCase):
+    def setUp(self):
+        super(TestSMTPConnectionPool, self).setUp()
+        self.config(smtp_pool_size=1, smtp_pool_max_messages=100,
+                    smtp_pool_idle_timeout=60,
+                    smtp_pool_keepalive_interval=15, group='plugin_email')
+        smtp.close_pool()
+        self.addCleanup(smtp.close_pool)
+
+    def send(self):
+        with get_pooled_smtp_client() as connection:
+            connection.sendmail('from@example.com', 'to@example.com', 'msg')
+            return connection.client
+
+    def idle_for(self, seconds):
+        for connection in smtp.get_pool()._idle:
+            connection.last_used = time.time() - seconds
+
+    def test_reuse(self):
+        """Assert that connections are kept open between uses."""
+        client = self.send()
+        self.assertIsInstance(client, mock.DummySMTP)
+        self.assertIs(client, self.send())
+        self.assertEqual(2, client.sendmail_invoked)
+        self.assertFalse(hasattr(client, 'has_quit'))
+
+        smtp.close_pool()
+        self.assertTrue(client.has_quit)
+
+    def test_no_pool(self):
+        """Assert that a pool size of 0 opens a connection for each use."""
+        self.config(smtp_pool_size=0, group='plugin_email')
+        smtp.close_pool()
+
+        client = self.send()
+        self.assertTrue(client.has_quit)
+        self.assertIsNot(client, self.send())
+
+    def test_max_messages(self):
+        """Assert that connections are replaced after sending enough
+        messages.
+        """
+        self.config(smtp_pool_max_messages=3, group='plugin_email')
+        smtp.close_pool()
+
+        client = self.send()
+        self.send()
+        self.assertIsNone(self.send())
+        self.assertTrue(client.has_quit)
+        self.assertIsNot(client, self.send())
+
+    def test_idle_timeout(self):
+        """Assert that connections which have been idle too long are closed.
+        """
+        client = self.send()
+        self.idle_for(61)
+        self.assertIsNot(client, self.send())
+        self.assertTrue(client.has_quit)
+
+    def test_keepalive(self):
+        """Assert that idle connections are checked before they're reused,
+        and replaced if they've been closed.
+        """
+        client = self.send()
+        self.assertIs(client, self.send())
+        self.assertFalse(hasattr(client, 'noop_invoked'))
+
+        self.idle_for(20)
+        self.assertIs(client, self.send())
+        self.assertEqual(1, client.noop_invoked)
+
+        client.is_connected = False
+        self.idle_for(20)
+        self.assertIsNot(client, self.send())
+
+    def test_reconnect(self):
+        """Assert that a message is sent again over a new connection if the
+        connection fails.
+        """
+        client = self.send()
+        client.is_connected = False
+        new_client = self.send()
+        self.assertIsNot(client, new_client)
+        self.assertEqual(1, new_client.sendmail_invoked)
+
+        # Other errors are raised, and the connection is kept.
+        new_client.exception = smtplib.SMTPRecipientsRefused({})
+        self.assertRaises(smtplib.SMTPRecipientsRefused, self.send)
+        self.assertEqual(1, new_client.sendmail_invoked)
+        del new_client.exception
+        self.assertIs(new_client, self.send())
@@ -0,0 +1,261 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import smtplib
+import time
+
+import mock
+from oslo_config import cfg
+
+import storyboard.db.api.base as db_api
+from storyboard.db.api import mail_queue
+from storyboard.db import models
+from storyboard.plugin.email import sender
+from storyboard.plugin.email import spool
+import storyboard.tests.db.base as db_base
+
+
+CONF = cfg.CONF
+
+
+class TestSpool(db_base.BaseDbTestCase):
+
+    def setUp(self):
+        super(TestSpool, self).setUp()
+        self.config(spool=True, group='plugin_email')
+
+        patcher = mock.patch(
+            'storyboard.plugin.email.smtp_client.get_pooled_smtp_client')
+        get_smtp_client = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.smtp = mock.Mock(smtplib.SMTP)
+        get_smtp_client.return_value.__enter__ = self.smtp
+
+    def _entries(self):
+        session = db_api.get_session(in_request=False)
+        return db_api.model_query(models.MailQueue, session) \
+            .order_by(models.MailQueue.id).all()
+
+    def test_get_mail_client(self):
+        """Assert that emails are spooled instead of sent, one per domain,
+        when the spool is enabled.
+        """
+        with spool.get_mail_client() as client:
+            client.sendmail(from_addr='storyboard@example.org',
+                            to_addrs=['a@example.com', 'b@Example.com',
+                                      'c@example.net'],
+                            msg='A message')
+        self.assertFalse(self.smtp.return_value.sendmail.called)
+
+        entries = self._entries()
+        self.assertEqual(2, len(entries))
+        self.assertEqual('example.com', entries[0].domain)
+        self.assertEqual(['a@example.com', 'b@Example.com'],
+                         json.loads(entries[0].recipients))
+        self.assertEqual('example.net', entries[1].domain)
+        self.assertEqual('A message', entries[1].message)
+
+        self.config(spool=False, group='plugin_email')
+        with spool.get_mail_client() as client:
+            client.sendmail(from_addr='storyboard@example.org',
+                            to_addrs='a@example.com', msg='A message')
+        self.assertTrue(self.smtp.return_value.sendmail.called)
+        self.assertEqual(2, len(self._entries()))
+
+    def test_claim(self):
+        """Assert that each email is only claimed by one sender at a time,
+        until the claim expires.
+        """
+        for domain in ('example.com', 'example.net'):
+            mail_queue.mail_add('storyboard@example.org',
+                                ['a@' + domain], domain, 'A message')
+
+        first = mail_queue.mail_claim('first', 1, 300)
+        second = mail_queue.mail_claim('second', 10, 300)
+        self.assertEqual(1, len(first))
+        self.assertEqual(1, len(second))
+        self.assertNotEqual(first[0].id, second[0].id)
+        self.assertEqual([], mail_queue.mail_claim('third', 10, 300))
+
+        mail_queue.mail_release('first')
+        self.assertEqual([first[0].id],
+                         [entry.id for entry in
+                          mail_queue.mail_claim('third', 10, -1)])
+        # An expired claim can be taken over.
+        self.assertEqual(1, len(mail_queue.mail_claim('fourth', 10, 300)))
+
+        # Deferred emails aren't due yet.
+        mail_queue.mail_defer('second', second[0].id, 60)
+        self.assertEqual([], mail_queue.mail_claim('fifth', 10, 300))
+
+    def test_send_batch(self):
+        """Assert that sent emails are removed, failed ones are tried again
+        later, and permanently refused ones are kept as dead letters.
+        """
+        self.config(spool_retry_delay=60, group='plugin_email')
+        for recipient in ('sent', 'failed', 'refused'):
+            mail_queue.mail_add('storyboard@example.org',
+                                [recipient + '@example.com'],
+                                'example.com', 'A message')
+
+        def sendmail(from_addr, to_addrs, msg):
+            if to_addrs == ['failed@example.com']:
+                raise smtplib.SMTPServerDisconnected()
+            if to_addrs == ['refused@example.com']:
+                raise smtplib.SMTPRecipientsRefused(
+                    {'refused@example.com': (550, 'No such user')})
+        self.smtp.return_value.sendmail.side_effect = sendmail
+
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        self.assertEqual(3, mail_sender.send_batch())
+
+        failed, refused = self._entries()
+        self.assertEqual(1, failed.attempts)
+        self.assertIsNone(failed.claimed_by)
+        self.assertIsNotNone(failed.next_attempt_at)
+        self.assertIsNone(failed.dead_at)
+        self.assertIsNotNone(refused.dead_at)
+        self.assertIn('No such user', refused.last_error)
+
+        # Nothing is due until the failed email's retry.
+        self.assertEqual(0, mail_sender.send_batch())
+
+    def test_max_attempts(self):
+        self.config(spool_max_attempts=2, spool_retry_delay=-1,
+                    group='plugin_email')
+        mail_queue.mail_add('storyboard@example.org', ['a@example.com'],
+                            'example.com', 'A message')
+        self.smtp.return_value.sendmail.side_effect = \
+            smtplib.SMTPServerDisconnected()
+
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        mail_sender.send_batch()
+        self.assertIsNone(self._entries()[0].dead_at)
+        mail_sender.send_batch()
+        entry = self._entries()[0]
+        self.assertEqual(2, entry.attempts)
+        self.assertIsNotNone(entry.dead_at)
+        self.assertEqual(0, mail_sender.send_batch())
+
+    def test_rate_limit(self):
+        """Assert that emails over a domain's rate limit are put off."""
+        self.config(spool_domain_rate_limit=2, group='plugin_email')
+        for domain in ('example.com', 'example.com', 'example.com',
+                       'example.net'):
+            mail_queue.mail_add('storyboard@example.org', ['a@' + domain],
+                                domain, 'A message')
+
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        self.assertEqual(4, mail_sender.send_batch())
+        self.assertEqual(3, self.smtp.return_value.sendmail.call_count)
+
+        entries = self._entries()
+        self.assertEqual(1, len(entries))
+        self.assertEqual('example.com', entries[0].domain)
+        self.assertEqual(0, entries[0].attempts)
+        self.assertIsNotNone(entries[0].next_attempt_at)
+
+    def test_own_sessions(self):
+        """Assert that the sender doesn't need a request's session, since
+        it runs in a process of its own.
+        """
+        self.config(spool_domain_rate_limit=2, spool_retry_delay=60,
+                    group='plugin_email')
+        for recipient in ('sent', 'failed', 'deferred'):
+            mail_queue.mail_add('storyboard@example.org',
+                                [recipient + '@example.com'],
+                                'example.com', 'A message')
+
+        def sendmail(from_addr, to_addrs, msg):
+            if to_addrs == ['failed@example.com']:
+                raise smtplib.SMTPServerDisconnected()
+        self.smtp.return_value.sendmail.side_effect = sendmail
+
+        # Without the test case's patch, sessions default to the API
+        # request's, which the sender doesn't have.
+        self._reset_get_session()
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        self.assertEqual(3, mail_sender.send_batch())
+
+        failed, deferred = self._entries()
+        self.assertEqual(1, failed.attempts)
+        self.assertEqual(0, deferred.attempts)
+        self.assertIsNotNone(deferred.next_attempt_at)
+
+        # Nothing is due, and the sender releases its claims as it stops.
+        clock = mock.Mock(time=time.time, sleep=mock.Mock(
+            side_effect=KeyboardInterrupt))
+        with mock.patch.object(sender, 'time', clock):
+            self.assertRaises(KeyboardInterrupt, mail_sender.run)
+        self.assertEqual([None, None],
+                         [entry.claimed_by for entry in self._entries()])
+
+    def test_unexpected_error(self):
+        """Assert that an email which fails for any other reason is kept
+        as a dead letter, rather than stopping the sender.
+        """
+        for recipient in ('broken', 'sent'):
+            mail_queue.mail_add('storyboard@example.org',
+                                [recipient + '@example.com'],
+                                'example.com', 'A message')
+        session = db_api.get_session(in_request=False)
+        with session.begin():
+            broken = self._entries()[0]
+            session.query(models.MailQueue) \
+                .filter_by(id=broken.id) \
+                .update({'recipients': 'not json'})
+
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        self.assertEqual(2, mail_sender.send_batch())
+        self.assertEqual(1, self.smtp.return_value.sendmail.call_count)
+
+        entries = self._entries()
+        self.assertEqual(1, len(entries))
+        self.assertEqual(broken.id, entries[0].id)
+        self.assertIsNotNone(entries[0].dead_at)
+        self.assertEqual(0, mail_sender.send_batch())
+
+
+class TestMailSender(db_base.BaseDbTestCase):
+
+    def test_retry_delay(self):
+        self.config(spool_retry_delay=60, spool_retry_max_delay=300,
+                    group='plugin_email')
+        mail_sender = sender.MailSender(CONF.plugin_email)
+        self.assertEqual(60, mail_sender.retry_delay(1))
+        self.assertEqual(120, mail_sender.retry_delay(2))
+        self.assertEqual(300, mail_sender.retry_delay(4))
+
+    def test_is_permanent(self):
+        self.assertTrue(sender.is_permanent(
+            smtplib.SMTPDataError(554, 'Rejected')))
+        self.assertFalse(sender.is_permanent(
+            smtplib.SMTPDataError(451, 'Try again')))
+        self.assertFalse(sender.is_permanent(smtplib.SMTPRecipientsRefused(
+            {'a@example.com': (550, 'No'), 'b@example.com': (450, 'Busy')})))
+        self.assertFalse(sender.is_permanent(
+            smtplib.SMTPServerDisconnected()))
+
+    def test_domain_rate_limiter(self):
+        limiter = sender.DomainRateLimiter(60)
+        with mock.patch('time.time', return_value=1000.0):
+            for _ in range(60):
+                self.assertEqual(0, limiter.acquire('example.com'))
+            self.assertAlmostEqual(1.0, limiter.acquire('example.com'))
+            self.assertEqual(0, limiter.acquire('example.net'))
+        with mock.patch('time.time', return_value=1001.0):
+            self.assertEqual(0, limiter.acquire('example.com'))
+
+        unlimited = sender.DomainRateLimiter(0)
+        for _ in range(100):
+            self.assertEqual(0, unlimited.acquire('example.com'))
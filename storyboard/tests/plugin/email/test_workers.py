@@ -13,16 +13,21 @@
 # limitations under the License.
 
 import copy
+import json
 import mock
 import six
 import smtplib
 
 from oslo_config import cfg
 
+from storyboard.common import event_types
 import storyboard.db.api.base as db_api_base
 import storyboard.db.models as models
+from storyboard.plugin.email.factory import EmailFactory
+from storyboard.plugin.email.factory import get_template_matrix
 from storyboard.plugin.email.workers import EmailWorkerBase
 from storyboard.plugin.email.workers import SubscriptionEmailWorker
+from storyboard.plugin.event_context import EventContext
 from storyboard.tests import base
 
 
@@ -132,9 +137,21 @@ class TestEmailWorkerBase(base.FunctionalTest):
         self.assertEqual('value', before['before_only'])
         self.assertEqual(None, after['before_only'])
 
+    def test_get_changed_properties_diff_only(self):
+        """Only the sent fields are compared with the full resource."""
+        worker_base = MockEmailWorkerBase({})
+        context = EventContext(diff_only=True)
+
+        before, after = worker_base.get_changed_properties(
+            {'id': 1, 'story_id': 2, 'title': 'Old'},
+            {'id': 1, 'story_id': 2, 'title': 'New', 'status': 'todo'},
+            context=context)
+        self.assertEqual({'title': 'Old'}, before)
+        self.assertEqual({'title': 'New'}, after)
+
 
 class TestSubscriptionEmailWorker(base.FunctionalTest):
-    @mock.patch('storyboard.plugin.email.smtp_client.get_smtp_client')
+    @mock.patch('storyboard.plugin.email.smtp_client.get_pooled_smtp_client')
     def test_handle_email(self, get_smtp_client):
         """Make sure that events from the queue are sent as emails."""
         dummy_smtp = mock.Mock(smtplib.SMTP)
@@ -174,6 +191,74 @@ class TestSubscriptionEmailWorker(base.FunctionalTest):
                 dummy_smtp.return_value.sendmail.call_args[1]['to_addrs'],
                 subscribed_user.email)
 
+    @mock.patch('storyboard.plugin.email.smtp_client.get_pooled_smtp_client')
+    def test_handle_email_diff_only(self, get_smtp_client):
+        """Events with only the changed fields are completed from the
+        database before they are rendered.
+        """
+        dummy_smtp = mock.Mock(smtplib.SMTP)
+        worker_base = SubscriptionEmailWorker({})
+        get_smtp_client.return_value.__enter__ = dummy_smtp
+
+        before = {'id': 1, 'title': 'Old Title'}
+        after = {'id': 1, 'title': 'Test story'}
+        context = EventContext(resource='story', resource_id=1,
+                               resource_before=before, resource_after=after,
+                               diff_only=True)
+
+        with base.HybridSessionManager():
+            session = db_api_base.get_session()
+            author = db_api_base.entity_get(models.User, 2, session=session)
+            subscribers = worker_base.get_subscribers(session, 'story', 1)
+
+            with mock.patch.object(context, 'full_state',
+                                   wraps=context.full_state) as full_state, \
+                    mock.patch('storyboard.plugin.email.factory.EmailFactory'
+                               '.render') as render:
+                worker_base.handle_email(session=session,
+                                         author=author,
+                                         subscribers=subscribers,
+                                         method='PUT',
+                                         url='http://localhost/',
+                                         path='/stories/1',
+                                         query_string='',
+                                         status=200,
+                                         resource='story',
+                                         resource_id=1,
+                                         resource_before=before,
+                                         resource_after=after,
+                                         context=context)
+            self.assertTrue(full_state.called)
+            kwargs = render.call_args[1]
+            self.assertEqual({'title': 'Old Title'}, kwargs['before'])
+            self.assertEqual(1, len(kwargs['after']))
+
+    def test_send(self):
+        """Make sure that emails are sent to several recipients at once,
+        when that's allowed.
+        """
+        worker_base = SubscriptionEmailWorker({})
+        smtp_client = mock.Mock(smtplib.SMTP)
+        email = mock.Mock(sender='sender@example.org')
+        email.for_recipient.side_effect = lambda address: address
+        email.for_recipients.return_value = 'undisclosed'
+        addresses = ['a@example.org', 'b@example.org', 'c@example.org']
+
+        worker_base.send(smtp_client, email, addresses)
+        self.assertEqual(addresses,
+                         [call[1]['msg'] for call in
+                          smtp_client.sendmail.call_args_list])
+
+        smtp_client.reset_mock()
+        CONF.set_override('smtp_recipients_per_message', 2, 'plugin_email')
+        self.addCleanup(CONF.clear_override, 'smtp_recipients_per_message',
+                        'plugin_email')
+        worker_base.send(smtp_client, email, addresses)
+        self.assertEqual([(['a@example.org', 'b@example.org'], 'undisclosed'),
+                          ('c@example.org', 'c@example.org')],
+                         [(call[1]['to_addrs'], call[1]['msg']) for call in
+                          smtp_client.sendmail.call_args_list])
+
     def test_get_templates(self):
         """Make sure the get_templates method behaves as expected."""
         worker_base = SubscriptionEmailWorker({})
@@ -194,6 +279,70 @@ class TestSubscriptionEmailWorker(base.FunctionalTest):
         self.assertEqual('story/f/POST.txt', txt)
         self.assertEqual('story/f/POST.html', html)
 
+    def test_handle_batch_event(self):
+        """Make sure that a batch of card changes in a worklist is rendered
+        with the templates which list all of them.
+        """
+        worker_base = MockEmailWorkerBase({})
+        event_info = {
+            'added': [{'worklist_id': 1, 'item_id': 1, 'item_type': 'story',
+                       'item_title': 'Added story', 'position': 0}],
+            'removed': [{'worklist_id': 1, 'item_id': 2, 'item_type': 'task',
+                         'item_title': 'Archived task'}],
+            'updated': [{
+                'old': {'worklist_id': 2, 'item_id': 3, 'item_type': 'story',
+                        'item_title': 'Moved story', 'position': 4},
+                'new': {'worklist_id': 1, 'item_id': 3, 'item_type': 'story',
+                        'item_title': 'Moved story', 'position': 1}
+            }]
+        }
+        event = {
+            'id': 1,
+            'worklist_id': 1,
+            'event_type': event_types.WORKLIST_CONTENTS_BATCH_CHANGED,
+            'event_info': json.dumps(event_info)
+        }
+
+        with base.HybridSessionManager():
+            session = db_api_base.get_session()
+            author = db_api_base.entity_get(models.User, 2, session=session)
+
+            with mock.patch.object(worker_base, 'get_subscribers',
+                                   return_value=[author]):
+                worker_base.handle(session=session,
+                                   author=author,
+                                   method='POST',
+                                   url='http://localhost/',
+                                   path='/worklists/1/items',
+                                   query_string='',
+                                   status=200,
+                                   resource='timeline_event',
+                                   resource_id=1,
+                                   resource_after=event)
+
+            values = worker_base.handled_values
+            self.assertEqual('worklist', values['resource'])
+            self.assertEqual('item_batch', values['sub_resource'])
+            self.assertEqual('PUT', values['method'])
+
+            subject, text, _html = get_template_matrix()[
+                (values['resource'], values['sub_resource'], values['method'])]
+            factory = EmailFactory(sender='test@example.org',
+                                   subject=subject,
+                                   text_template=text)
+            body = factory.template_cache['plain'].render(
+                author=author,
+                resource=mock.Mock(title='Test worklist'),
+                before=None,
+                after=values['resource_after'])
+
+        self.assertIn('Test worklist', body)
+        self.assertIn('Added story 1: Added story', body)
+        self.assertIn('Archived task 2: Archived task', body)
+        self.assertIn('Moved story 3: Moved story', body)
+        self.assertIn('Position: 5 ---> 2', body)
+        self.assertIn('From worklist 2', body)
+
 
 class MockEmailWorkerBase(EmailWorkerBase):
     """Mock instantiation of the abstract base class."""
@@ -0,0 +1,101 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from datetime import datetime
+from datetime import timedelta
+import json
+
+from oslo_config import cfg
+import pytz
+
+import storyboard.db.api.base as db_api
+from storyboard.db.api import subscription_events as events_api
+from storyboard.db.models import SubscriptionEvents
+from storyboard.plugin.subscription_cleaner.cleaner import \
+    SubscriptionEventCleaner
+import storyboard.tests.db.base as db_base
+from storyboard.tests.mock_data import load_data
+
+
+CONF = cfg.CONF
+
+
+class TestSubscriptionEventCleaner(db_base.BaseDbTestCase):
+    """Test cases for the subscription event cleaner plugin."""
+
+    def setUp(self):
+        super(TestSubscriptionEventCleaner, self).setUp()
+        self.config(enable=True, max_age=30, compact_after=48,
+                    chunk_size=2, group='plugin_subscription_cleaner')
+
+    def _add(self, subscriber_id, event_type, story_id, days_old):
+        load_data([SubscriptionEvents(
+            subscriber_id=subscriber_id,
+            author_id=1,
+            event_type=event_type,
+            event_info=json.dumps({'story_id': story_id}),
+            created_at=datetime.now(pytz.utc) - timedelta(days=days_old))])
+
+    def _events(self):
+        events = db_api.model_query(SubscriptionEvents) \
+            .order_by(SubscriptionEvents.id).all()
+        return [(e.subscriber_id, e.event_type, json.loads(e.event_info))
+                for e in events]
+
+    def test_enabled(self):
+        self.assertTrue(SubscriptionEventCleaner(CONF).enabled())
+        self.config(enable=False, group='plugin_subscription_cleaner')
+        self.assertFalse(SubscriptionEventCleaner(CONF).enabled())
+
+    def test_trigger(self):
+        """Assert that this plugin runs every hour."""
+        plugin = SubscriptionEventCleaner(CONF)
+        self.assertEqual(3600, plugin.trigger().interval_length)
+
+    def test_run(self):
+        """Assert that old events are removed, and that repeated events
+        are merged once they are old enough.
+        """
+        for days_old in (40, 35):
+            self._add(1, 'task_status_changed', 1, days_old)
+        for days_old in (10, 9, 8):
+            self._add(1, 'task_status_changed', 1, days_old)
+        self._add(1, 'task_status_changed', 2, 7)
+        self._add(1, 'user_comment', 1, 6)
+        self._add(1, 'user_comment', 1, 6)
+        self._add(2, 'task_status_changed', 1, 5)
+        # Too new to merge.
+        self._add(1, 'task_status_changed', 1, 1)
+        self._add(1, 'task_status_changed', 1, 0)
+        self.assertEqual(
+            10, events_api.subscription_events_get_unread(1).unread_count)
+
+        SubscriptionEventCleaner(CONF).run()
+        self.assertEqual([
+            (1, 'task_status_changed', {'story_id': 1, 'compacted': 3}),
+            (1, 'task_status_changed', {'story_id': 2}),
+            (1, 'user_comment', {'story_id': 1}),
+            (1, 'user_comment', {'story_id': 1}),
+            (2, 'task_status_changed', {'story_id': 1}),
+            (1, 'task_status_changed', {'story_id': 1}),
+            (1, 'task_status_changed', {'story_id': 1})
+        ], self._events())
+        self.assertEqual(
+            6, events_api.subscription_events_get_unread(1).unread_count)
+
+        # Merged events are merged again with later ones.
+        self._add(1, 'task_status_changed', 1, 3)
+        SubscriptionEventCleaner(CONF).run()
+        self.assertEqual(
+            (1, 'task_status_changed', {'story_id': 1, 'compacted': 4}),
+            self._events()[-1])
+        self.assertEqual(7, len(self._events()))
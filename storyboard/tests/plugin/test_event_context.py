@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from mock import patch
+
+import storyboard.db.api.base as db_api_base
+from storyboard.plugin import event_context
+from storyboard.plugin.event_context import EventContext
+import storyboard.tests.base as base
+
+
+class TestEventContext(base.FunctionalTest):
+
+    def test_affected_ids(self):
+        context = EventContext(resource='story', resource_id=3)
+        self.assertEqual(3, context.story_id)
+        self.assertIsNone(context.worklist_id)
+
+        context = EventContext(resource='timeline_event', resource_id=10,
+                               resource_after={'story_id': None,
+                                               'worklist_id': 2})
+        self.assertIsNone(context.story_id)
+        self.assertEqual(2, context.worklist_id)
+
+        context = EventContext(resource='task', resource_id=1,
+                               resource_before={'story_id': 4})
+        self.assertEqual(4, context.story_id)
+
+    def test_resolve_once_per_session(self):
+        context = EventContext(author_id=1)
+
+        with base.HybridSessionManager():
+            session = db_api_base.get_session()
+            author = context.author(session)
+            self.assertEqual(1, author.id)
+
+            with patch.object(event_context.db_api, 'entity_get') as get:
+                self.assertIs(author, context.author(session))
+                self.assertIs(author, context.resolve(session, 'user', 1))
+                self.assertFalse(get.called)
+
+                context.resolve(db_api_base.get_session(), 'user', 1)
+                self.assertEqual(1, get.call_count)
+
+            self.assertIsNone(context.resolve(session, 'foo', 1))
+
+    def test_shared_values(self):
+        """Subscribers and preferences are only looked up once."""
+        context = EventContext(resource='story', resource_id=1)
+
+        with base.HybridSessionManager():
+            session = db_api_base.get_session()
+            with patch.object(event_context.sub_api,
+                              'subscription_get_all_subscriber_ids',
+                              return_value=set([1, 3])) as get_ids:
+                for _i in range(2):
+                    self.assertEqual(set([1, 3]), context.subscriber_ids(
+                        session, 'story', 1))
+                self.assertEqual(1, get_ids.call_count)
+
+            user = context.resolve(session, 'user', 1)
+            self.assertEqual('bar', context.preference(user, 'foo'))
+            self.assertIsNone(context.preference(user, 'no_value'))
+
+    def test_full_state(self):
+        """Slim payloads are completed from the database when needed."""
+        after = {'id': 1, 'title': 'New title'}
+        context = EventContext(resource='story', resource_id=1,
+                               resource_after=after)
+        self.assertIs(after, context.full_state(None))
+
+        context = EventContext(resource='story', resource_id=1,
+                               resource_after=after, diff_only=True)
+        with base.HybridSessionManager():
+            session = db_api_base.get_session()
+            state = context.full_state(session)
+            self.assertEqual(1, state['id'])
+            self.assertIn('description', state)
@@ -12,7 +12,15 @@
 # implied. See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import time
+
+import fixtures
+from mock import Mock
+from mock import patch
+
 import storyboard.db.api.base as db_api_base
+from storyboard.notifications import metrics
 import storyboard.plugin.event_worker as plugin_base
 import storyboard.tests.base as base
 
@@ -63,12 +71,86 @@ class TestWorkerTaskBase(base.FunctionalTest):
             self.assertIsNotNone(milestone)
             self.assertEqual(1, milestone.id)
 
+    def test_event_without_context(self):
+        """Plugins whose handle method doesn't take an EventContext are
+        still given events.
+        """
+        worker = TestLegacyWorkerPlugin({})
+
+        with base.HybridSessionManager():
+            result = worker.event(author_id=1, method='PUT', url=None,
+                                  path='/v1/stories/1', query_string=None,
+                                  status=200, resource='story',
+                                  resource_id=1)
+        self.assertEqual(('story', 1, 1), result)
+
+
+class TestDaemonManager(base.TestCase):
+
+    @patch.object(plugin_base, 'Process')
+    def test_sharded_restart(self, mock_process):
+        """A restarted process takes over the shard of the one it replaces.
+        """
+        mock_process.side_effect = \
+            lambda target, args, kwargs: Mock(args=args)
+        manager = plugin_base.DaemonManager(child_process_count=3,
+                                            daemon_method=Mock(),
+                                            sharded=True)
+        for i in range(3):
+            manager._add_process(i)
+
+        dead = manager._procs[1]
+        dead.is_alive.return_value = False
+        dead.exitcode = 1
+        manager._health_check()
+
+        self.assertEqual([(0,), (2,), (1,)],
+                         [process.args for process in manager._procs])
+
+    def test_metrics(self):
+        """The metrics of every child process are added up and written,
+        including those of processes which have died.
+        """
+        metrics_file = os.path.join(self.useFixture(
+            fixtures.TempDir()).path, 'storyboard.prom')
+        manager = plugin_base.DaemonManager(child_process_count=2,
+                                            daemon_method=Mock(),
+                                            metrics_file=metrics_file)
+        self.addCleanup(manager._metrics_queue.close)
+
+        one = metrics.WorkerMetrics()
+        one.record_event()
+        manager._metrics_queue.put(('one', one.snapshot()))
+        one.record_event()
+        manager._metrics_queue.put(('one', one.snapshot()))
+        manager._metrics_queue.put(('two', one.snapshot()))
+
+        # Give the queue's feeder thread a moment.
+        for _i in range(50):
+            manager._collect_metrics(force=True)
+            if len(manager._snapshots) == 2:
+                break
+            time.sleep(0.1)
+
+        with open(metrics_file) as f:
+            self.assertIn('storyboard_worker_events_total 4\n', f.read())
+
 
 class TestWorkerPlugin(plugin_base.WorkerTaskBase):
     def handle(self, session, author, method, url, path, query_string, status,
                resource, resource_id, sub_resource=None, sub_resource_id=None,
-               resource_before=None, resource_after=None):
+               resource_before=None, resource_after=None, context=None):
         pass
 
     def enabled(self):
         return True
+
+
+class TestLegacyWorkerPlugin(plugin_base.WorkerTaskBase):
+    def handle(self, session, author, method, url, path, query_string, status,
+               resource, resource_id, sub_resource=None, sub_resource_id=None,
+               resource_before=None, resource_after=None):
+        return resource, resource_id, author.id
+
+    def enabled(self):
+        return True